@@ -0,0 +1,79 @@
+# bench_actors.py
+# Times Scene.npcAt with the spatial index against the old linear scan, with
+# N npcs spread over a 100x100 tile map and the party walking around.
+#
+# usage (from the benchmarks directory): python bench_actors.py [N...]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import random
+import time
+from cStringIO import StringIO
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.display.set_mode((800,600))
+pygame.font.init()
+
+import configuration
+from characters import Actor
+from scene import Scene
+
+DefaultCounts = [10, 100, 1000]
+Queries = 20000
+Moves = 2000
+
+class Engine(object):
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+        self.font = pygame.font.Font(None, 20)
+
+def linearNpcAt(scene, collisionPoint):
+    "Scene.npcAt as it was before the spatial index"
+    cx, cy = collisionPoint
+    for npc in scene.actors:
+        r = npc.getRect()
+        if r[0] <= cx and r[0]+r[2] >= cx and r[1] <= cy and r[1]+r[3] >= cy: return npc
+    return None
+
+def run(scene, count):
+    rnd = random.Random(count)
+    for actor in list(scene.actors): scene.removeActorFromScene(actor)
+    for i in xrange(count):
+        npc = Actor(scene, configuration.default_actor_spriteset)
+        npc.px, npc.py = rnd.randrange(scene.widthInPixels), rnd.randrange(scene.heightInPixels)
+        scene.addActorToScene(npc)
+
+    points = [(rnd.randrange(scene.widthInPixels), rnd.randrange(scene.heightInPixels)) for i in xrange(Queries)]
+
+    t = time.time()
+    linear = [linearNpcAt(scene, p) for p in points]
+    linearTime = time.time() - t
+
+    t = time.time()
+    indexed = [scene.npcAt(p) for p in points]
+    indexedTime = time.time() - t
+    assert linear == indexed
+
+    # npcs wandering keep the index up to date as they go
+    t = time.time()
+    for i in xrange(Moves): scene.actors[i % count].move((rnd.randint(-3, 3), rnd.randint(-3, 3)))
+    moveTime = time.time() - t
+
+    return linearTime / Queries * 1e6, indexedTime / Queries * 1e6, moveTime / Moves * 1e6
+
+if __name__ == '__main__':
+    counts = [int(a) for a in sys.argv[1:]] or DefaultCounts
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        scene = Scene(Engine())
+        scene.initScene()
+        results = [(count,) + run(scene, count) for count in counts]
+    finally: sys.stdout = stdout
+
+    print "%6s %16s %16s %16s" % ("npcs", "linear (us)", "indexed (us)", "move (us)")
+    for r in results: print "%6d %16.2f %16.2f %16.2f" % r
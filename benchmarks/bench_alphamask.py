@@ -0,0 +1,87 @@
+# bench_alphamask.py
+# Times TileFactory loading a 500 tile tileset with the per-pixel blended
+# alpha mask functions against the NumPy ones, and checks that both produce
+# the same tiles.
+#
+# usage (from the benchmarks directory): python bench_alphamask.py [tiles]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import tempfile
+import time
+from cStringIO import StringIO
+from zipfile import ZipFile, ZIP_DEFLATED
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.display.set_mode((800,600))
+
+import configuration
+import dataset
+import imageutil
+import tiles
+
+DefaultTiles = 500
+
+def makeTileset(count):
+    """Writes a temporary tilesets zip holding a "bench" set of count regular
+    tiles, made by tinting the tiles of the default set. Returns its path.
+    """
+    src = ZipFile(configuration.tilesets)
+    images = []
+    for name in dataset.splitSets(src.namelist())[configuration.default_tileset]:
+        img = pygame.image.load(StringIO(src.read(name)))
+        if img.get_size() == (configuration.default_tile_width, configuration.default_tile_height): images.append(img)
+    src.close()
+
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    z = ZipFile(path, 'w', ZIP_DEFLATED)
+    for i in xrange(count):
+        img = images[i % len(images)].copy()
+        img.fill((i % 7 * 8, i % 5 * 8, i % 3 * 8), None, pygame.BLEND_ADD)
+        fd, png = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        pygame.image.save(img, png)
+        z.write(png, 'bench/tile%03d.png' % i)
+        os.remove(png)
+    z.writestr('bench/base.png', z.read('bench/tile000.png'))
+    z.writestr('bench/generic_container.png', z.read('bench/tile001.png'))
+    z.close()
+    return path
+
+def loadTileset(horizontal, vertical):
+    imageutil.createHorizontalBlendedAlphaMask = horizontal
+    imageutil.createVerticalBlendedAlphaMask = vertical
+    t = time.time()
+    tf = tiles.TileFactory('bench', configuration.default_tile_width, configuration.default_tile_height)
+    return time.time() - t, tf
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultTiles
+    configuration.tilesets = makeTileset(count)
+    configuration.tileset_cache = False
+
+    # TileFactory is chatty
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        fast = (imageutil.createHorizontalBlendedAlphaMask, imageutil.createVerticalBlendedAlphaMask)
+        slow = (imageutil.perPixelHorizontalBlendedAlphaMask, imageutil.perPixelVerticalBlendedAlphaMask)
+        slowTime, slowTf = loadTileset(*slow)
+        fastTime, fastTf = loadTileset(*fast)
+    finally:
+        sys.stdout = stdout
+        os.remove(configuration.tilesets)
+
+    same = len(slowTf.tiles) == len(fastTf.tiles) and \
+        all(pygame.image.tostring(a, 'RGBA') == pygame.image.tostring(b, 'RGBA') for a, b in zip(slowTf.tiles, fastTf.tiles))
+
+    print "tileset of %d tiles (%d tile surfaces incl. blends)" % (count, len(fastTf.tiles))
+    print "per-pixel: %8.3f s" % slowTime
+    print "numpy:     %8.3f s" % fastTime
+    print "speedup:   %8.1fx" % (slowTime / fastTime)
+    print "identical output: %s" % same
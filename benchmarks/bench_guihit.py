@@ -0,0 +1,72 @@
+# bench_guihit.py
+# Dispatches mouse motion events over a TileSelector-like palette of image
+# buttons, once testing every button as Control.controlsAt used to and once
+# through the spatial hit-testing index.
+#
+# usage (from the benchmarks directory): python bench_guihit.py [buttons] [events]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import random
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((1024,768))
+
+import gui
+
+DefaultButtons = 2000
+DefaultEvents = 10000
+TileSize = 32
+
+class LinearApplication(gui.Application):
+    "Tests every child for every event, the way controlsAt did before the index"
+    def controlsAt(self, event):
+        return [i for i in self.children if self.isMouseOver(event, i)]
+
+def buildPalette(appClass, buttons):
+    app = appClass(backgroundColor=(200,200,200))
+    image = pygame.Surface((TileSize, TileSize)).convert_alpha()
+    perRow = app.width / (TileSize + 2)
+    for t in xrange(buttons):
+        button = gui.ImageButton(parent=app, pos=(2 + (t % perRow) * (TileSize + 2), 2 + (t / perRow) * (TileSize + 2)),
+                                 image=image, width=TileSize, height=TileSize)
+        button.borderWidth = 0
+        button.backgroundColor = (0,0,0,0)
+        app.add(button)
+    return app
+
+def dispatch(app, events):
+    hovered = []
+    t = time.time()
+    for e in events:
+        app.mouseMotion(e)
+        hovered.append(tuple(c.tileIndex for c in app.mouseOverControls))
+    return time.time() - t, hovered
+
+if __name__ == '__main__':
+    buttons = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultButtons
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else DefaultEvents
+
+    rnd = random.Random(0)
+    height = (buttons / (1024 / (TileSize + 2)) + 1) * (TileSize + 2)
+    events = [pygame.event.Event(pygame.MOUSEMOTION, pos=(rnd.randrange(1024), rnd.randrange(height)), rel=(0,0), buttons=(0,0,0))
+              for i in xrange(count)]
+
+    results = {}
+    for name, appClass in (("linear", LinearApplication), ("indexed", gui.Application)):
+        app = buildPalette(appClass, buttons)
+        for i, c in enumerate(app.children): c.tileIndex = i
+        results[name] = dispatch(app, events)
+
+    assert results["linear"][1] == results["indexed"][1]
+    print "%d motion events over %d buttons" % (count, buttons)
+    for name in ("linear", "indexed"):
+        elapsed = results[name][0]
+        print "%8s: %7.3f s (%6.1f us/event)" % (name, elapsed, elapsed / count * 1e6)
@@ -0,0 +1,79 @@
+# bench_listbox.py
+# Fills a ListBox with a merchant's worth of item labels and scrolls through
+# it with the mouse wheel, once the way ListBox.add used to work (a row for
+# every entry, all of them laid out again after each one) and once through
+# the virtualized list that only makes rows for the entries in view.
+#
+# usage (from the benchmarks directory): python bench_listbox.py [entries] [scrolls]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((1024,768))
+
+import gui
+
+DefaultEntries = 10000
+DefaultScrolls = 200
+# the old list lays out every row on every add, so it only gets this many
+EagerEntries = 1000
+
+class EagerListBox(gui.ListBox):
+    "Makes and lays out a row for every entry, the way ListBox.add used to"
+
+    def extend(self, entries):
+        for entry in entries:
+            control = self.rowFactory(entry)
+            c = gui.BorderedControl(parent=self, borderWidth=0)
+            c.x = self.xpadding
+            c.width = self.width - self.xpadding*2
+            c.height = control.height + self.ypadding*2
+            c.borderRenderer.backgroundColor = self.evenColor if len(self.children) % 2 == 0 else self.oddColor
+            control.x, control.y = self.xpadding, self.ypadding
+            c.add(control)
+            gui.BorderedControl.add(self, c)
+            y = self.borderRenderer.borderWidth
+            for c in self.children:
+                c.y = y
+                y += c.height
+
+    def scrollBy(self, dy):
+        for c in self.children: c.yOffset -= dy
+
+def createRow(entry): return gui.Label(text="Item #%d" % entry, fontColor=(0,0,0))
+
+def bench(listClass, entries, scrolls):
+    app = gui.Application(backgroundColor=(200,200,200))
+    listbox = listClass(width=300, height=300, pos=(10,10), rowFactory=createRow)
+    app.add(listbox)
+    buffer = pygame.Surface(pygame.display.get_surface().get_size()).convert_alpha()
+
+    t = time.time()
+    listbox.extend(xrange(entries))
+    app.renderFrame(buffer)
+    fill = time.time() - t
+
+    wheel = pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=5, pos=(50,50))
+    t = time.time()
+    for i in xrange(scrolls):
+        listbox.mouseDown(wheel)
+        app.renderFrame(buffer)
+    scroll = time.time() - t
+    return fill, scroll, len(listbox.children)
+
+if __name__ == '__main__':
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultEntries
+    scrolls = int(sys.argv[2]) if len(sys.argv) > 2 else DefaultScrolls
+
+    for name, listClass, count in (("eager", EagerListBox, min(entries, EagerEntries)), ("virtual", gui.ListBox, entries)):
+        fill, scroll, rows = bench(listClass, count, scrolls)
+        print "%8s: %5d entries filled and drawn in %7.3f s, %d scrolled frames %6.2f ms each (%d rows)" % \
+            (name, count, fill, scrolls, scroll / scrolls * 1000, rows)
@@ -0,0 +1,43 @@
+# bench_loader.py
+# Decodes every image in the tileset and spriteset zips, repeated to stand
+# in for a large data set, once on the calling thread and once on a pool
+# of loader threads of each size given.
+#
+# usage (from the benchmarks directory): python bench_loader.py [repeats] [threads...]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.display.set_mode((1024,768))
+
+import configuration
+import loader
+import vfs
+
+DefaultRepeats = 20
+
+def bench(archives, repeats, threads):
+    configuration.loader_threads = threads
+    if loader._pool: loader._pool.stop()
+    loader._pool = None
+    t = time.time()
+    count = 0
+    for i in xrange(repeats):
+        for archive in archives: count += len(loader.loadImages(archive, archive.namelist()))
+    return time.time() - t, count
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultRepeats
+    threadCounts = [int(n) for n in sys.argv[2:]] or [2, 4, loader.threadCount()]
+
+    archives = [vfs.mount(configuration.tilesets), vfs.mount(configuration.spritesets)]
+    for threads in [1] + sorted(set(threadCounts) - set([1])):
+        elapsed, count = bench(archives, repeats, threads)
+        print "%2d threads: %d images in %6.3f s (%5.2f ms each)" % (threads, count, elapsed, elapsed / count * 1000)
@@ -0,0 +1,55 @@
+# bench_log.py
+# Times a logged debug message with debug logging off, on, and on with the
+# caller recorded, against a print through the old stdout replacement (which
+# walked the stack twice per line), written to a null device.
+#
+# usage (from the benchmarks directory): python bench_log.py [calls]
+#
+
+import sys
+sys.path.append('../components')
+
+import inspect
+import log
+import os
+import time
+import traceback
+
+DefaultCalls = 100000
+
+class DebugPrint(object):
+    "The stdout replacement the engine used to install, without the indent"
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, string):
+        if string == "\n": return
+        spaces = len(traceback.extract_stack())
+        frame = inspect.currentframe().f_back
+        ls = traceback.extract_stack()[-2]
+        self.out.write("%s%s (%s): %s\n" % (" " * spaces, ls[2], frame.f_lineno, string))
+        self.out.flush()
+
+def bench(f, calls):
+    t = time.time()
+    for i in xrange(calls): f(i)
+    return (time.time() - t) / calls * 1000000
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultCalls
+    logger = log.getLogger("bench")
+    def logged(i): logger.debug("cataloging irregular tile %s", i)
+
+    log.setLevel(log.INFO)
+    print "debug off:        %8.3f us per call" % bench(logged, calls)
+    log.setLevel(log.DEBUG)
+    print "debug on:         %8.3f us per call" % bench(logged, calls)
+    log.setCallerInfo(True)
+    print "debug on, caller: %8.3f us per call" % bench(logged, calls)
+
+    out = open(os.devnull, 'w')
+    debugPrint = DebugPrint(out)
+    def printed(i): print >> debugPrint, "cataloging irregular tile %s" % i
+    calls = max(calls / 100, 1)
+    print "DebugPrint:       %8.3f us per call" % bench(printed, calls)
@@ -0,0 +1,65 @@
+# bench_scheduler.py
+# Runs a scene's worth of update steps with thousands of scene scripts
+# scheduled (NPC barks, ambient triggers, every one of them due now and then),
+# once the way Scene.update used to drive them (every SceneScript counting
+# up its own timeout each step) and once through the heap scheduler, which
+# only touches the scripts that are due.
+#
+# usage (from the benchmarks directory): python bench_scheduler.py [scripts] [steps]
+#
+
+import sys
+sys.path.append('../components')
+
+import random
+import time
+
+from scheduler import Scheduler
+
+DefaultScripts = 5000
+DefaultSteps = 900 # 30 seconds of updates at 30 per second
+Step = 1000.0 / 30
+
+class CountingScript(object):
+    "A SceneScript as it used to be: counts up dt every update step"
+
+    def __init__(self, timeout, counter):
+        self.timeout = timeout
+        self.counter = counter
+        self.dt = 0
+
+    def update(self, ticks):
+        self.dt += ticks
+        if self.dt > self.timeout:
+            self.counter[0] += 1
+            self.dt = 0
+
+def timeouts(scripts):
+    random.seed(1)
+    return [random.randint(2000, 60000) for i in xrange(scripts)]
+
+def benchCounting(scripts, steps):
+    counter = [0]
+    pending = [CountingScript(timeout, counter) for timeout in timeouts(scripts)]
+    t = time.time()
+    for i in xrange(steps):
+        for script in pending: script.update(Step)
+    return time.time() - t, counter[0]
+
+def benchScheduler(scripts, steps):
+    counter = [0]
+    def run(): counter[0] += 1
+    scheduler = Scheduler()
+    for timeout in timeouts(scripts): scheduler.schedule(run, timeout, timeout)
+    t = time.time()
+    for i in xrange(steps): scheduler.advance(Step)
+    return time.time() - t, counter[0]
+
+if __name__ == '__main__':
+    scripts = int(sys.argv[1]) if len(sys.argv) > 1 else DefaultScripts
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else DefaultSteps
+
+    for name, bench in (("counting", benchCounting), ("heap", benchScheduler)):
+        elapsed, runs = bench(scripts, steps)
+        print "%9s: %d scripts, %d steps in %6.3f s (%6.3f ms per step), %d runs" % \
+            (name, scripts, steps, elapsed, elapsed / steps * 1000, runs)
@@ -0,0 +1,45 @@
+# bench_spritesets.py
+# Spawns N actors sharing one spriteset, once building a private Spriteset
+# per actor (the old behaviour) and once through characters.spritesets, and
+# reports the time taken and the frame bytes kept alive.
+#
+# usage (from the benchmarks directory): python bench_spritesets.py [N...]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+import pygame
+pygame.display.init()
+pygame.display.set_mode((800,600))
+
+import characters
+import configuration
+from characters import Actor, Spriteset
+
+DefaultCounts = [10, 50, 200]
+
+def spawn(count, shared):
+    name = configuration.default_actor_spriteset
+    t = time.time()
+    if shared: actors = [Actor(None, name) for i in xrange(count)]
+    else: actors = [Actor(None, Spriteset(name)) for i in xrange(count)]
+    elapsed = time.time() - t
+
+    held = {}
+    for a in actors: held[id(a._spriteset)] = a._spriteset.getByteSize()
+    return elapsed, sum(held.values())
+
+if __name__ == '__main__':
+    counts = [int(a) for a in sys.argv[1:]] or DefaultCounts
+    print "%6s %14s %12s %14s %12s" % ("actors", "private (s)", "private MB", "shared (s)", "shared MB")
+    for count in counts:
+        characters.spritesets.clear()
+        privateTime, privateBytes = spawn(count, False)
+        sharedTime, sharedBytes = spawn(count, True)
+        print "%6d %14.3f %12.2f %14.3f %12.2f" % (count, privateTime, privateBytes / 1048576.0, sharedTime, sharedBytes / 1048576.0)
+    print characters.spritesets
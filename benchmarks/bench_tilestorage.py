@@ -0,0 +1,90 @@
+# bench_tilestorage.py
+# Compares the two map storages ('objects': a Tilestack and Tile per cell,
+# 'grid': tiles.TileGrid) at several map sizes. Each measurement runs in its
+# own process so the peak memory figures don't bleed into each other.
+#
+# usage (from the benchmarks directory): python bench_tilestorage.py [sizes...]
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import random
+import resource
+import subprocess
+import time
+
+DefaultSizes = [100, 500, 1000]
+Lookups = 100000
+
+def peakKb(): return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def runCase(storage, size):
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    import pygame
+    pygame.display.init()
+    pygame.display.set_mode((800,600))
+    import configuration
+    from cStringIO import StringIO
+    from tiles import TileFactory, Tile, Tilestack, TileGrid
+    import mapformat
+
+    tf = TileFactory(configuration.default_tileset, 32, 32)
+    base = tf.specialTiles['base']
+    startKb = peakKb()
+
+    t = time.time()
+    if storage == 'grid': stacks = TileGrid(tf, size, size, base)
+    else:
+        stacks = []
+        for i in xrange(size * size):
+            ts = Tilestack()
+            ts.addBaseTile(Tile(tf, base))
+            stacks.append(ts)
+    build = time.time() - t
+    memKb = peakKb() - startKb
+
+    rnd = random.Random(1)
+    cells = [rnd.randrange(size * size) for i in xrange(Lookups)]
+    t = time.time()
+    for i in cells: stacks[i].isWalkable
+    lookup = (time.time() - t) / Lookups * 1e6
+
+    t = time.time()
+    for i in cells[:10000]: stacks[i].addRoofTile(Tile(tf, 3))
+    edit = (time.time() - t) / 10000 * 1e6
+
+    out = StringIO()
+    t = time.time()
+    writer = mapformat.MapWriter(out, tf.tileset, 32, 32, size, size)
+    if storage == 'grid': cells = stacks.cells()
+    else: cells = (ts.toCell() for ts in stacks)
+    for cell in cells: writer.writeCell(*cell)
+    writer.close()
+    save = time.time() - t
+
+    out.seek(0)
+    t = time.time()
+    reader = mapformat.MapReader(out)
+    if storage == 'grid':
+        loaded = TileGrid(tf, size, size)
+        loaded.loadCells(reader.cells())
+    else: loaded = [Tilestack.fromCell(cell, tf) for cell in reader.cells()]
+    load = time.time() - t
+
+    print "%s %d %.3f %d %.2f %.2f %.3f %.3f" % (storage, size, build, memKb, lookup, edit, save, load)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--case':
+        runCase(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+
+    sizes = [int(a) for a in sys.argv[1:]] or DefaultSizes
+    print "%-8s %6s %10s %10s %11s %11s %9s %9s" % ("storage", "size", "build (s)", "mem (MB)", "lookup (us)", "edit (us)", "save (s)", "load (s)")
+    for size in sizes:
+        for storage in ('objects', 'grid'):
+            line = subprocess.Popen([sys.executable, __file__, '--case', storage, str(size)], stdout=subprocess.PIPE).communicate()[0]
+            fields = line.strip().split('\n')[-1].split()
+            storage, size, build, mem, lookup, edit, save, load = fields
+            print "%-8s %6s %10s %10.1f %11s %11s %9s %9s" % (storage, size + "^2", build, int(mem) / 1024.0, lookup, edit, save, load)
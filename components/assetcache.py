@@ -0,0 +1,98 @@
+# assetcache.py
+# A process-wide cache for assets that are expensive to load and safe to share
+# (e.g. Spritesets), reference counted per holder and bounded in bytes.
+#
+
+from collections import OrderedDict
+import weakref
+
+class AssetCache(object):
+    """Loads each asset once and hands the same object to everyone asking for
+    the same key. Every holder that acquires an asset counts as one reference;
+    the reference goes away when the holder releases it or is garbage
+    collected. Assets nobody references stay cached, least recently used
+    first out, for as long as they fit in maxBytes.
+
+    loader(key) builds an asset and sizeOf(asset) tells how many bytes it
+    holds. Cached assets are shared, so callers must not change them.
+    """
+
+    def __init__(self, name, loader, sizeOf, maxBytes):
+        self.name = name
+        self.loader = loader
+        self.sizeOf = sizeOf
+        self.maxBytes = maxBytes
+        self.assets = {}            # key -> (asset, size)
+        self.refs = {}              # key -> {id(holder): weakref to holder}
+        self.unused = OrderedDict() # keys nobody holds, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def __len__(self): return len(self.assets)
+    def __contains__(self, key): return key in self.assets
+
+    def acquire(self, key, holder):
+        """Returns the asset for key, loading it if needed, and counts holder
+        as one of its users.
+        """
+        if key in self.assets:
+            self.hits += 1
+            self.unused.pop(key, None)
+        else:
+            self.misses += 1
+            asset = self.loader(key)
+            size = self.sizeOf(asset)
+            self.assets[key] = (asset, size)
+            self.bytes += size
+            self.refs[key] = {}
+            self._trim()
+
+        holders = self.refs[key]
+        if id(holder) not in holders:
+            holders[id(holder)] = weakref.ref(holder, lambda ref, key=key, hid=id(holder): self._drop(key, hid))
+        return self.assets[key][0]
+
+    def release(self, key, holder):
+        """Tells the cache that holder no longer uses the asset for key."""
+        self._drop(key, id(holder))
+
+    def _drop(self, key, holderId):
+        holders = self.refs.get(key)
+        if holders is None or holderId not in holders: return
+        del holders[holderId]
+        if not holders:
+            self.unused[key] = True
+            self._trim()
+
+    def _trim(self):
+        while self.bytes > self.maxBytes and self.unused:
+            key, _ = self.unused.popitem(last=False)
+            self.bytes -= self.assets.pop(key)[1]
+            del self.refs[key]
+            self.evictions += 1
+
+    def clear(self):
+        """Forgets every asset nobody is holding."""
+        for key in self.unused.keys():
+            self.bytes -= self.assets.pop(key)[1]
+            del self.refs[key]
+            self.evictions += 1
+        self.unused.clear()
+
+    def refCount(self, key): return len(self.refs.get(key, ()))
+
+    def stats(self):
+        """Returns a dict of the cache's counters."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hitRate': float(self.hits) / lookups if lookups else 0.0,
+                'entries': len(self.assets), 'unused': len(self.unused),
+                'bytes': self.bytes, 'maxBytes': self.maxBytes}
+
+    def __repr__(self):
+        s = self.stats()
+        return "%s cache: %d entries (%d unused), %.1f of %.1f MB, %d hits, %d misses (%.0f%%), %d evictions" % \
+            (self.name, s['entries'], s['unused'], s['bytes'] / 1048576.0, s['maxBytes'] / 1048576.0,
+             s['hits'], s['misses'], s['hitRate'] * 100, s['evictions'])
@@ -9,14 +9,17 @@
 #    [x] Review classes included in module for relevance to module
 #
 
-from cStringIO import StringIO
+from assetcache import AssetCache
 from items import Inventory
 from random import randint
-from zipfile import ZipFile
 import configuration
-import dataset
+import loader
+import log
 import os
 import pygame
+import vfs
+
+logger = log.getLogger("characters")
 
 class Spriteset:
     """Spriteset takes care of the loading and organizing of individual frames of animation."""
@@ -26,18 +29,17 @@ class Spriteset:
     def __init__(self, spriteset):
         self.__items = [[],[],[],[]]
         self.spriteset = spriteset
-        z = ZipFile(configuration.spritesets)
-        namelist = z.namelist()
-        spritesets = dataset.splitSets(namelist)
-        for s in spritesets[self.spriteset]:
+        self.frozen = False
+        z = vfs.mount(configuration.spritesets)
+        frames = [s for s in z.sets[self.spriteset] if os.path.split(s)[-1][:1] in ('e', 'n', 's', 'w')]
+        images = loader.loadImages(z, frames)
+        for s in z.sets[self.spriteset]:
             i = os.path.split(s)[-1]
-            if i.startswith('e'): self.__items[Spriteset.EAST].append(pygame.image.load(StringIO(z.read(s))).convert_alpha())
-            elif i.startswith('n'): self.__items[Spriteset.NORTH].append(pygame.image.load(StringIO(z.read(s))).convert_alpha())
-            elif i.startswith('s'): self.__items[Spriteset.SOUTH].append(pygame.image.load(StringIO(z.read(s))).convert_alpha())
-            elif i.startswith('w'): self.__items[Spriteset.WEST].append(pygame.image.load(StringIO(z.read(s))).convert_alpha())
-            else: print 'Skipping invalid sprite file "%s"' % i
-            
-        z.close()
+            if i.startswith('e'): self.__items[Spriteset.EAST].append(images[s])
+            elif i.startswith('n'): self.__items[Spriteset.NORTH].append(images[s])
+            elif i.startswith('s'): self.__items[Spriteset.SOUTH].append(images[s])
+            elif i.startswith('w'): self.__items[Spriteset.WEST].append(images[s])
+            else: logger.warning('Skipping invalid sprite file "%s"', i)
 
     def __repr__(self):
         return "East: %s\nNorth: %s\nSouth: %s\nWest: %s" % (self.__items[Spriteset.EAST], self.__items[Spriteset.NORTH], 
@@ -55,11 +57,13 @@ class Spriteset:
         else: return self.__items[key]
     
     def __setitem__(self, key, value):
+        if self.frozen: raise TypeError, "spriteset %s is shared and cannot be changed" % self.spriteset
         if not key in (Spriteset.EAST, Spriteset.NORTH, Spriteset.SOUTH, Spriteset.WEST):
             raise KeyError, """key must be Spriteset.EAST, Spriteset.NORTH, Spriteset.SOUTH, or Spriteset.WEST"""
         else: self.__items[key] = [value]
 
     def __delitem__(self, key):
+        if self.frozen: raise TypeError, "spriteset %s is shared and cannot be changed" % self.spriteset
         if not key in (Spriteset.EAST, Spriteset.NORTH, Spriteset.SOUTH, Spriteset.WEST):
             raise KeyError, """key must be Spriteset.EAST, Spriteset.NORTH, Spriteset.SOUTH, or Spriteset.WEST"""
         else: del self.__items[key]
@@ -86,13 +90,31 @@ class Spriteset:
             for j in i: mx = max(mx, j.get_height()+2)
         return mx
     
+    def getByteSize(self):
+        """Return the number of bytes held by the frames' pixels."""
+        size = 0
+        for i in self.__items:
+            for j in i: size += j.get_width() * j.get_height() * j.get_bytesize()
+        return size
+    
+    def loadShared(spriteset):
+        """Loader for the spritesets cache: a Spriteset that refuses changes."""
+        ret = Spriteset(spriteset)
+        ret.frozen = True
+        return ret
+    
+    loadShared = staticmethod(loadShared)
+    
+spritesets = AssetCache("Spriteset", Spriteset.loadShared, Spriteset.getByteSize, configuration.spriteset_cache_bytes)
+    
 class Sprite(object):
     """The Sprite class takes care of all the low-level animation functionality."""
     
     def __init__(self, spriteset, xoff=0, yoff=0, direction=Spriteset.EAST):
         object.__init__(self)
         
-        if isinstance(spriteset, str): self._spriteset = Spriteset(spriteset)
+        self.positionListener = None
+        if isinstance(spriteset, str): self._spriteset = spritesets.acquire(spriteset, self)
         elif isinstance(spriteset, Spriteset): self._spriteset = spriteset
         
         # CAUTION: arbitrary magic numbers below!
@@ -116,6 +138,18 @@ class Sprite(object):
         self.image = self._spriteset[self.direction][self._frame]        
         self.update(1)        
         
+    def __get_px(self): return self._px
+    def __set_px(self, px):
+        self._px = px
+        if self.positionListener: self.positionListener(self)
+    px = property(__get_px, __set_px, None, "X pixel coordinate")
+    
+    def __get_py(self): return self._py
+    def __set_py(self, py):
+        self._py = py
+        if self.positionListener: self.positionListener(self)
+    py = property(__get_py, __set_py, None, "Y pixel coordinate")
+    
     def getRect(self):
         """Returns the rect occupied by this sprite based on its current (px,py) and its width x height"""
         return (self.px, self.py, self.width, self.height)
@@ -234,9 +268,11 @@ class Sprite(object):
 
     def changeSpriteset(self, ss):
         """This method will keep all settings for the sprite, but change the spriteset
-        to the newly specified one.
+        to the newly specified one, given either as a Spriteset or by name.
         """
     
+        if self._spriteset.frozen: spritesets.release(self._spriteset.spriteset, self)
+        if isinstance(ss, str): ss = spritesets.acquire(ss, self)
         self._spriteset = ss
         self._tmpBuf = pygame.Surface((self._spriteset.getMaxWidth(), self._spriteset.getMaxHeight())).convert_alpha()
         self.width, self.height = self._tmpBuf.get_size()
@@ -0,0 +1,85 @@
+# codecache.py
+# Compiled content scripts (scene scripts, items and dialogs), so each one is
+# compiled once instead of on every launch and every scene load.
+#
+# Code objects are kept in memory for the session and, when
+# configuration.code_cache is set, marshalled into configuration.cachedir
+# under the script's name and a hash of its source, its name and the
+# interpreter's magic number. A changed script or a different Python simply
+# misses the cache and gets compiled again.
+#
+
+import configuration
+import diskcache
+import hashlib
+import imp
+import log
+import marshal
+import os
+import re
+import types
+
+logger = log.getLogger("codecache")
+
+FormatVersion = 1
+
+_codes = {} # key -> code object
+
+def cleanSource(source):
+    "Normalizes line endings the way exec'd content scripts always have been"
+    source = source.replace('\r', '')
+    if not source.endswith('\n'): source += "\n"
+    return source
+
+def cacheKey(source, filename):
+    h = hashlib.sha1("%s %d %s\0" % (imp.get_magic(), FormatVersion, filename))
+    h.update(source)
+    return h.hexdigest()
+
+def _prefix(filename):
+    return "code-%s-" % re.sub(r'[^\w.]', '_', filename)
+
+def _path(filename, key):
+    return os.path.join(configuration.cachedir, "%s%s.marshal" % (_prefix(filename), key))
+
+def compileSource(source, filename):
+    """Returns the code object for source, which filename names (in
+    tracebacks as well). Raises SyntaxError like compile does.
+    """
+    source = cleanSource(source)
+    key = cacheKey(source, filename)
+    code = _codes.get(key)
+    if code is not None: return code
+
+    path = _path(filename, key)
+    if configuration.code_cache and os.path.exists(path): code = _load(path)
+    if code is None:
+        code = compile(source, filename, 'exec')
+        if configuration.code_cache: _save(path, _prefix(filename), code)
+    _codes[key] = code
+    return code
+
+def _load(path):
+    try:
+        f = open(path, 'rb')
+        try: code = marshal.load(f)
+        finally: f.close()
+    except Exception, e:
+        logger.warning("Ignoring unreadable code cache %s: %s", path, e)
+        return None
+    return code if isinstance(code, types.CodeType) else None
+
+def _save(path, prefix, code):
+    "Writes code to path, replacing the entries for older versions of the same script"
+    diskcache.removeStale(prefix, (".marshal",))
+    diskcache.writeFile(path, lambda f: marshal.dump(code, f))
+
+def definedFunctions(code):
+    """Returns the names of the functions (and classes) the script compiled
+    into code defines, found without running it.
+    """
+    return [c.co_name for c in code.co_consts if isinstance(c, types.CodeType) and not c.co_name.startswith('<')]
+
+def clear():
+    "Forgets the code objects of this session (the ones on disk stay)"
+    _codes.clear()
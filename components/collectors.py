@@ -1,60 +1,84 @@
-import pygame
+import codecache
 import configuration
 import constants
-import os
 import items
+import loader
+import log
 import types
 import gui
-from cStringIO import StringIO
-from zipfile import ZipFile
+import vfs
+
+logger = log.getLogger("collectors")
+
+class DialogHelpers(object):
+    """The helper functions of every dialog, passed to a speak function as its first argument.
+    A dialog that hasn't been spoken yet is run the first time one of its helpers is used."""
+    
+    def __init__(self, collector): self.collector = collector
+    
+    def __getattr__(self, name):
+        func = self.collector.getHelper(name)
+        if func is None: raise AttributeError, "No dialog defines a helper named %s" % name
+        return func
 
 class DialogCollector(object):
     """This class reads the appropriate data directories for actor dialogs. It then stores them by id
-    (based on the directory name) for reference by npc actors.
+    (based on the directory name) for reference by npc actors. A dialog's script is only run the
+    first time an actor speaks it or another dialog calls one of its helpers.
     """
     
     def __init__(self, scene, dialogset):
         self.scene = scene
         self.dialogset = dialogset
-        self.dialogs = {}
-        self.otherFuncs = []
+        self.dialogs = {} # id -> speak function, None until the dialog is first run
+        self.dialogFiles = {} # id -> names of the dialog's files in the dialogs zip
+        self.otherFuncs = {} # name -> helper function of a dialog that has been run
+        self.helperDialogs = None # name -> id of the dialog defining it, found when first needed
         self._loadDialogset()
         
-    def splitSets(self, namelist):
-        sets = {}
-        for name in namelist:
-            set, item = tuple(os.path.split(os.path.split(name)[0]))
-            if not set in sets: sets[set] = {}
-            if not item in sets[set]: sets[set][item] = []
-            sets[set][item].append(name)
-        return sets
-        
     def _loadDialogset(self):       
         """Read the "dialogs" data directory for zip files that contain         
         dialog.py files. Incorporate that into the collection of dialogs.
         """
         
-        z = ZipFile(configuration.dialogs)
-        dialogs = self.splitSets(z.namelist())
+        dialogs = vfs.mount(configuration.dialogs).itemsets
         
         for dialog in dialogs:
             for id in dialogs[dialog]:
-                for dialog_file in dialogs[dialog][id]:
-                    dialog_script = z.read(dialog_file)
-                    speakFunc, otherFuncs = self.getFunctions(z, dialog_file)
-                    self.dialogs[id] = speakFunc
-                    self.otherFuncs += otherFuncs
+                self.dialogs[id] = None
+                self.dialogFiles[id] = dialogs[dialog][id]
+
+    def _loadDialog(self, id):
+        z = vfs.mount(configuration.dialogs)
+        for dialog_file in self.dialogFiles[id]:
+            speakFunc, otherFuncs = self.getFunctions(z, dialog_file)
+            self.dialogs[id] = speakFunc
+            for func in otherFuncs: self.otherFuncs[func.__name__] = func
+            
+    def _findHelpers(self):
+        "Maps each helper function name to its dialog by compiling, but not running, every dialog"
+        self.helperDialogs = {}
+        z = vfs.mount(configuration.dialogs)
+        for id in self.dialogFiles:
+            for dialog_file in self.dialogFiles[id]:
+                for name in codecache.definedFunctions(codecache.compileSource(z.read(dialog_file), dialog_file)):
+                    if name != "speak": self.helperDialogs.setdefault(name, id)
+                    
+    def getHelper(self, name):
+        "Returns the helper function named name, running the dialog defining it if need be, or None"
+        if name not in self.otherFuncs:
+            if self.helperDialogs is None: self._findHelpers()
+            id = self.helperDialogs.get(name)
+            if id is not None and self.dialogs[id] is None: self._loadDialog(id)
+        return self.otherFuncs.get(name)
             
     def getFunctions(self, zipFile, dialog):
-        dialogStr = zipFile.read(dialog)        
-        # clean up the script
-        dialogStr = dialogStr.replace('\r', '') 
-        if not dialogStr.endswith('\n'): dialogStr += "\n"
+        code = codecache.compileSource(zipFile.read(dialog), dialog)
         otherFuncs = []
         speakFunc = None
         locals = {'scene': self.scene, 'engine': self.scene.engine, 'gui': gui}
         globals = {}        
-        exec(dialogStr,locals,globals)
+        exec(code,locals,globals)
         for glbl in globals:
             if type(globals[glbl]) == types.FunctionType:
                 if glbl == "speak": speakFunc = globals[glbl]
@@ -63,34 +87,36 @@ class DialogCollector(object):
         return speakFunc, otherFuncs
     
     def runDialog(self, actor):
-        class otherFuncs: pass
-        for i in self.otherFuncs: setattr(otherFuncs, i.__name__, staticmethod(i))
-        self.dialogs[actor.dialogId](otherFuncs, actor, self.scene)
+        if self.dialogs.get(actor.dialogId) is None and actor.dialogId in self.dialogFiles: self._loadDialog(actor.dialogId)
+        self.dialogs[actor.dialogId](DialogHelpers(self), actor, self.scene)
         
 class ItemCollector(object):
-    "Handles the loading and instancing of items."
+    """Handles the loading and instancing of items. The itemset is read the first time an item
+    is asked for."""
     
     def __init__(self, scene, itemset):
         self.scene = scene
         self.itemset = itemset
-        self.items = {}
-        self.itemDescriptions = {}
-        self._loadItems()
+        self._items = None
+        self._itemDescriptions = {}
         
-    def splitSets(self, namelist):
-        sets = {}
-        for name in namelist:
-            set, item = tuple(os.path.split(os.path.split(name)[0]))
-            if not set in sets: sets[set] = {}
-            if not item in sets[set]: sets[set][item] = []
-            sets[set][item].append(name)
-        return sets
+    def __get_items(self):
+        if self._items is None: self._loadItems()
+        return self._items
+    items = property(__get_items, None, None, "The master copy of every item in the itemset, by name")
+
+    def __get_itemDescriptions(self):
+        if self._items is None: self._loadItems()
+        return self._itemDescriptions
+    itemDescriptions = property(__get_itemDescriptions, None, None, "Item descriptions by item name")
         
     def _loadItems(self):
         "Read the itemset zip file for item zips, creating Item objects along the way."
-        print "loading itemset: %s" % self.itemset
-        z = ZipFile(configuration.items)
-        itemsets = self.splitSets(z.namelist())
+        logger.info("loading itemset: %s", self.itemset)
+        self._items = {}
+        z = vfs.mount(configuration.items)
+        itemsets = z.itemsets
+        images = loader.loadImages(z, [name for names in itemsets[self.itemset].itervalues() for name in names if name.endswith('.png')])
         
         for itemset in itemsets[self.itemset]:
             item_filenames = itemsets[self.itemset][itemset]
@@ -98,26 +124,20 @@ class ItemCollector(object):
             for item_filename in item_filenames:
                 if item_filename.endswith('.py'): 
                     script = z.read(item_filename)
-                    self._setItemData(item, script)
+                    self._setItemData(item, script, item_filename)
                 elif item_filename.endswith('.png'):
-                    item.image = pygame.image.load(StringIO(z.read(item_filename))).convert_alpha()                
+                    item.image = images[item_filename]
                 else:
-                    print 'Skipping unknown filetype "%s"' % item_filename
+                    logger.warning('Skipping unknown filetype "%s"', item_filename)
                     continue
                     
-            print "Created item: %s" % item.name
-            self.items[item.name] = item
-        
-        z.close()
+            logger.debug("Created item: %s", item.name)
+            self._items[item.name] = item
                 
-    def _setItemData(self, item, script):
-        # clean up the script 
-        script = script.replace('\r', '') 
-        if not script.endswith('\n'): script = script+"\n"
-
+    def _setItemData(self, item, script, filename="<item>"):
         l = {'EquipTypes': constants.EquipTypes, 'JobTypes': constants.JobTypes, 'EquipLocation': constants.EquipLocation}
         g = {}        
-        exec(script,l,g)
+        exec(codecache.compileSource(script, filename),l,g)
         for t in g:
             i = t.lower()
             if type(g[t]) == types.FunctionType: item.events[t] = g[t]
@@ -130,8 +150,8 @@ class ItemCollector(object):
             elif i == "attack_bonus" or i == "attackbonus": item.attackBonus = g[t]
             elif i == "defense": item.defense = g[t]
             elif i == "defense_bonus" or i == "defensebonus": item.defenseBonus = g[t]
-            elif i == "description" or i == "desc": self.itemDescriptions[item.name] = g[t]
-            else: print "Skipping %s: %s" % (type(g[t]), i)
+            elif i == "description" or i == "desc": self._itemDescriptions[item.name] = g[t]
+            else: logger.debug("Skipping %s: %s", type(g[t]), i)
                         
     def createItem(self, character, itemName):
         """Creates a new copy of the specified item by replicating the "master" version created
@@ -16,6 +16,7 @@ itemdir = os.path.join(datadir, 'items')
 fontdir = os.path.join(datadir, 'fonts')
 regfont = os.path.join(fontdir, 'Vera.ttf')
 monofont = os.path.join(fontdir, 'VeraMono.ttf')
+cachedir = os.path.join(datadir, 'cache')
 
 spritesets = os.path.join(datadir, 'spritesets.zip')
 tilesets = os.path.join(datadir, 'tilesets.zip')
@@ -30,6 +31,73 @@ default_height_in_tiles = 100
 default_tile_width = 32
 default_tile_height = 32
 
+# 'grid' keeps the map in typed arrays (tiles.TileGrid), 'objects' in one
+# Tilestack object per cell
+tile_storage = 'grid'
+
+# the map is pre-rendered in square chunks of tile_chunk_size tiles; at most
+# tile_chunk_cache_limit chunks keep their off-screen surfaces at any one time
+tile_chunk_size = 16
+tile_chunk_cache_limit = 48
+
+# when True the engine only redraws and pushes to the display the parts of the
+# screen that changed each frame (and nothing at all while the scene is idle)
+dirty_rect_rendering = False
+
+# the game logic (movement, animation, scripts) always advances in fixed steps
+# of 1/update_rate seconds, catching up at most max_update_steps per frame;
+# frames are drawn at up to max_render_fps (0 for no limit), with actors and
+# the viewport interpolated between the last two steps
+update_rate = 30
+max_update_steps = 5
+max_render_fps = 60
+
+# at most this many scene scripts (addScript timers) run in one update step,
+# the rest run first thing in the next one (0 for no limit)
+max_scene_scripts_per_update = 64
+
+# keep processed tilesets (blends, irregular tile slices) in cachedir so that
+# later launches can skip decoding them
+tileset_cache = True
+
+# keep the compiled scene scripts, items and dialogs in cachedir so that later
+# launches can skip compiling them
+code_cache = True
+
+# images in the data zips are decoded on this many threads at once (0 for
+# one per processor core)
+loader_threads = 0
+
+# npcs are indexed for collision tests in square cells of this many pixels
+actor_hash_cell_size = 64
+
+# spritesets no actor uses any more stay loaded until they take up more
+# than this many bytes
+spriteset_cache_bytes = 16 * 1024 * 1024
+
+# rendered strings (labels, console lines, the HUD) are kept for reuse until
+# they take up more than this many bytes
+text_cache_bytes = 4 * 1024 * 1024
+
+# messages below log_level ('debug', 'info', 'warning' or 'error') aren't
+# logged at all; the last log_history of the rest are kept for the console
+# (log.recent) and copied to log_file (nothing if empty) and, from
+# log_console_level up, to stdout. log_caller adds the calling file, line and
+# function to every message, at some cost
+log_level = 'info'
+log_console_level = 'info'
+log_history = 1000
+log_file = os.path.join(cachedir, 'overworld.log')
+log_caller = False
+
+# time the engine's phases and count the work done in them, keeping the last
+# profile_frames frames; F3 shows them over the game (redrawn every
+# profile_view_interval milliseconds), F4 writes them to profile_csv
+profiling = True
+profile_frames = 600
+profile_view_interval = 250
+profile_csv = os.path.join(cachedir, 'profile.csv')
+
 default_tileset = "default"
 default_actor_spriteset = "chryso"
 default_itemset = "default"
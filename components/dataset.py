@@ -1,34 +1,146 @@
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 import configuration
+import hashlib
+import marshal
 import os
+import struct
+import vfs
 
 def splitSets(nameList):
     sets = {}
     for name in nameList:
         set = os.path.split(name)[0]
-        if not set in sets: sets[set] = []            
+        if not set in sets: sets[set] = []
         sets[set].append(name)
     return sets
 
+def hashFile(filename):
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        for block in iter(lambda: f.read(65536), ''): h.update(block)
+    finally: f.close()
+    return h.hexdigest()
+
 class DatasetBuilder:
-    '''Third approach, this time, no nested zip files.'''
-    
+    '''Fourth approach: still no nested zip files, but a manifest of every
+    member's size, mtime and sha1 is kept in configuration.cachedir so that an
+    unchanged data directory costs only a walk and some stats, and a changed
+    one only recompresses the files that differ.'''
+
+    ManifestVersion = 2
+
+    # already compressed, deflating them again only costs time on every read
+    StoredExtensions = ('.png',)
+
     def buildDataset(self, path):
-        
-        zfilename = os.path.join(configuration.datadir, os.path.split(path)[-1] + '.zip')
-        
-        if os.path.exists(zfilename): os.remove(zfilename)
-        
-        zf = ZipFile(zfilename, 'w')
-        
+        """Brings the dataset zip for path up to date. Returns the number of
+        members that had to be (re)compressed; 0 means the zip was left alone.
+        """
+        name = os.path.split(path)[-1]
+        zfilename = os.path.join(configuration.datadir, name + '.zip')
+        manifestName = os.path.join(configuration.cachedir, name + '.manifest')
+
+        sources = self._scan(path)
+        manifest = self._readManifest(manifestName)
+        oldFiles = manifest['files'] if manifest and os.path.exists(zfilename) and manifest['zip'] == self._stat(zfilename) else {}
+
+        files, changed = {}, []
+        for arcname, (filename, size, mtime) in sources.iteritems():
+            old = oldFiles.get(arcname)
+            if old and old[:2] == (size, mtime):
+                files[arcname] = old
+                continue
+            # only files whose stats changed get read, and a touched but
+            # identical file still counts as unchanged
+            digest = hashFile(filename)
+            files[arcname] = (size, mtime, digest)
+            if not old or old[2] != digest: changed.append(arcname)
+
+        removed = [arcname for arcname in oldFiles if arcname not in sources]
+
+        if changed or removed or not oldFiles: self._writeZip(zfilename, sources, changed if oldFiles else sources.keys())
+        if changed or removed or files != oldFiles or not oldFiles:
+            self._writeManifest(manifestName, {'files': files, 'zip': self._stat(zfilename)})
+
+        return len(changed) if oldFiles else len(sources)
+
+    def _stat(self, filename):
+        st = os.stat(filename)
+        return (st.st_size, st.st_mtime)
+
+    def _scan(self, path):
+        """Maps each archive name under path to (filename, size, mtime)."""
+        ret = {}
         for root, dirs, files in os.walk(path):
             if '_svn' in root or '.svn' in root or not files: continue
-                        
+
             pseudoroot = root.replace(path, "")
-                        
+
             for f in files:
-                filename = os.path.join(pseudoroot, f)
-                zf.write(os.path.join(root, f), filename, ZIP_DEFLATED)
-                
-        zf.close()
-   
\ No newline at end of file
+                filename = os.path.join(root, f)
+                arcname = os.path.join(pseudoroot, f).lstrip(os.sep).replace(os.sep, '/')
+                ret[arcname] = (filename,) + self._stat(filename)
+        return ret
+
+    def _readManifest(self, filename):
+        if not os.path.exists(filename): return None
+        try:
+            f = open(filename, 'rb')
+            try: manifest = marshal.load(f)
+            finally: f.close()
+        except (EOFError, ValueError, TypeError, IOError): return None
+        if manifest.get('version') != DatasetBuilder.ManifestVersion: return None
+        return manifest
+
+    def _writeManifest(self, filename, manifest):
+        if not os.path.isdir(configuration.cachedir): os.makedirs(configuration.cachedir)
+        manifest['version'] = DatasetBuilder.ManifestVersion
+        f = open(filename + '.tmp', 'wb')
+        try: marshal.dump(manifest, f)
+        finally: f.close()
+        if os.path.exists(filename): os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+
+    def _writeZip(self, zfilename, sources, recompress):
+        """Writes a new zip holding sources. Members listed in recompress are
+        compressed from their files, all others are copied still compressed
+        from the existing zip.
+        """
+        recompress = set(recompress)
+        old = ZipFile(zfilename) if os.path.exists(zfilename) and len(recompress) < len(sources) else None
+        zf = ZipFile(zfilename + '.tmp', 'w')
+        try:
+            for arcname in sorted(sources):
+                if arcname in recompress or arcname not in old.NameToInfo: zf.write(sources[arcname][0], arcname, self._compression(arcname))
+                else: self._copyMember(old, zf, old.getinfo(arcname))
+        finally:
+            zf.close()
+            if old: old.close()
+
+        vfs.unmount(zfilename)
+        if os.path.exists(zfilename): os.remove(zfilename)
+        os.rename(zfilename + '.tmp', zfilename)
+
+    def _compression(self, arcname):
+        return ZIP_STORED if arcname.lower().endswith(DatasetBuilder.StoredExtensions) else ZIP_DEFLATED
+
+    def _copyMember(self, src, dst, info):
+        """Copies a member's compressed bytes from one open zip into another
+        without inflating and deflating them again.
+        """
+        src.fp.seek(info.header_offset)
+        header = src.fp.read(30)
+        if header[:4] != "PK\003\004": raise IOError, "Bad local header for %s" % info.filename
+        nameLength, extraLength = struct.unpack("<HH", header[26:30])
+        src.fp.seek(info.header_offset + 30 + nameLength + extraLength)
+        data = src.fp.read(info.compress_size)
+
+        info.extra = ''
+        info.flag_bits &= ~0x08 # sizes go in the local header, no data descriptor
+        info.header_offset = dst.fp.tell()
+        dst.fp.write(info.FileHeader())
+        dst.fp.write(data)
+        dst.filelist.append(info)
+        dst.NameToInfo[info.filename] = info
+        dst._didModify = True
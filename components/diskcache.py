@@ -0,0 +1,41 @@
+# diskcache.py
+# What the caches kept in configuration.cachedir (processed tilesets,
+# compiled scripts) share: entries named <prefix><40 hex digit key><suffix>,
+# written in one go, and swept out once a newer entry replaces them.
+#
+
+import configuration
+import os
+import re
+
+def entryPattern(prefix, suffixes):
+    """Returns a regular expression matching the names of the entries (and
+    their temporary files) with exactly prefix before their key, so that a
+    prefix never matches the entries of a name it is the start of.
+    """
+    return re.compile("%s[0-9a-f]{40}(%s)(\\.tmp)?$" % (re.escape(prefix), "|".join(re.escape(s) for s in suffixes)))
+
+def removeStale(prefix, suffixes):
+    "Removes every entry named prefix, a key and one of suffixes from the cache directory."
+    if not os.path.isdir(configuration.cachedir): return
+    stale = entryPattern(prefix, suffixes)
+    for name in os.listdir(configuration.cachedir):
+        if stale.match(name): os.remove(os.path.join(configuration.cachedir, name))
+
+def writeFile(path, write):
+    """Calls write(f) with a file open for writing and puts it at path once it
+    is complete. Returns what write returned.
+    """
+    if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+
+    # written under a temporary name and renamed, so a crash never leaves a
+    # half written entry behind
+    f = open(path + ".tmp", 'wb')
+    try:
+        try: ret = write(f)
+        finally: f.close()
+    except:
+        os.remove(path + ".tmp")
+        raise
+    os.rename(path + ".tmp", path)
+    return ret
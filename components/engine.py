@@ -3,16 +3,22 @@ from dataset import DatasetBuilder
 from modes import PlayMode, EditMode
 from pygame.locals import *
 from scene import Scene
-from utils import DebugPrint
+import characters
 import configuration
+import fonts
 import gui
+import loader
+import log
 import os
+import profiler
 import pygame
 import sys
 import time
 
 LoadDefaultMap = False
 
+logger = log.getLogger("engine")
+
 class Effects(object):
     "All engine effects, like screen fades, lightning, etc."
     
@@ -24,7 +30,11 @@ class Effects(object):
         self.currentEffect.update(ticks)
         
     def render(self, surface):
-        self.currentEffect.render(surface)
+        with profiler.scope("render.effects"): self.currentEffect.render(surface)
+        
+    def isActive(self):
+        "True while an effect is playing"
+        return not isinstance(self.currentEffect, Effects.NoEffect)
     
     def lightning(self, time):
         self.currentEffect = self.Lightning(self, time)
@@ -124,6 +134,36 @@ class Effects(object):
                 cur = pygame.time.get_ticks()
                 pygame.display.flip()
                 alpha -= 255. * (float(cur - old) / float(time))
+        gui.displayReleased()
+
+class Overlay(object):
+    """A user interface shown above the scene by Engine.run itself instead of
+    by a loop of its own. ui is a gui.Application, or anything else with
+    handleEvents(events), needsRedraw(), renderFrame(surface) (which leaves
+    the rects it changed in ui.damage) and done.
+    """
+    
+    def __init__(self, ui, pauseScene=False, onClose=None, queued=False):
+        self.ui = ui
+        self.pauseScene = pauseScene
+        self.onClose = onClose
+        self.queued = queued
+        self.layer = None
+        self.rect = None
+        
+    def update(self):
+        """Redraws the ui onto the overlay's layer if anything in it changed.
+        Returns the screen rects that did."""
+        if self.layer is None:
+            self.layer = pygame.Surface(pygame.display.get_surface().get_size()).convert_alpha()
+        elif not self.ui.needsRedraw(): return []
+        self.layer.fill((0,0,0,0))
+        self.ui.renderFrame(self.layer)
+        self.rect = self.layer.get_bounding_rect()
+        return self.ui.damage
+        
+    def render(self, surface):
+        if self.rect: surface.blit(self.layer, self.rect, self.rect)
 
 class Console(object):
     "An interactive python prompt from within Overworld."
@@ -157,26 +197,32 @@ class Console(object):
         self._buffer.set_alpha(150)
         self.bgcolor = (0,0,0,150)
         self.fgcolor = (200,200,200,255)
-        self._font = pygame.font.Font(None, 24)
+        self._font = fonts.getFont(None, 24)
         self.setPrompt("> ")
         self._inputBuf = ""
         self._historyBuf = []
         self._responseBuf = []
         self._locals = {'scene': self.engine.scene, 'console': self, 'engine': self.engine, 'effects' : self.engine.effects,
-                        'play': self.engine.modes["play"], 'edit': self.engine.modes["edit"], 's': TestingSetup(self.engine.scene)}
+                        'play': self.engine.modes["play"], 'edit': self.engine.modes["edit"], 's': TestingSetup(self.engine.scene),
+                        'spritesets': characters.spritesets, 'textCache': fonts.textCache, 'log': log, 'logs': self.showLog,
+                        'profiler': profiler}
         self._globals = {'quit': self.shutdownEngine }
         self.done = False
         
     def __del__(self):
         sys.stdout = sys.__stdout__
         
+    def showLog(self, count=8, level='debug'):
+        "Shows the last count log messages of at least level in the response buffer"
+        for line in log.recent(count, log.levelNamed(level)): self._responseBuf.insert(0, line)
+
     def shutdownEngine(self):
         self.engine.done = True
         self.done = True
         
     def setPrompt(self, ps):
         self.promptStr = ps
-        self._prompt = self._font.render(self.promptStr, 1, self.fgcolor)
+        self._prompt = fonts.render(self._font, self.promptStr, 1, self.fgcolor)
         
     def update(self):
         # clean up the response buffer:
@@ -186,27 +232,37 @@ class Console(object):
             
     def render(self, surface):
         self.engine.scene.render(surface)
+        self.renderFrame(surface)
         
+    def renderFrame(self, surface):
+        "Draws the console (without the scene behind it) onto surface"
         self._buffer.fill(self.bgcolor)
         pygame.draw.line(self._buffer, (200,200,200,255), (0,self._buffer.get_height()-2), (self._buffer.get_width(), self._buffer.get_height()-2),2)
 
         # prompt:
         self._buffer.blit(self._prompt, (10,10))
         # input:
-        self._input = self._font.render(self._inputBuf, 1, self.fgcolor)
+        self._input = fonts.render(self._font, self._inputBuf, 1, self.fgcolor)
         self._buffer.blit(self._input, (20 + self._prompt.get_width(), 10))
         # response:
         c = 0
         for i in self._responseBuf:
             try:
-                response = self._font.render(i, 1, self.fgcolor)
+                response = fonts.render(self._font, i, 1, self.fgcolor)
                 y = (c+1)*response.get_height()+20
                 self._buffer.blit(response, (10, y))
                 c += 1
             except pygame.error:
                 self._responseBuf.insert(0, '**Error: too much text to display')
 
-        surface.blit(self._buffer, (0,0))
+        self.damage = [surface.blit(self._buffer, (0,0))]
+        
+    # the console is cheap to draw, so as an overlay it is redrawn every frame
+    def needsRedraw(self): return True
+    
+    def handleEvents(self, events):
+        self.update()
+        for e in events: self.handleInput(e)
     
     def handleInput(self, event):
         if event.type == KEYDOWN:
@@ -283,72 +339,82 @@ class Console(object):
             pygame.display.flip()
 
         sys.stdout = oldstdout
+        gui.displayReleased()
 
 class Engine(object):
     
     def __init__(self):
-        print "Hijacking stdout...",
-        self._hijackStdout()
-        sys.__stdout__.write("done\n\n")
+        log.start()
         
-        print "Initializing Pygame"
+        logger.info("Initializing Pygame")
         self._initPygame()
-        print "Finished Pygame Initialization\n"
+        logger.info("Finished Pygame Initialization")
 
-        pd = gui.ProgressDialog("Initializing Overworld...")
+        # the bar stands for the five datasets and the game to begin with; the
+        # scene and the images it decodes add their own work as it comes up
+        pd = gui.ProgressDialog("Initializing Overworld...", work=6)
         pd.start()
+        loader.progressListener = pd
                 
-        print "Initializing Data\n"
+        logger.info("Initializing Data")
         self._initData(pd)
-        print "Finished Data Initialization\n"
+        logger.info("Finished Data Initialization")
         
-        print "Initializing Game"
+        logger.info("Initializing Game")
         self._initGame(pd)
-        print "Finished Game Initialization\n"
+        logger.info("Finished Game Initialization")
         
+        loader.progressListener = None
         pd.end()
         
-    def _hijackStdout(self):
-        sys.stdout = DebugPrint()
-        
     def _initData(self, progressDialog=None):
         """This method looks in the "data" directory for new or modified data files that ought
         to be incorporated into datasets. See the Overworld documentation for details on 
         organizing datasets.
         """
         
-        print "Building Spritesets"
+        logger.info("Building Spritesets")
         self._buildSpritesets()
-        progressDialog.updateProgress(20)
-        print "Finished Building Spritesets\n"
+        progressDialog.updateProgress(1)
+        logger.info("Finished Building Spritesets")
         
-        print "Building Tilesets"
+        logger.info("Building Tilesets")
         self._buildTilesets()
-        progressDialog.updateProgress(20)
-        print "Finished Building Tilesets\n"
+        progressDialog.updateProgress(1)
+        logger.info("Finished Building Tilesets")
         
-        print "Building Scripts"
+        logger.info("Building Scripts")
         self._buildScripts()
-        progressDialog.updateProgress(20)
-        print "Finished Building Scripts\n"
+        progressDialog.updateProgress(1)
+        logger.info("Finished Building Scripts")
         
-        print "Building Dialogs"
+        logger.info("Building Dialogs")
         self._buildDialogs()
-        progressDialog.updateProgress(20)
-        print "Finished Building Dialogs\n"
+        progressDialog.updateProgress(1)
+        logger.info("Finished Building Dialogs")
 
-        print "Building Items"
+        logger.info("Building Items")
         self._buildItems()
-        progressDialog.updateProgress(20)
-        print "Finished Building Items"
+        progressDialog.updateProgress(1)
+        logger.info("Finished Building Items")
         
     def _initPygame(self):        
         pygame.display.init()
         pygame.font.init()
-        self.screen = pygame.display.set_mode(configuration.screen_resolution, HWSURFACE|DOUBLEBUF)
+        # partial display updates need a single buffered display
+        flags = HWSURFACE if configuration.dirty_rect_rendering else HWSURFACE|DOUBLEBUF
+        self.screen = pygame.display.set_mode(configuration.screen_resolution, flags)
         self.buffer = pygame.Surface(self.screen.get_size())
         self.clock = pygame.time.Clock()
-        self.font = pygame.font.Font(None, 20)
+        self.font = fonts.getFont(None, 20)
+        self.fpsText = None
+        self.fpsTextTime = 0
+        self.lastFrame = None
+        self.updateStep = 1000.0 / configuration.update_rate
+        self.accumulator = 0.0
+        self.updateTime = 0.0
+        self.renderTime = 0.0
+        self.profilerView = None
         pygame.display.set_caption("Overworld %s-alpha" % time.strftime("%Y.%m.%d"))
         
     def _initGame(self, progressDialog=None):
@@ -364,11 +430,94 @@ class Engine(object):
         self.modes = {"edit": EditMode(self), "play": PlayMode(self)}
         self.mode = self.modes["edit"]
         self.effects = Effects(self)      
+        self.overlays = []
+        self.pendingOverlays = []
+        self.tasks = []
         self.done = False
         
-        if progressDialog: progressDialog.updateProgress(10)
+        if progressDialog: progressDialog.updateProgress(1)
     
     def handleInput(self): self.mode.handleInput()
+    
+    def openOverlay(self, ui, pauseScene=False, onClose=None):
+        """Shows ui (see Overlay) above the scene from the next frame on. It gets
+        all input until it is done, at which point onClose(ui) is called. The
+        scene keeps updating underneath unless pauseScene is set.
+        """
+        ui.done = False
+        self.overlays.append(Overlay(ui, pauseScene, onClose))
+        
+    def queueOverlay(self, ui, pauseScene=False, onClose=None):
+        """Like openOverlay, but the ui waits until no overlay is open, so that
+        queued uis (the lines of a conversation, say) show one after another.
+        """
+        ui.done = False
+        self.pendingOverlays.append(Overlay(ui, pauseScene, onClose, queued=True))
+        if not self.overlays: self.overlays.append(self.pendingOverlays.pop(0))
+        
+    def runPendingOverlays(self):
+        """Runs the queued uis to completion in their own loops, the one on
+        display first, for callers that can't go on before they have been seen.
+        Anything that starts a modal loop (ui.run()) calls this first, so that
+        the lines played before it are read before it shows.
+        """
+        queued = [o for o in self.overlays if o.queued]
+        for overlay in queued: self.overlays.remove(overlay)
+        queued.extend(self.pendingOverlays)
+        del self.pendingOverlays[:]
+        
+        for overlay in queued:
+            if not overlay.ui.done: overlay.ui.run()
+            if overlay.onClose: overlay.onClose(overlay.ui)
+    
+    def addTask(self, task):
+        """Calls task.poll() once a frame, before the scene updates, until it
+        returns True. For background work (see SceneLoader) whose results have
+        to be taken in on the main thread.
+        """
+        self.tasks.append(task)
+        
+    def runTasks(self):
+        self.tasks = [task for task in self.tasks if not task.poll()]
+    
+    def isScenePaused(self):
+        return any(overlay.pauseScene for overlay in self.overlays)
+    
+    def handleOverlayInput(self):
+        "Hands this frame's input to the topmost overlay instead of the mode"
+        events = pygame.event.get()
+        for e in events:
+            if e.type == QUIT: self.done = True
+        self.overlays[-1].ui.handleEvents(events)
+        
+        self.movingRight = self.movingLeft = self.movingUp = self.movingDown = False
+        self.holding_shift = False
+        
+    def closeOverlays(self):
+        "Removes the overlays that are done, then shows the next queued one if none are left"
+        for overlay in [o for o in self.overlays if o.ui.done]:
+            self.overlays.remove(overlay)
+            if overlay.onClose: overlay.onClose(overlay.ui)
+        if not self.overlays and self.pendingOverlays: self.overlays.append(self.pendingOverlays.pop(0))
+        
+    def updateOverlays(self):
+        "Lets the open overlays redraw what changed in them. Returns the screen rects that did."
+        rects = []
+        for overlay in self.overlays: rects.extend(overlay.update())
+        return rects
+    
+    def renderOverlays(self, surface):
+        with profiler.scope("render.overlays"):
+            for overlay in self.overlays: overlay.render(surface)
+        if self.overlays: pygame.mouse.set_visible(True)
+        
+    def showConsole(self):
+        "Opens the console as an overlay, capturing stdout while it is open"
+        console = Console(self)
+        oldstdout = sys.stdout
+        sys.stdout = console.StdoutCapture(console)
+        def restoreStdout(console): sys.stdout = oldstdout
+        self.openOverlay(console, onClose=restoreStdout)
 
     def update(self):
         dx, dy = 0, 0
@@ -381,19 +530,122 @@ class Engine(object):
         if self.movingUp: dy = -1
         if self.movingDown: dy = 1
             
+        self.scene.savePositions()
         self.scene.moveParty(dx,dy)
         self.scene.centerAt(self.scene.player.px, self.scene.player.py)
-        t = self.clock.tick(30) # throttled to 30 fps
-        self.scene.update(t) 
-        self.effects.update(t)
+        self.scene.update(self.updateStep)
+        
+    def simulate(self, frameTime):
+        """Advances the game logic by frameTime milliseconds of real time in
+        fixed steps of updateStep, carrying over whatever is left for the next
+        frame. After a long stall at most max_update_steps are run, so a slow
+        frame can't snowball into ever more catching up. Returns the number of
+        steps taken.
+        """
+        self.accumulator = min(self.accumulator + frameTime, self.updateStep * configuration.max_update_steps)
+        # counted by division, as subtracting updateStep over and over can
+        # leave the last step a rounding error short
+        steps = int(self.accumulator / self.updateStep)
+        for i in xrange(steps): self.update()
+        self.accumulator = max(self.accumulator - steps * self.updateStep, 0.0)
+        self.scene.setInterpolation(self.accumulator / self.updateStep)
+        return steps
         
     def render(self):
         self.scene.render(self.buffer)
         self.effects.render(self.buffer)
+        
+    def renderMode(self):
+        with profiler.scope("render.mode"): self.mode.render(self.buffer)
+        
+    def toggleProfiler(self):
+        "Shows or hides the phase timings and frame time graph (see profiler.ProfilerView)"
+        self.profilerView = None if self.profilerView else profiler.ProfilerView()
+        if self.profilerView and not profiler.enabled: profiler.setEnabled(True)
+        
+    def exportProfile(self):
+        "Writes the frames the profiler has kept to configuration.profile_csv"
+        logger.info("Wrote %d frames of timings to %s", len(profiler.frames()), profiler.exportCsv())
+            
+    def updateText(self):
+        """Re-renders the FPS counter about once a second, and the profiler view
+        when it is shown and due. Returns the screen rects they covered before
+        and after, or [] when neither changed.
+        """
+        ret = self.profilerView.update(self.profilerTopright()) if self.profilerView else []
+        now = pygame.time.get_ticks()
+        if self.fpsText and now - self.fpsTextTime < 1000: return ret
+        
+        old = self.fpsText
+        self.fpsText = fonts.render(self.font, "FPS: %.2f  update: %.1f ms  render: %.1f ms" % (self.clock.get_fps(), self.updateTime, self.renderTime),
+                                        True, (200,200,200))
+        self.fpsTextTime = now
+        ret.append(self.fpsText.get_rect(topleft=(10,10)))
+        if old: ret.append(old.get_rect(topleft=(10,10)))
+        return ret
             
     def renderText(self):
-        fpsTxt1 = self.font.render("FPS: %.2f" % self.clock.get_fps(), True, (200,200,200))
-        self.buffer.blit(fpsTxt1, (10,10))
+        with profiler.scope("render.text"):
+            if not self.fpsText: self.updateText()
+            self.buffer.blit(self.fpsText, (10,10))
+            if self.profilerView: self.profilerView.render(self.buffer, self.profilerTopright())
+        
+    def profilerTopright(self): return (self.buffer.get_width() - 10, 10)
+        
+    def getDirtyRects(self):
+        """Returns the screen rects that need redrawing this frame, None if the
+        whole screen does.
+        """
+        frame = (self.scene, self.mode, gui.DisplayGeneration, self.effects.isActive(), tuple(self.overlays), self.profilerView)
+        lastFrame, self.lastFrame = self.lastFrame, frame
+        
+        textRects = self.updateText()
+        sceneRects = self.scene.getDirtyRects()
+        modeRects = self.mode.getDirtyRects(self.buffer)
+        overlayRects = self.updateOverlays()
+        
+        # effects paint the whole screen, and leave it to be repainted once they stop
+        if frame != lastFrame or frame[3] or sceneRects is None: return None
+        
+        # overlapping rects are merged so nothing gets drawn twice
+        screenRect = self.buffer.get_rect()
+        ret = []
+        for r in sceneRects + modeRects + overlayRects + textRects:
+            r = screenRect.clip(r)
+            if not r.width or not r.height: continue
+            i = r.collidelist(ret)
+            while i != -1:
+                r = r.union(ret.pop(i))
+                i = r.collidelist(ret)
+            ret.append(r)
+        return ret
+        
+    def renderDirty(self):
+        """Redraws only what changed since the last frame and pushes just those
+        rects to the display. Does nothing at all when the scene is idle.
+        """
+        with profiler.scope("render.damage"): rects = self.getDirtyRects()
+        
+        if rects is None:
+            self.render()
+            self.renderMode()
+            self.renderOverlays(self.buffer)
+            self.renderText()
+            self.screen.blit(self.buffer, (0,0))
+            with profiler.scope("render.flip"): pygame.display.update()
+            return
+        
+        for r in rects:
+            self.buffer.set_clip(r)
+            self.render()
+            self.renderMode()
+            self.renderOverlays(self.buffer)
+            self.renderText()
+            self.screen.blit(self.buffer, r, r)
+        self.buffer.set_clip(None)
+        
+        if rects:
+            with profiler.scope("render.flip"): pygame.display.update(rects)
     
     def run(self):
 
@@ -404,19 +656,41 @@ To use the latest test script, open the console and type: s.setup()
 
 The test script will run and you will be able to try out the functionality it sets up.
 """
-        gui.Dialog.createOkDialog(welcomeMessage).run()
+        self.openOverlay(gui.Dialog.createOkDialog(welcomeMessage))
 
+        self.accumulator = 0.0
+        self.clock.tick()
+        profiler.endFrame()
         while not self.done:        
-            self.handleInput()
-            self.update()
-            self.render()
-            self.mode.render(self.buffer)
-            self.renderText()
-            self.screen.blit(self.buffer, (0,0))
-            pygame.display.flip()
+            with profiler.scope("input"):
+                if self.overlays: self.handleOverlayInput()
+                else: self.handleInput()
+                self.closeOverlays()
+            if self.tasks:
+                with profiler.scope("tasks"): self.runTasks()
+            with profiler.scope("wait"): t = self.clock.tick(configuration.max_render_fps)
+            
+            start = time.time()
+            with profiler.scope("update"):
+                if not self.isScenePaused() and self.simulate(t): self.updateTime = (time.time() - start) * 1000.0
+                self.effects.update(t)
+            
+            start = time.time()
+            with profiler.scope("render"):
+                if configuration.dirty_rect_rendering: self.renderDirty()
+                else:
+                    self.render()
+                    self.renderMode()
+                    self.updateOverlays()
+                    self.renderOverlays(self.buffer)
+                    self.renderText()
+                    self.screen.blit(self.buffer, (0,0))
+                    with profiler.scope("render.flip"): pygame.display.flip()
+            self.renderTime = (time.time() - start) * 1000.0
+            profiler.endFrame()
             
     def quit(self):
-        print "Quitting..."
+        logger.info("Quitting...")
         self.done = True
             
     def warpPlayerToTile(self, tx, ty):
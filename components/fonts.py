@@ -0,0 +1,87 @@
+# fonts.py
+# A pool of shared pygame fonts and a bounded cache of the text surfaces
+# rendered with them, used by the gui, the console and the HUD.
+#
+
+from collections import OrderedDict
+import configuration
+import pygame
+
+_fonts = {}
+
+def getFont(filename=None, size=24, bold=False, italic=False, underline=False):
+    """Returns the Font for filename (None for pygame's default font) at size
+    and style, loading it the first time it is asked for. Fonts are shared,
+    so callers must not change their style.
+    """
+    key = (filename, size, bold, italic, underline)
+    font = _fonts.get(key)
+    if font is None:
+        font = _fonts[key] = pygame.font.Font(filename, size)
+        if bold: font.set_bold(True)
+        if italic: font.set_italic(True)
+        if underline: font.set_underline(True)
+    return font
+
+class TextCache(object):
+    """Keeps the surfaces font.render made for recently drawn strings, least
+    recently used first out once they take up more than maxBytes. Cached
+    surfaces are shared, so callers must only blit them, never draw on them.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.surfaces = OrderedDict() # (font, text, antialias, color, background) -> surface
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self): return len(self.surfaces)
+
+    def render(self, font, text, antialias, color, background=None):
+        "Same as font.render, but reuses the surface from an earlier call."
+        key = (font, text, antialias, tuple(color), background and tuple(background))
+        surface = self.surfaces.pop(key, None)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces[key] = surface
+            return surface
+
+        self.misses += 1
+        if background is None: surface = font.render(text, antialias, color)
+        else: surface = font.render(text, antialias, color, background)
+        self.surfaces[key] = surface
+        self.bytes += self._sizeOf(surface)
+        while self.bytes > self.maxBytes and len(self.surfaces) > 1:
+            key, old = self.surfaces.popitem(last=False)
+            self.bytes -= self._sizeOf(old)
+            self.evictions += 1
+        return surface
+
+    def _sizeOf(self, surface):
+        return surface.get_pitch() * surface.get_height()
+
+    def clear(self):
+        self.surfaces.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Returns a dict of the cache's counters."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hitRate': float(self.hits) / lookups if lookups else 0.0,
+                'entries': len(self.surfaces), 'bytes': self.bytes, 'maxBytes': self.maxBytes,
+                'fonts': len(_fonts)}
+
+    def __repr__(self):
+        s = self.stats()
+        return "Text cache: %d surfaces, %.1f of %.1f MB, %d hits, %d misses (%.0f%%), %d evictions, %d fonts" % \
+            (s['entries'], s['bytes'] / 1048576.0, s['maxBytes'] / 1048576.0, s['hits'], s['misses'],
+             s['hitRate'] * 100, s['evictions'], s['fonts'])
+
+textCache = TextCache(configuration.text_cache_bytes)
+
+def render(font, text, antialias, color, background=None):
+    "font.render through the shared text cache"
+    return textCache.render(font, text, antialias, color, background)
@@ -9,11 +9,15 @@
 #	[] Review classes included in module for relevance to module
 #
 
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from math import pi, floor
 from pygame.locals import *
+from spatial import SpatialHash
+import fonts
 import pygame
+import re
 import sys
-import threading
 
 DefaultControlBackground = (0x88, 0x88, 0x88)
 DefaultControlBackground2 = (0xaa, 0xaa, 0xaa)
@@ -22,14 +26,77 @@ DefaultControlBorderColor = (0,0,0,255)
 DefaultControlBorderWidth = 1
 DefaultControlHighlight = (187,221,255,255)
 DefaultApplicationIdleTime = 50
+DefaultDialogIdleTime = 20
 DefaultFontColor = (255,255,255,255)
+DefaultHitGridSize = 64
+
+# bumped whenever a gui loop hands the display back to its caller, so anything
+# that keeps the screen contents between frames knows it has to redraw it all
+DisplayGeneration = 0
+
+def displayReleased():
+	global DisplayGeneration
+	DisplayGeneration += 1
+
+# number of controls that have actually redrawn their surfaces so far; when
+# ShowRedrawCount is set Applications display how many did so each frame
+RedrawCount = 0
+ShowRedrawCount = False
+
+# bumped whenever a control scrolls, which moves everything inside it
+ScrollGeneration = 0
+
+# while an Application renders a frame, the rects (in the coordinates of the
+# surface it renders into) that changed on it since the last frame
+_damage = None
+
+def waitForEvents(timeout):
+	"""Returns the pending events, first sleeping until one arrives or timeout
+	milliseconds pass when there are none. pygames older than 2.0 can't wait
+	with a timeout, so there it simply sleeps for timeout.
+	"""
+	try: first = pygame.event.wait(timeout)
+	except TypeError:
+		pygame.time.wait(timeout)
+		return pygame.event.get()
+	if first.type == pygame.NOEVENT: return []
+	return [first] + pygame.event.get()
 
 class GuiException(Exception): pass
 
 class Control(object):
+	"""Base of all gui controls. A control keeps the surface it last rendered
+	and only draws itself again once it has been invalidated. Assigning to
+	any attribute (other than those in undrawnAttributes) invalidates the
+	control and every control it is drawn into; changing only where it sits
+	(x, y and their offsets) invalidates just its ancestors. Controls that
+	change on their own from frame to frame set animated and are redrawn
+	every time.
+	
+	Children are kept in drawing order (those marked onTop last) as they are
+	added and as onTop changes, and each control remembers its absolute
+	position until it or one of its ancestors moves. Pointer events find the
+	children they hit through a spatial index of the children's rects.
+	"""
+	
+	animated = False
+	scrollY = 0		# how far the children are scrolled up
+	undrawnAttributes = frozenset(['parent', 'mouseOverControls', 'mouseDownControls', 'callback', 'animateInited',
+								   'done', 'result', 'focusedControl', 'buffer', 'idleTime', 'origClip', 'tmpOpacity',
+								   '_origFontColor', 'redraws', 'damage'])
+	placementAttributes = frozenset(['x', 'y', 'xOffset', 'yOffset'])
+	layoutAttributes = placementAttributes | frozenset(['width', 'height'])
 	
 	def __init__(self, **kwargs):
 		
+		self.__dict__['_Control__dirty'] = True
+		self.__dict__['_Control__changed'] = True
+		self.__dict__['_Control__drawnRect'] = None
+		self.__dict__['_Control__drawing'] = False
+		self.__dict__['_Control__surface'] = None
+		self.__dict__['_Control__abs'] = None
+		self.__dict__['_Control__absGeneration'] = None
+		self.__dict__['_Control__hitIndex'] = None
 		self.children = []
 		self.show = True
 		self.parent = kwargs['parent'] if 'parent' in kwargs else None		
@@ -44,32 +111,89 @@ class Control(object):
 		self.animateInit = kwargs['animateInit'] if 'animateInit' in kwargs else lambda x: ()
 		self.animateFunc = kwargs['animateFunc'] if 'animateFunc' in kwargs else lambda x,y: ()
 		self.animateInited = False
+		if 'animateFunc' in kwargs: self.animated = True
 		self.enabled = True
 	
 	def __repr__(self): return "Abstract Control"
 	
-	def __get_abs_x(self): 
-		compx = self.x + self.xOffset
-		p = self.parent
-		while True:
-			if p:
-				compx += p.x + p.xOffset
-				p = p.parent
-			else: break
-		return compx
+	def __setattr__(self, name, value):
+		d = self.__dict__
+		if name in d:
+			try: changed = d[name] != value
+			except Exception: changed = True
+		# properties are caught when they set their own attributes
+		else: changed = not isinstance(getattr(type(self), name, None), property)
+		object.__setattr__(self, name, value)
+		if not changed: return
+		
+		if name in Control.layoutAttributes and d.get('parent'): d['parent'].__dict__['_Control__hitIndex'] = None
+		if name == 'children': d['_Control__hitIndex'] = None
+		if name == 'scrollY':
+			# rather than forgetting the positions of all the children
+			global ScrollGeneration
+			ScrollGeneration += 1
+		
+		if name in Control.placementAttributes:
+			self.__moved()
+			if not d['_Control__drawing'] and d.get('parent'): d['parent'].__invalidateTree()
+		elif name == 'parent': self.__moved()
+		elif not d['_Control__drawing'] and name not in self.undrawnAttributes: self.invalidate()
+	
+	def invalidate(self):
+		"""Marks this control for redrawing, along with every control it is
+		drawn into. Only needed for changes that don't go through an attribute
+		assignment on the control (e.g. drawing onto an image it shows).
+		"""
+		self.__dict__['_Control__changed'] = True
+		self.__invalidateTree()
+	
+	def __invalidateTree(self):
+		"Marks this control and its ancestors for redrawing without counting it as changed itself"
+		c = self
+		while c is not None:
+			c.__dict__['_Control__dirty'] = True
+			c = c.__dict__.get('parent')
+	
+	def __moved(self):
+		"Forgets the absolute positions of this control and its descendants"
+		stack = [self]
+		while stack:
+			c = stack.pop()
+			d = c.__dict__
+			# a control is only ever positioned after its parent, so nothing
+			# below a control without a position has one either
+			if d['_Control__abs'] is None and c is not self: continue
+			d['_Control__abs'] = None
+			stack.extend(d.get('children', ()))
+	
+	def __get_abs(self):
+		pos = self.__abs
+		if pos is None or self.__absGeneration != ScrollGeneration:
+			parent = self.parent
+			if parent:
+				px, py = parent.__get_abs()
+				py -= parent.scrollY
+			else: px, py = 0, 0
+			pos = self.__dict__['_Control__abs'] = (px + self.x + self.xOffset, py + self.y + self.yOffset)
+			self.__dict__['_Control__absGeneration'] = ScrollGeneration
+		return pos
+	
+	def needsRedraw(self):
+		"True when this control or anything drawn into it has to be redrawn"
+		return self.__dirty or self.animated
+	
+	def __get_abs_x(self): return self.__get_abs()[0]
 	absx = property(__get_abs_x)
 		
-	def __get_abs_y(self): 
-		compy = self.y + self.yOffset
-		p = self.parent
-		while True:
-			if p:
-				compy += p.y + p.yOffset
-				p = p.parent
-			else: break
-		return compy
+	def __get_abs_y(self): return self.__get_abs()[1]
 	absy = property(__get_abs_y)
 	
+	def __get_on_top(self): return self.__on_top
+	def __set_on_top(self, onTop):
+		self.__on_top = onTop
+		if self.parent and self in self.parent.children: self.parent.sortChildren()
+	onTop = property(__get_on_top, __set_on_top, None, "Render after (above) the controls not on top")
+	
 	def __get_rot(self): return self.__render_on_top
 	def __set_rot(self, rot):
 		for c in self.children: c.renderOnTop = rot
@@ -115,7 +239,10 @@ class Control(object):
 	def render(self, surface):
 		self.update(self)
 
-		tmpSurface = pygame.Surface((self.width, self.height)).convert_alpha()
+		tmpSurface = self.__surface
+		if tmpSurface is None or tmpSurface.get_size() != (self.width, self.height):
+			tmpSurface = self.__dict__['_Control__surface'] = pygame.Surface((self.width, self.height)).convert_alpha()
+			self.__dict__['_Control__dirty'] = True
 		
 		if not self.animateInited: 
 			self.animateInit(self)
@@ -123,18 +250,61 @@ class Control(object):
 
 		self.animateFunc(self, tmpSurface)
 		
-		self.preRender(tmpSurface)
+		if self.__dirty or self.animated: self.__redraw(tmpSurface)
 		
-		self.children.sort(lambda x,y: 1 if x.onTop and not y.onTop else -1 if y.onTop and not x.onTop else 0)	# this is why i love python
-
-		for c in self.children:
-			if c.show: c.render(tmpSurface)
+		parent = self.parent
+		surface.blit(tmpSurface, (self.x+self.xOffset, self.y+self.yOffset - (parent.scrollY if parent else 0)))
+		self.__damaged()
+		
+		# stays invalid so that it (and whatever it is drawn into) is redrawn next frame
+		if self.animated: self.invalidate()
+	
+	def __redraw(self, tmpSurface):
+		global RedrawCount
+		RedrawCount += 1
+		
+		d = self.__dict__
+		d['_Control__dirty'] = False
+		d['_Control__drawing'] = True
+		try:
+			tmpSurface.fill((0,0,0,255))
 			
-		self.postRender(tmpSurface)
-
-		if not self.enabled: tmpSurface.fill((0,0,0,50))
-
-		surface.blit(tmpSurface, (self.x+self.xOffset, self.y+self.yOffset))
+			self.preRender(tmpSurface)
+	
+			for c in self.childrenInView():
+				if c.show: c.render(tmpSurface)
+				else: c.__hidden()
+				
+			self.postRender(tmpSurface)
+	
+			if not self.enabled: tmpSurface.fill((0,0,0,50))
+		finally: d['_Control__drawing'] = False
+	
+	def childrenInView(self):
+		"The children that may show on this control's surface, in drawing order"
+		return self.children
+	
+	def __damaged(self):
+		"""Reports the rects this control changed on screen as it was drawn:
+		all of it when it changed itself, and where it was and is now when it
+		moved. Controls that were only redrawn for their children's sake
+		leave it to the children.
+		"""
+		d = self.__dict__
+		rect = (self.absx, self.absy, self.width, self.height)
+		drawn = d['_Control__drawnRect']
+		if _damage is not None and (d['_Control__changed'] or rect != drawn):
+			_damage.append(rect)
+			if drawn is not None and drawn != rect: _damage.append(drawn)
+		d['_Control__drawnRect'] = rect
+		d['_Control__changed'] = False
+	
+	def __hidden(self):
+		"Reports where a control that is no longer shown was drawn"
+		d = self.__dict__
+		if d['_Control__drawnRect'] is None: return
+		if _damage is not None: _damage.append(d['_Control__drawnRect'])
+		d['_Control__drawnRect'] = None
 					
 	def handleEvents(self, events=None):
 		if events is None: events = pygame.event.get()
@@ -147,7 +317,6 @@ class Control(object):
 			elif e.type == pygame.KEYDOWN: self.keypress(e)
 		
 	def mouseMotion(self, event):
-		for c in self.controlsAt(event): c.mouseMotion(event)
 		newMouseOvers = self.controlsAt(event)
 		for c in newMouseOvers:
 			if c not in self.mouseOverControls:
@@ -182,13 +351,29 @@ class Control(object):
 	def add(self, control):
 		assert isinstance(control, Control)
 		control.parent = self
-		self.children.append(control)
+		if control.onTop: self.children.append(control)
+		else:
+			# goes after the rest but below any controls on top
+			i = len(self.children)
+			while i and self.children[i-1].onTop: i -= 1
+			self.children.insert(i, control)
+		self.__dict__['_Control__hitIndex'] = None
+		self.invalidate()
 		control.added(self)
 		
 	def added(self, parent): pass
 		
 	def remove(self, control):
-		if control in self.children: self.children.remove(control)
+		if control in self.children: 
+			self.children.remove(control)
+			self.__dict__['_Control__hitIndex'] = None
+			self.invalidate()
+			
+	def sortChildren(self):
+		"Puts the children back in drawing order, the ones on top last"
+		self.children.sort(key=lambda c: c.onTop)
+		self.__dict__['_Control__hitIndex'] = None
+		self.invalidate()
 	
 	@staticmethod	
 	def highlightColor(color, colorDx=30):
@@ -206,12 +391,28 @@ class Control(object):
 		absx, absy = control.absx, control.absy
 		return control.show and x >= absx and x <= absx+control.width and y >= absy and y <= absy+control.height
 
+	def childIndex(self):
+		"""Returns a grid of the children's rects (unscrolled), built the first
+		time it is needed after they are added, removed, moved or resized.
+		Lookups in it come back in drawing order.
+		"""
+		index = self.__hitIndex
+		if index is None:
+			index = self.__dict__['_Control__hitIndex'] = SpatialHash(DefaultHitGridSize)
+			for c in self.children: index.insert(c, (c.x + c.xOffset, c.y + c.yOffset, c.width, c.height))
+		return index
+
 	def controlsAt(self, event):
-		return [i for i in self.children if self.isMouseOver(event, i)]
+		"Returns the shown children under the pointer, in drawing order"
+		x, y = event.pos
+		absx, absy = self.__get_abs()
+		return [c for c in self.childIndex().queryPoint(x - absx, y - absy + self.scrollY) if c.show]
 	
 	def removeAllChildren(self):
 		for c in self.children: c.removeAllChildren()		
 		for i in range(len(self.children)): self.children.pop()
+		self.__dict__['_Control__hitIndex'] = None
+		self.invalidate()
 		
 class BorderedControl(Control):
 	
@@ -258,6 +459,11 @@ class BorderRenderer(object):
 		self.borderWidth = borderWidth
 		self.backgroundColor = backgroundColor
 		
+	def __setattr__(self, name, value):
+		object.__setattr__(self, name, value)
+		control = self.__dict__.get('borderControl')
+		if control is not None and name != 'borderControl': control.invalidate()
+		
 	def render(self, surface): pass
 			
 class SquareBorderRenderer(BorderRenderer):
@@ -323,7 +529,7 @@ class Button(BorderedControl):
 		
 		self.fontColor = kwargs['fontColor'] if 'fontColor' in kwargs else (255,255,255)
 		self.callback = kwargs['callback'] if 'callback' in kwargs else None
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 24)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 24)
 		self.text = kwargs['text'] if 'text' in kwargs else ''
 		self.xpadding = kwargs['xpadding'] if 'xpadding' in kwargs else 12
 		self.ypadding = kwargs['ypadding'] if 'ypadding' in kwargs else 8
@@ -341,7 +547,7 @@ class Button(BorderedControl):
 	def __get_text(self): return self.__internal_text
 	def __set_text(self, txt):
 		self.__internal_text = txt
-		self.__textBuffer = self.font.render(self.__internal_text, True, self.fontColor)
+		self.__textBuffer = fonts.render(self.font, self.__internal_text, True, self.fontColor)
 	def __del_text(self):
 		del self.__internal_text
 	text = property(__get_text, __set_text, __del_text, "Text displayed on button")
@@ -397,7 +603,7 @@ class Label(BorderedControl):
 			del kwargs["borderWidth"]
 		else: self.borderRenderer.borderWidth = 0
 		
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 24)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 24)
 		self.fontColor = kwargs['fontColor'] if 'fontColor' in kwargs else DefaultFontColor
 		self.text = kwargs['text'] if 'text' in kwargs else ''
 		self.xalignment = kwargs['xalignment'] if 'xalignment' in kwargs else 'left'
@@ -408,7 +614,10 @@ class Label(BorderedControl):
 	def __gettext(self): return self.__text
 	def __settext(self, text):
 		self.__text = text
-		self.textSurface = self.font.render(self.__text, True, self.fontColor)
+		# some controls set the same text on every frame, which needn't redraw
+		if self.__dict__.get('_Label__textKey') == (text, self.font, self.fontColor): return
+		self.__textKey = (text, self.font, self.fontColor)
+		self.textSurface = fonts.render(self.font, self.__text, True, self.fontColor)
 		if self.height < self.textSurface.get_height(): self.height = self.textSurface.get_height()
 		if self.width < self.textSurface.get_width(): self.width = self.textSurface.get_width()
 	def __deltext(self): del self.text		
@@ -453,7 +662,7 @@ class Image(BorderedControl):
 		BorderedControl.__init__(self, **kwargs)
 		self.borderWidth = kwargs['borderWidth'] if 'borderWidth' in kwargs else 0
 		self.backgroundColor = kwargs['backgroundColor'] if 'backgroundColor' in kwargs else (0,0,0,0)
-		self.surface = kwargs["surface"] if "surface" in kwargs else pygame.font.Font(None, 50).render("X", True, (150, 20, 20))
+		self.surface = kwargs["surface"] if "surface" in kwargs else fonts.render(fonts.getFont(None, 50), "X", True, (150, 20, 20))
 
 		self.width = max(self.width, self.surface.get_width())
 		self.height = max(self.height, self.surface.get_height())
@@ -476,7 +685,7 @@ class ImageButton(BorderedControl):
 		
 		self.opacity = kwargs['opacity'] if 'opacity' in kwargs else 255
 		self.hoverOpacity = kwargs['hoverOpacity'] if 'hoverOpacity' in kwargs else 100
-		self.image = kwargs['image'] if 'image' in kwargs else pygame.font.Font(None, 50).render("X", True, (150, 20, 20))
+		self.image = kwargs['image'] if 'image' in kwargs else fonts.render(fonts.getFont(None, 50), "X", True, (150, 20, 20))
 		self.width = kwargs['width'] if 'width' in kwargs else self.image.get_width() + self.borderWidth*2
 		self.height = kwargs['height'] if 'height' in kwargs else self.image.get_height() + self.borderWidth*2
 		self.tmpOpacity = self.opacity
@@ -526,7 +735,7 @@ class ProgressBar(BorderedControl):
 		self.min = kwargs['min'] if 'min' in kwargs else 0.0
 		self.value = kwargs['value'] if 'value' in kwargs else self.min
 		self.showText = kwargs['showText'] if 'showText' in kwargs else True
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 16)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 16)
 		
 	def __repr__(self): return "Progress Bar"
 		
@@ -574,7 +783,7 @@ class ProgressBar(BorderedControl):
 		width = self.value * stepSize
 		pygame.draw.rect(internalSurface, self.barColor, (2, 2, width, ish-4))
 		if self.showText:
-			txt = self.font.render("%.0f%s" % ((self.value/self.max)*100, '%'), True, self.fontColor)
+			txt = fonts.render(self.font, "%.0f%s" % ((self.value/self.max)*100, '%'), True, self.fontColor)
 			x = (isw>>1)-(txt.get_width()>>1)
 			y = (ish>>1)-(txt.get_height()>>1)
 			internalSurface.blit(txt, (x,y))
@@ -588,7 +797,7 @@ class TextInput(BorderedControl):
 		self.text = ""
 		self.fontColor = kwargs['fontColor'] if 'fontColor' in kwargs else (0,0,0)
 		if 'backgroundColor' not in kwargs: self.borderRenderer.backgroundColor = (255,255,255)
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 20)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 20)
 		self.width = kwargs['width'] if 'width' in kwargs else self.parent.width-20 if self.parent else 200
 		self.height = self.font.get_height()+5
 		
@@ -596,7 +805,7 @@ class TextInput(BorderedControl):
 		BorderedControl.preRender(self, surface)
 		
 		#draw text
-		textSurface = self.font.render(self.text, 1, self.fontColor)		
+		textSurface = fonts.render(self.font, self.text, 1, self.fontColor)		
 		surface.blit(textSurface, (1, 2))
 		
 		#draw cursor
@@ -620,7 +829,18 @@ class TextInput(BorderedControl):
 		if tmpbuf != '': self.text += tmpbuf
 		
 class ListBox(BorderedControl):
-	"Unscrollable zebra control list"
+	"""Zebra list that scrolls with the mouse wheel. Its entries are kept in
+	self.items, but only the entries scrolled into view get rows: the control
+	shown for an entry is rowFactory(entry) (by default the entry itself, as
+	for the controls passed to add), and the zebra rows wrapped around them
+	are recycled as they scroll out of view. The control made for an entry is
+	kept, so an entry scrolled back into view shows the same control, with
+	whatever it holds on to (like an ItemListControl's bubble). Entries that
+	aren't controls are all rowHeight high, which defaults to the height of
+	the first one made.
+	"""
+	
+	undrawnAttributes = BorderedControl.undrawnAttributes | frozenset(['rowFactory', 'rowHeight', 'contentBottom', 'entryControls'])
 	
 	def __init__(self, **kwargs):
 		BorderedControl.__init__(self, **kwargs)
@@ -632,6 +852,15 @@ class ListBox(BorderedControl):
 		self.evenColor = kwargs['evenColor'] if 'evenColor' in kwargs else DefaultControlBackground2
 		self.hoverHighlight = kwargs['hoverHighlight'] if 'hoverHighlight' in kwargs else True
 		self.highlightColor = kwargs['highlightColor'] if 'highlightColor' in kwargs else DefaultControlHighlight
+		self.rowFactory = kwargs['rowFactory'] if 'rowFactory' in kwargs else lambda entry: entry
+		self.rowHeight = kwargs['rowHeight'] if 'rowHeight' in kwargs else None
+		self.scroll_dy = kwargs['scroll_dy'] if 'scroll_dy' in kwargs else 16
+		self.items = []
+		self.rowTops = []		# where each entry's row starts, unscrolled
+		self.contentBottom = self.borderRenderer.borderWidth
+		self.rows = {}			# index of an entry in view -> its row
+		self.entryControls = {}	# index of an entry -> the control made for it
+		self.spareRows = []
 		
 	def __repr__(self): return "ListBox"
 	
@@ -661,18 +890,69 @@ class ListBox(BorderedControl):
 	
 	def mouseLeave(self, event):
 		for c in self.children: c.mouseLeave(event)
+		
+	def mouseDown(self, event):
+		if event.button == 4: self.scrollUp()
+		elif event.button == 5: self.scrollDown()
+		else: BorderedControl.mouseDown(self, event)
+		
+	def preRender(self, surface):
+		self.origClip = surface.get_clip()
+		BorderedControl.preRender(self, surface)
+		bw = self.borderRenderer.borderWidth
+		surface.set_clip(bw, bw, self.width-bw*2, self.height-bw*2)
+		
+	def postRender(self, surface):
+		surface.set_clip(self.origClip)
+		BorderedControl.postRender(self, surface)
 	
 	def add(self, control, sortControl=True):
-		c = self.createWrapperControl(control)
-		BorderedControl.add(self, c)
-		if sortControl: self.sort()
+		"""Appends an entry. With sortControl False the rows are only updated
+		if the new entry is in view, so that many entries can be added out
+		of view cheaply."""
+		self.__append(control)
+		if sortControl or self.rowTops[-1] < self.scrollY + self.height: self.showRows()
+		
+	def extend(self, entries):
+		"Appends all of entries, laying the list out just once"
+		for entry in entries: self.__append(entry)
+		self.showRows()
+		
+	def __append(self, entry):
+		self.items.append(entry)
+		self.rowTops.append(self.contentBottom)
+		self.contentBottom += self.__entryHeight(entry)
+		
+	def __entryHeight(self, entry):
+		if isinstance(entry, Control): return entry.height + self.ypadding*2
+		if self.rowHeight is None: self.rowHeight = self.rowFactory(entry).height
+		return self.rowHeight + self.ypadding*2
+		
+	def remove(self, control):
+		if control in self.items:
+			index = self.items.index(control)
+			del self.items[index]
+			self.entryControls = dict((i if i < index else i-1, c) for i, c in self.entryControls.iteritems() if i != index)
+			self.sort()
+		else: BorderedControl.remove(self, control)
 		
-	def createWrapperControl(self, control):
-		c = BorderedControl(parent=self, borderWidth=0)
+	def removeAllChildren(self):
+		del self.items[:]
+		del self.rowTops[:]
+		self.contentBottom = self.borderRenderer.borderWidth
+		self.rows.clear()
+		self.entryControls.clear()
+		del self.spareRows[:]
+		self.scrollY = 0
+		BorderedControl.removeAllChildren(self)
+		
+	def createWrapperControl(self, control, index):
+		c = self.spareRows.pop() if self.spareRows else BorderedControl(parent=self, borderWidth=0)
 		c.x = self.xpadding
+		c.y = self.rowTops[index]
 		c.width = self.width - self.xpadding*2
 		c.height = control.height + self.ypadding*2
-		c.borderRenderer.backgroundColor = self.evenColor if len(self.children) % 2 == 0 else self.oddColor
+		c.borderRenderer.backgroundColor = self.evenColor if index % 2 == 0 else self.oddColor
 		c.mouseEnter = self.createMouseEnterFunction(c, control)
 		c.mouseLeave = self.createMouseLeaveFunction(c, control)
 		control.y = (c.height-control.height)/2
@@ -680,17 +960,65 @@ class ListBox(BorderedControl):
 		c.add(control)
 		return c
 		
+	def __releaseRow(self, row):
+		if row in self.mouseOverControls: self.mouseOverControls.remove(row)
+		BorderedControl.remove(self, row)
+		for c in list(row.children): row.remove(c)
+		self.spareRows.append(row)
+		
 	def sort(self):
+		"Lays all the entries out again, for when their controls changed height"
 		y = self.borderRenderer.borderWidth
-		for c in self.children:
-			c.y = y
-			y += c.height
+		del self.rowTops[:]
+		for entry in self.items:
+			self.rowTops.append(y)
+			y += self.__entryHeight(entry)
+		self.contentBottom = y
+		for row in self.rows.values(): self.__releaseRow(row)
+		self.rows.clear()
+		self.showRows()
+		
+	def showRows(self):
+		"""Gives exactly the entries in view rows, keeping the rows of those
+		that were in view already."""
+		top = self.scrollY
+		first = max(bisect_right(self.rowTops, top) - 1, 0)
+		last = bisect_left(self.rowTops, top + self.height)
+		
+		for i in [i for i in self.rows if not first <= i < last]: self.__releaseRow(self.rows.pop(i))
+		for i in xrange(first, last):
+			if i not in self.rows:
+				self.rows[i] = self.createWrapperControl(self.__entryControl(i), i)
+				BorderedControl.add(self, self.rows[i])
+				
+	def __entryControl(self, index):
+		if index not in self.entryControls: self.entryControls[index] = self.rowFactory(self.items[index])
+		return self.entryControls[index]
+		
+	def scrollBy(self, dy):
+		bw = self.borderRenderer.borderWidth
+		self.scrollY = max(0, min(self.scrollY + dy, self.contentBottom + bw - self.height))
+		self.showRows()
+		
+	def scrollTo(self, y):
+		"Scrolls so that the content at y (unscrolled) shows at the top of the list"
+		self.scrollBy(y - self.borderRenderer.borderWidth - self.scrollY)
+		
+	def scrollUp(self): self.scrollBy(-self.scroll_dy)
+	def scrollDown(self): self.scrollBy(self.scroll_dy)
 					
 class ScrollBox(BorderedControl): 
+	"""Control whose children scroll (with the mouse wheel) inside its border.
+	Scrolling just moves the view over them, and only the children in view
+	are drawn.
+	"""
+	
+	undrawnAttributes = BorderedControl.undrawnAttributes | frozenset(['_ScrollBox__bottom'])
 	
 	def __init__(self, **kwargs):
 		BorderedControl.__init__(self, **kwargs)
 		self.scroll_dy = kwargs['scroll_dy'] if 'scroll_dy' in kwargs else 8
+		self.__bottom = None	# (child index it was measured for, lowest child bottom)
 	
 	def preRender(self, surface):
 		self.origClip = surface.get_clip()
@@ -702,6 +1030,9 @@ class ScrollBox(BorderedControl):
 		BorderedControl.postRender(self, surface)
 		surface.set_clip(self.origClip)
 		
+	def childrenInView(self):
+		return self.childIndex().queryRect((0, self.scrollY, self.width, self.height))
+		
 	def mouseDown(self, event):
 		if event.button == 4: self.scrollUp()
 		if event.button == 5: self.scrollDown()
@@ -712,31 +1043,105 @@ class ScrollBox(BorderedControl):
 	def mouseLeave(self, event):
 		self.borderRenderer.borderWidth -= 1
 		
+	def contentBottom(self):
+		"Bottom of the lowest child, measured again only after the children change"
+		index = self.childIndex()
+		if self.__bottom is None or self.__bottom[0] is not index:
+			rects = [index.rectOf(c) for c in self.children]
+			self.__bottom = (index, max([y + h for x, y, w, h in rects] or [0]))
+		return self.__bottom[1]
+		
 	def scrollUp(self): 
-		for c in self.children: 
-			c.yOffset += self.scroll_dy
-			c.yOffset = min(c.yOffset, 0)
+		self.scrollY = max(self.scrollY - self.scroll_dy, 0)
 		
 	def scrollDown(self): 
-		for c in self.children: 
-			c.yOffset -= self.scroll_dy
-			c.yOffset = max(c.yOffset, -c.height)
+		self.scrollY = max(min(self.scrollY + self.scroll_dy, self.contentBottom() - self.height), 0)
 		
+WordPattern = re.compile(r'[^ \n]+')
+
+class TextLayout(object):
+	"""Word wraps text to a width in pixels. Words are measured with
+	font.size once per font and finished layouts are kept by (font, width,
+	text), least recently used first out, so laying out the same text again
+	costs a dictionary lookup. Each line of a layout is text[start:end] for
+	its span, so callers can map offsets in the text onto the lines.
+	"""
+	
+	def __init__(self, maxLayouts=256, maxWords=4096):
+		self.maxLayouts = maxLayouts
+		self.maxWords = maxWords
+		self.layouts = OrderedDict()	# (font, width, text) -> (lines, spans)
+		self.wordWidths = {}			# font -> {word: width}
+		
+	def wordWidth(self, font, word):
+		widths = self.wordWidths.get(font)
+		if widths is None or len(widths) > self.maxWords: widths = self.wordWidths[font] = {}
+		w = widths.get(word)
+		if w is None: w = widths[word] = font.size(word)[0]
+		return w
+	
+	def wrap(self, font, width, text):
+		"""Returns the lines text breaks into at width. Newlines (and, as they
+		always have, runs of two spaces) start a new line; a word too wide for
+		a line of its own gets one anyway.
+		"""
+		return self._layout(font, width, text)[0]
+		
+	def spans(self, font, width, text):
+		"Returns the (start, end) offsets in text of each line wrap returns"
+		return self._layout(font, width, text)[1]
+		
+	def _layout(self, font, width, text):
+		key = (font, width, text)
+		layout = self.layouts.pop(key, None)
+		if layout is None:
+			spans = self._wrap(font, width, text)
+			layout = tuple(text[start:end] for start, end in spans), spans
+			if len(self.layouts) >= self.maxLayouts: self.layouts.popitem(last=False)
+		self.layouts[key] = layout
+		return layout
+		
+	def _wrap(self, font, width, text):
+		space = self.wordWidth(font, ' ')
+		spans = []
+		start, end, lineWidth = None, 0, 0
+		for match in WordPattern.finditer(text):
+			gap = text[end:match.start()]
+			if start is not None and (len(gap) > 1 or '\n' in gap):
+				spans.append((start, end))
+				start = None
+			w = self.wordWidth(font, match.group())
+			if start is not None and lineWidth + space + w > width:
+				spans.append((start, end))
+				start = None
+			if start is None: start, lineWidth = match.start(), w
+			else: lineWidth += space + w
+			end = match.end()
+		if start is not None: spans.append((start, end))
+		return tuple(spans)
+
+layouts = TextLayout()
+
 class MultilineLabel(BorderedControl):
-	"A label control that wraps text up to it's height (and then clips)."
+	"""A label control that wraps text up to it's height (and then clips).
+	The wrapped and rendered text is kept until the text, font, colors or
+	size change.
+	"""
 	
 	def __init__(self, **kwargs):
 		BorderedControl.__init__(self, **kwargs)
 		
 		self.text = kwargs['text'] if 'text' in kwargs else None
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 24)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 24)
 		self.fontColor = kwargs['fontColor'] if 'fontColor' in kwargs else (0,0,0)
 		self.borderRenderer.backgroundColor = kwargs['backgroundColor'] if 'backgroundColor' in kwargs else (0,0,0,0)
+		self.xpadding = kwargs['xpadding'] if 'xpadding' in kwargs else 2
+		self.ypadding = kwargs['ypadding'] if 'ypadding' in kwargs else 2
 		self.width = kwargs['width'] if 'width' in kwargs else self.getIdealSize()[0] if self.text else 0
 		self.height = kwargs['height'] if 'height' in kwargs else self.getIdealSize()[1] if self.text else 0
 		self.borderRenderer.borderWidth = kwargs['borderWidth'] if 'borderWidth' in kwargs else 0
-		self.xpadding = kwargs['xpadding'] if 'xpadding' in kwargs else 2
-		self.ypadding = kwargs['ypadding'] if 'ypadding' in kwargs else 2
+		self.textKey = None
+		self.textSurface = None
 	
 	def __repr__(self): return "Multiline Control"
 
@@ -756,47 +1161,37 @@ class MultilineLabel(BorderedControl):
 	
 	def splitText(self, text):
 		if not text or text == '': return []
-		
-		text = text.replace('\n', '  ')
-		lettersPerLine = (self.width-self.borderRenderer.borderWidth*2) / (self.font.size("l")[0]*1.85) # TODO: Figure out a good way to get an accurate lettersPerLine
-		spacedText = text.split(' ')
-		
-		# divide the spacedText into lines by line length of 40 characters
-		tmp = []
-		currentline = ""
-		for word in spacedText:
-			if word == "": tmp.append(currentline); currentline = ""
-			elif len(currentline) + len(" ") + len(word) > lettersPerLine: tmp.append(currentline); currentline = word + " "
-			else: currentline += word + " "
-		
-		tmp.append(currentline)
-		return [i for i in tmp if i != ""]
+		return list(layouts.wrap(self.font, self._wrapWidth(), text))
+	
+	def _wrapWidth(self): return self.width - self.borderRenderer.borderWidth*2 - self.xpadding
 	
 	def getRenderedTextSize(self, text):
+		if not text or text == "": return (0,0)
+		lines = self.splitText(text)
+		width = max([self.font.size(t)[0] for t in lines] or [0])
+		return (width, self.font.get_linesize() * len(lines))
+	
+	def _getTextKey(self, text):
+		return (text, self.font, self.fontColor, self.borderRenderer.backgroundColor, self.borderRenderer.borderWidth,
+				self.width, self.xpadding, self.ypadding)
 		
-		if not text or text == "": return (0,0)		
-		width, height = 0, 0		
-		ty = 0
-		
-		for t in self.splitText(text):
-			textSurface = self.font.render(t, True, (255,255,255))
-			tsw = textSurface.get_width()
-			width = max(width, tsw)
-			ty += self.font.get_linesize()#textSurface.get_height()
-		height = ty
-		
-		return (width,height)
-		
-	def renderText(self):
-		w,h = self.getRenderedTextSize(self.text)
+	def _createTextSurface(self, text):
+		w,h = self.getRenderedTextSize(text)
 		tmpSurface = pygame.Surface((w+self.xpadding, h+self.ypadding)).convert_alpha()
 		tmpSurface.fill(self.borderRenderer.backgroundColor)
+		return tmpSurface
+		
+	def renderText(self):
+		key = self._getTextKey(self.text)
+		if key == self.textKey: return self.textSurface
+		
+		tmpSurface = self._createTextSurface(self.text)
 		ty = self.ypadding
 		for t in self.splitText(self.text):
-			textSurface = self.font.render(t, True, self.fontColor)
-			tmpSurface.blit(textSurface, (self.xpadding,ty))
+			tmpSurface.blit(fonts.render(self.font, t, True, self.fontColor), (self.xpadding,ty))
 			ty += self.font.get_linesize()
-			
+		
+		self.textKey, self.textSurface = key, tmpSurface
 		return tmpSurface
 			
 	def preRender(self, surface):
@@ -804,10 +1199,13 @@ class MultilineLabel(BorderedControl):
 		surface.blit(self.renderText(), (self.borderRenderer.borderWidth,self.borderRenderer.borderWidth))
 
 class ChattingMultilineLabel(MultilineLabel):
-	"""Does the cool "talking" text that most rpgs have. Currently breaks
-	pretty badly on long texts.
+	"""Does the cool "talking" text that most rpgs have. The whole text is
+	laid out up front, so words appear where they will end up, and each frame
+	only draws the characters revealed since the last one.
 	"""
 	
+	animated = True
+	
 	def __init__(self, **kwargs):
 		MultilineLabel.__init__(self, **kwargs)
 		self.origText = kwargs['text'] if 'text' in kwargs else ''
@@ -817,20 +1215,39 @@ class ChattingMultilineLabel(MultilineLabel):
 		self.pageLength = len(self.origText)
 		self.updateValue = 0
 		self.chatting = True
+		self.revealed = 0
 		
 	def renderText(self):
-		tmpText = self.origText[self.textStart:self.textEnd]
+		fullText = self.origText[self.textStart:]
+		key = self._getTextKey(fullText)
+		if key != self.textKey:
+			self.textKey, self.textSurface = key, self._createTextSurface(fullText)
+			self.revealed = 0
 		
+		tmpText = self.origText[self.textStart:self.textEnd]
 		if len(tmpText) == len(self.origText): self.chatting = False
-		self.text = tmpText[:self.textEnd]
-		retSurface = MultilineLabel.renderText(self)
+		self.text = tmpText
+		
+		# draws just the characters that weren't there last frame
+		reveal = len(tmpText)
+		ty = self.ypadding
+		for start, end in layouts.spans(self.font, self._wrapWidth(), fullText) if fullText else ():
+			if start >= reveal: break
+			if self.revealed < end:
+				line = fullText[start:end]
+				a, b = max(self.revealed, start) - start, min(reveal, end) - start
+				tx = self.xpadding + self.font.size(line[:a])[0]
+				self.textSurface.blit(self.font.render(line[a:b], True, self.fontColor), (tx, ty))
+			ty += self.font.get_linesize()
+		self.revealed = reveal
+		if not self.chatting: self.animated = False
 		
 		self.updateValue += 1
 		if self.updateValue > 1:
 			self.textEnd += self.textPace
 			self.updateValue = 0
 			
-		return retSurface
+		return self.textSurface
 
 class Application(BorderedControl):
 	
@@ -843,38 +1260,90 @@ class Application(BorderedControl):
 		self.focusedControl = None
 		self.done = False
 		self.buffer = None
+		self.redraws = 0
+		self.damage = []
+		self.redrawFont = fonts.getFont(None, 16)
 		
 	def __repr__(self): return "Application"
 			
 	def exit(self, button=None, event=None): self.done = True
+	
+	def renderFrame(self, surface):
+		"""Renders the control tree onto surface, counting how many controls
+		had to be redrawn for it in self.redraws and keeping the rects of
+		surface that changed since the last frame in self.damage.
+		"""
+		global _damage
+		redraws = RedrawCount
+		_damage = []
+		try: self.render(surface)
+		finally: damage, _damage = _damage, None
+		self.redraws = RedrawCount - redraws
+		self.damage = [pygame.Rect(r) for r in damage]
+		
+	def renderRedrawCount(self, surface):
+		txt = fonts.render(self.redrawFont, "redrawn: %d" % self.redraws, True, (255,255,0), (0,0,0))
+		return surface.blit(txt, (surface.get_width()-txt.get_width()-5, 5))
 
 	def run(self):
 		self.buffer = pygame.Surface((self.width, self.height)).convert_alpha()
-		self.buffer.fill(self.borderRenderer.backgroundColor)
+		self.runLoop(self.buffer, (self.x,self.y), self.borderRenderer.backgroundColor)
+		
+	def runLoop(self, buffer, offset, clearColor):
+		"""Handles events and draws the control tree (through buffer, which is
+		shown at offset) until done. Between frames the loop sleeps until
+		there is input or idleTime has passed, it only renders when something
+		was invalidated or animates, and it only pushes the damaged rects to
+		the display. The whole screen is redrawn on the first frame and after
+		another loop has had the display.
+		"""
 		screen = pygame.display.get_surface()
+		screenRect = screen.get_rect()
 		originalSurface = pygame.Surface(screen.get_size())
 		originalSurface.blit(screen, (0,0))
 		old_mouse = pygame.mouse.set_visible(True)
+		ox, oy = offset
+		generation = None
+		countRect = None
 		self.done = False
 		
+		def repaint(r):
+			screen.blit(originalSurface, r, r)
+			screen.blit(buffer, r, r.move(-ox, -oy))
+		
 		while not self.done:
-			self.handleEvents(None)
-			
-			screen.blit(originalSurface, (0,0))			
-			self.render(self.buffer)
-			screen.blit(self.buffer, (self.x,self.y))
-			self.buffer.fill(self.borderRenderer.backgroundColor)
+			if generation != DisplayGeneration or self.needsRedraw() or ShowRedrawCount != bool(countRect):
+				buffer.fill(clearColor)
+				self.renderFrame(buffer)
+				
+				if generation != DisplayGeneration:
+					generation = DisplayGeneration
+					screen.blit(originalSurface, (0,0))
+					screen.blit(buffer, offset)
+					rects = [screenRect]
+				else:
+					rects = [r.move(ox, oy).clip(screenRect) for r in self.damage]
+					if countRect: rects.append(countRect)
+					rects = [r for r in rects if r.width and r.height]
+					for r in rects: repaint(r)
+				
+				countRect = None
+				if ShowRedrawCount:
+					countRect = self.renderRedrawCount(screen)
+					rects.append(countRect)
+				pygame.display.update(rects)
 			
-			pygame.display.flip()
-			pygame.time.wait(self.idleTime)
+			self.handleEvents(waitForEvents(self.idleTime))
 			
 		pygame.mouse.set_visible(old_mouse)
+		displayReleased()
 		
 class Dialog(Application):
 	
 	def __init__(self, dialogText, **kwargs):
 		Application.__init__(self, **kwargs)
 		
+		self.idleTime = kwargs['idleTime'] if 'idleTime' in kwargs else DefaultDialogIdleTime
 		self.width = kwargs['width'] if 'width' in kwargs else (pygame.display.get_surface().get_width()>>1)
 		self.height = kwargs['height'] if 'height' in kwargs else (pygame.display.get_surface().get_height()>>1)
 
@@ -882,7 +1351,7 @@ class Dialog(Application):
 		
 		self.closeButton = Button(text="x", callback=self.exit)
 		
-		self.font = kwargs['font'] if 'font' in kwargs else pygame.font.Font(None, 32)
+		self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(None, 32)
 		self.fontColor = kwargs['fontColor'] if 'fontColor' in kwargs else (255,255,255)
 		self.textLabel = MultilineLabel(parent=self, text=dialogText, font=self.font, fontColor=self.fontColor)
 		self.textLabel.width = self.width - self.closeButton.width - 10
@@ -903,27 +1372,8 @@ class Dialog(Application):
 		self.center()
 		
 	def run(self):
-		
-		screen = pygame.display.get_surface()
-		originalSurface = pygame.Surface(screen.get_size())
-		originalSurface.blit(screen, (0,0))
-		old_mouse = pygame.mouse.set_visible(True)
-		
-		buffer = pygame.Surface(screen.get_size()).convert_alpha()
-		buffer.fill((0,0,0,0))
-		self.done = False
-		
-		while not self.done:
-			self.handleEvents(None)
-			
-			screen.blit(originalSurface, (0,0))
-			self.render(buffer)
-			screen.blit(buffer, (0,0))
-			
-			pygame.display.flip()
-			pygame.time.wait(20)
-			
-		pygame.mouse.set_visible(old_mouse)
+		buffer = pygame.Surface(pygame.display.get_surface().get_size()).convert_alpha()
+		self.runLoop(buffer, (0,0), (0,0,0,0))
 		
 	def center(self):
 		"""Center on the screen"""
@@ -1021,6 +1471,11 @@ class ErrorDialog(Dialog):
 		self.textLabel.backgroundColor = (0,0,0,0)
 			
 class ProgressDialog(Dialog):
+	"""Shows how much of a known amount of work (see addWork) is done. Whoever
+	does the work draws it through updateProgress; it has no loop of its own.
+	"""
+	
+	undrawnAttributes = Dialog.undrawnAttributes | frozenset(['work', 'workDone', 'refreshInterval', 'lastRefresh', 'screenBuffer', 'background'])
 	
 	def __init__(self, text, **kwargs):
 		Dialog.__init__(self, text, **kwargs)
@@ -1033,15 +1488,54 @@ class ProgressDialog(Dialog):
 		self.height += self.progressBar.height + 20
 		self.add(self.progressBar)
 		
+		self.work = kwargs['work'] if 'work' in kwargs else self.progressBar.max
+		self.workDone = 0
+		self.refreshInterval = kwargs['refreshInterval'] if 'refreshInterval' in kwargs else 30
+		self.lastRefresh = None
+		self.screenBuffer = None
+		self.background = None
+		
+	def addWork(self, units):
+		"Adds units to the amount of work the progress bar stands for."
+		self.work += units
+		self.updateProgress(0)
+		
 	def updateProgress(self, step):
-		self.progressBar.value = self.progressBar.value + step
+		"Notes that step more units of work are done and shows the new progress."
+		self.workDone += step
+		self.progressBar.value = self.progressBar.max * min(1.0, float(self.workDone) / self.work) if self.work else self.progressBar.min
+		self.refresh()
 		
 	def start(self):
-		thread = threading.Thread(target=self.run)
-		thread.start()
+		"Shows the dialog; it must be started and updated from the thread that owns the display."
+		screen = pygame.display.get_surface()
+		self.done = False
+		self.background = screen.copy()
+		self.screenBuffer = pygame.Surface(screen.get_size()).convert_alpha()
+		self.refresh(True)
+		
+	def refresh(self, force=False):
+		"Draws the dialog if it was started and refreshInterval ms have passed since it last was."
+		if self.screenBuffer is None or self.done: return
+		now = pygame.time.get_ticks()
+		if not force and self.lastRefresh is not None and now - self.lastRefresh < self.refreshInterval: return
+		self.lastRefresh = now
+		pygame.event.pump() # keeps the window responsive while the caller works
+		
+		screen = pygame.display.get_surface()
+		screenRect = screen.get_rect()
+		self.screenBuffer.fill((0,0,0,0))
+		self.renderFrame(self.screenBuffer)
+		rects = [screenRect] if force else [r.clip(screenRect) for r in self.damage]
+		for r in rects:
+			screen.blit(self.background, r, r)
+			screen.blit(self.screenBuffer, r, r)
+		pygame.display.update(rects)
 	
 	def end(self):
 		self.done = True
+		self.screenBuffer = self.background = None
+		displayReleased()
 			
 class ChatDialog(Dialog):
 	"""Special dialog that "talks", i.e., the text appears bit by bit.
@@ -1050,7 +1544,7 @@ class ChatDialog(Dialog):
 	
 	def __init__(self, text, **kwargs):
 		Dialog.__init__(self, text, **kwargs)
-		self.children.remove(self.textLabel)		
+		self.remove(self.textLabel)
 		self.textLabel = ChattingMultilineLabel(parent=self, width=self.width-self.closeButton.width-10, text=text)
 		self.textLabel.x = 5
 		self.textLabel.y = 5
@@ -1060,7 +1554,7 @@ class ChatDialog(Dialog):
 		self.closeButton.x = self.width - self.closeButton.width
 		
 	def handleEvents(self, events=None):
-		Dialog.handleEvents(self)
+		Dialog.handleEvents(self, events)
 		
 		keys = pygame.key.get_pressed()		
 		if keys[K_SPACE]: self.textLabel.textPace = 10
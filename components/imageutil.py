@@ -1,5 +1,5 @@
 # imageutil.py
-# Slow image manipulation functions that are useful in various situations.
+# Image manipulation functions that are useful in various situations.
 # by Andrew Martin (2006)
 #
 # TODO:
@@ -10,21 +10,25 @@
 #
 
 from math import ceil
+import log
 import math
 import pygame
 import pygame.locals
 import random
 
-def createHorizontalBlendedAlphaMask(surface, start, end):
-    """Takes a surface and applies an alpha mask gradient from start
-    (full alpha) to end (no alpha), returns a new surface with the
-    blend effect. NOTE: this is a per-pixel function, so it takes
-    exponentially longer time with increasing surface dimensions.
-    
-    New: Stops and returns None if the original already has 
-    any sort of alpha component (since this will just mess it up)
-    """
+logger = log.getLogger("imageutil")
+
+try:
+    import numpy
+    import pygame.surfarray
+except ImportError:
+    numpy = None
 
+def _clampRange(start, end, length):
+    """Clamps start and end to [0.0, 1.0] and returns the (start, stop, step)
+    of the pixel rows/columns a gradient covers, with the same rounding the
+    blended alpha mask functions have always used.
+    """
     assert isinstance(start, float), "second parameter must be a float"
     assert isinstance(end, float), "third parameter must be a float"
 
@@ -32,16 +36,67 @@ def createHorizontalBlendedAlphaMask(surface, start, end):
     if end > 1.0: end = 1.0
     if start < 0.0: start = 0.0
     if end < 0.0: end = 0.0
-    
-    new = pygame.Surface.convert_alpha(surface)
 
-    start_w = int(new.get_width() * start)
-    end_w = int(new.get_width() * end)
-    if end_w == 0: end_w = -1
+    start_px = int(length * start)
+    end_px = int(length * end)
+    if end_px == 0: end_px = -1
 
-    if start_w > end_w: step = -1
+    if start_px > end_px: step = -1
     else: step = 1
-        
+    return start_px, end_px, step
+
+def _blendedAlphaMask(surface, start, end, axis):
+    new = pygame.Surface.convert_alpha(surface)
+    start_px, end_px, step = _clampRange(start, end, new.get_size()[axis])
+    alpha_step = 255 / abs(start_px - end_px)
+
+    lines = range(start_px, end_px, step)
+    if lines and max(lines) >= new.get_size()[axis]: return None
+
+    alpha = pygame.surfarray.pixels_alpha(new)
+    try:
+        if axis == 0: region = alpha[lines, :]
+        else: region = alpha[:, lines]
+        if region.size and region.min() < 255: return None # can't use a surface that already has alpha
+
+        ramp = 255 - numpy.arange(len(lines)) * alpha_step
+        if axis == 0: alpha[lines, :] = ramp[:, numpy.newaxis]
+        else: alpha[:, lines] = ramp[numpy.newaxis, :]
+    finally: del alpha # unlocks the surface
+
+    return new
+
+def createHorizontalBlendedAlphaMask(surface, start, end):
+    """Takes a surface and applies an alpha mask gradient from start
+    (full alpha) to end (no alpha), returns a new surface with the
+    blend effect. Works on whole columns of the alpha plane at once
+    when NumPy is available.
+    
+    New: Stops and returns None if the original already has 
+    any sort of alpha component (since this will just mess it up)
+    """
+    if numpy is None: return perPixelHorizontalBlendedAlphaMask(surface, start, end)
+    return _blendedAlphaMask(surface, start, end, 0)
+
+def createVerticalBlendedAlphaMask(surface, start, end):
+    """Takes a surface and applies an alpha mask gradient from start
+    (full alpha) to end (no alpha), returns a new surface with the
+    blend effect. Works on whole rows of the alpha plane at once
+    when NumPy is available.
+    
+    New: Stops and returns None if the original already has 
+    any sort of alpha component (since this will just mess it up)
+    """
+    if numpy is None: return perPixelVerticalBlendedAlphaMask(surface, start, end)
+    return _blendedAlphaMask(surface, start, end, 1)
+
+def perPixelHorizontalBlendedAlphaMask(surface, start, end):
+    """The original get_at/set_at version of createHorizontalBlendedAlphaMask,
+    used when NumPy is missing. NOTE: this is a per-pixel function, so it
+    takes exponentially longer time with increasing surface dimensions.
+    """
+    new = pygame.Surface.convert_alpha(surface)
+    start_w, end_w, step = _clampRange(start, end, new.get_width())
     alpha_step = 255 / abs(start_w-end_w)
     
     for h in xrange(new.get_height()):
@@ -52,7 +107,7 @@ def createHorizontalBlendedAlphaMask(surface, start, end):
                 pixel = new.get_at((w,h))
                 if pixel[3] < 255: return None # can't use a surface that already has alpha 
             except:
-                print "Failed to retrieve pixel at (%s,%s)" % (w,h)
+                logger.warning("Failed to retrieve pixel at (%s,%s)", w, h)
                 return None
             
             new.set_at((w,h), (pixel[0],pixel[1],pixel[2],alpha))
@@ -60,40 +115,22 @@ def createHorizontalBlendedAlphaMask(surface, start, end):
 
     return new
 
-def createVerticalBlendedAlphaMask(surface, start, end):
-    """Takes a surface and applies an alpha mask gradient from start
-    (full alpha) to end (no alpha), returns a new surface with the
-    blend effect. NOTE: this is a per-pixel function, so it takes
-    exponentially longer time with increasing surface dimensions.
-    
-    New: Stops and returns None if the original already has 
-    any sort of alpha component (since this will just mess it up)
+def perPixelVerticalBlendedAlphaMask(surface, start, end):
+    """The original get_at/set_at version of createVerticalBlendedAlphaMask,
+    used when NumPy is missing. NOTE: this is a per-pixel function, so it
+    takes exponentially longer time with increasing surface dimensions.
     """
-
-    assert isinstance(start, float), "second parameter must be a float"
-    assert isinstance(end, float), "third parameter must be a float"
-
-    if start > 1.0: start = 1.0
-    if end > 1.0: end = 1.0
-    if start < 0.0: start = 0.0
-    if end < 0.0: end = 0.0
-    
     new = pygame.Surface.convert_alpha(surface)
-
-    start_h = int(new.get_height() * start)
-    end_h = int(new.get_height() * end)
-    if end_h == 0: end_h = -1
-
-    if start_h > end_h: step = -1
-    else: step = 1
-
+    start_h, end_h, step = _clampRange(start, end, new.get_height())
     alpha_step = 255 / abs(end_h - start_h)
 
     for w in xrange(new.get_width()):
         alpha = 255
         for h in xrange(start_h, end_h, step):
-            pixel = new.get_at((w,h))
-            if pixel[3] < 255: return None
+            try:
+                pixel = new.get_at((w,h))
+                if pixel[3] < 255: return None
+            except IndexError: return None
 
             new.set_at((w,h), (pixel[0],pixel[1],pixel[2],alpha))
             alpha -= alpha_step
@@ -122,8 +159,8 @@ def convertToTiles(surface, width, height):
             surf.blit(surface, (0,0), (dx*width, dy*height, width, height))
             ret.append(surf)
     
-    print "Converted surface with dimensions (%d x %d) into %d tiles of dimension (%d x %d)" % \
-    (surface.get_width(), surface.get_height(), len(ret), width, height)
+    logger.debug("Converted surface with dimensions (%d x %d) into %d tiles of dimension (%d x %d)",
+                 surface.get_width(), surface.get_height(), len(ret), width, height)
     
     return ret
     
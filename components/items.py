@@ -10,6 +10,9 @@
 #
 
 import constants
+import log
+
+logger = log.getLogger("items")
 
 class Item(object):
     "Class representing an item read from the item collection"
@@ -64,7 +67,7 @@ class Inventory(object):
         "Stow the specified item in the pack"
         
         if item in self.stowed: 
-            print "Failed to add item: can't add same item twice"
+            logger.warning("Failed to add item: can't add same item twice")
             return
         
         for i in self.stowed:
@@ -0,0 +1,91 @@
+# loader.py
+# Decodes the images in the data archives (tileset tiles, sprite frames, item
+# pictures) on a pool of worker threads. Workers read and inflate the members
+# and decode them, which pygame does without holding the GIL; the finished
+# surfaces come back through a queue to the calling thread, the only one
+# that converts them for the display.
+#
+
+import Queue
+import atexit
+import configuration
+import pygame
+import threading
+
+# when set, gets addWork(units) before a batch of images is decoded and
+# updateProgress(1) as each one is done (see gui.ProgressDialog)
+progressListener = None
+
+def threadCount():
+    "The number of worker threads, configuration.loader_threads or one per core."
+    if configuration.loader_threads: return configuration.loader_threads
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError): return 1
+
+def decodeImage(archive, name):
+    "Decodes one image member of archive, without converting it."
+    return pygame.image.load(archive.open(name), name)
+
+class ImageLoader(object):
+    "A pool of daemon threads decoding images for loadImages."
+
+    def __init__(self, threads):
+        self.requests = Queue.Queue()
+        self.threads = []
+        for i in xrange(threads):
+            thread = threading.Thread(target=self._work, name="ImageLoader-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            if request is None: return
+            archive, name, results = request
+            try: results.put((name, decodeImage(archive, name), None))
+            except Exception, e: results.put((name, None, e))
+
+    def loadImages(self, archive, names):
+        """Yields (name, surface) for each of names as the workers finish
+        them, in no particular order. Raises the first decoding error.
+        """
+        results = Queue.Queue()
+        for name in names: self.requests.put((archive, name, results))
+        for i in xrange(len(names)):
+            name, surface, error = results.get()
+            if error: raise error
+            yield name, surface
+
+    def stop(self):
+        "Lets the workers finish what they are doing and end."
+        for thread in self.threads: self.requests.put(None)
+        for thread in self.threads: thread.join()
+
+_pool = None
+
+def loadImages(archive, names):
+    """Returns a dict of the image members names of archive (a vfs.Archive),
+    decoded in parallel and converted with convert_alpha. Must be called from
+    the thread that owns the display.
+    """
+    global _pool
+    names = list(names)
+    if progressListener: progressListener.addWork(len(names))
+
+    threads = threadCount()
+    if threads > 1 and len(names) > 1:
+        if _pool is None:
+            _pool = ImageLoader(threads)
+            # daemon threads left waiting at exit complain as the interpreter goes away
+            atexit.register(_pool.stop)
+        decoded = _pool.loadImages(archive, names)
+    else: decoded = ((name, decodeImage(archive, name)) for name in names)
+
+    ret = {}
+    for name, surface in decoded:
+        ret[name] = surface.convert_alpha()
+        if progressListener: progressListener.updateProgress(1)
+    return ret
@@ -0,0 +1,191 @@
+# log.py
+# Leveled logging for Overworld, in place of printing everything through a
+# stdout replacement that walked the stack for every line.
+#
+# Messages are format strings with their arguments. While the writer thread
+# copies records to configuration.log_file and stdout, they are formatted as
+# they are logged, so the file shows the arguments as they were at the time
+# and not after the caller went on to change them. Otherwise they are only
+# formatted when the console reads them (see recent). A message below the
+# current level costs one comparison. Record the calling file, line and
+# function only if configuration.log_caller is set.
+#
+# usage:
+#     import log
+#     logger = log.getLogger("tiles")
+#     logger.debug("Splitting image %s into tiles", name)
+#
+
+from collections import deque
+import Queue
+import atexit
+import configuration
+import os
+import sys
+import threading
+import time
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LevelNames = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+def levelNamed(name):
+    "Returns the level for a name like 'debug' or 'WARNING'."
+    for level, levelName in LevelNames.iteritems():
+        if levelName == name.upper(): return level
+    raise ValueError, "Unknown log level %s" % name
+
+class Record(object):
+    "One logged message, formatted the first time its text is asked for."
+
+    __slots__ = ('time', 'level', 'name', 'message', 'args', 'caller', '_text')
+
+    def __init__(self, level, name, message, args, caller):
+        self.time = time.time()
+        self.level = level
+        self.name = name
+        self.message = message
+        self.args = args
+        self.caller = caller
+        self._text = None
+
+    def __get_text(self):
+        if self._text is None:
+            try: self._text = self.message % self.args if self.args else str(self.message)
+            except Exception, e: self._text = "%r %% %r (could not format: %s)" % (self.message, self.args, e)
+        return self._text
+    text = property(__get_text, None, None, "The message with its arguments filled in")
+
+    def __str__(self):
+        caller = " %s:%d %s()" % self.caller if self.caller else ""
+        return "%s %-7s %s%s: %s" % (time.strftime("%H:%M:%S", time.localtime(self.time)), LevelNames.get(self.level, self.level),
+                                    self.name, caller, self.text)
+
+class Writer(object):
+    """Copies records to a file and a stream on a thread of its own, so that
+    logging never waits for a disk or a terminal.
+    """
+
+    def __init__(self, filename=None, stream=None, streamLevel=INFO):
+        self.file = open(filename, 'a') if filename else None
+        self.stream = stream
+        self.streamLevel = streamLevel
+        self.records = Queue.Queue()
+        self.thread = threading.Thread(target=self._write, name="LogWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, record):
+        self.records.put(record)
+
+    def _write(self):
+        while True:
+            record = self.records.get()
+            if record is None: break
+            line = "%s\n" % record
+            try:
+                if self.file: self.file.write(line)
+                if self.stream and record.level >= self.streamLevel: self.stream.write(line)
+            except (IOError, ValueError): pass
+
+            # flush once the queue has run dry rather than after every line
+            if self.records.empty():
+                for out in (self.file, self.stream):
+                    try:
+                        if out: out.flush()
+                    except (IOError, ValueError): pass
+        if self.file: self.file.close()
+
+    def close(self):
+        "Writes out what is queued and stops the thread."
+        self.records.put(None)
+        self.thread.join()
+
+# the current state is module level so that the level test in the logging
+# methods is as cheap as it can be
+_level = levelNamed(configuration.log_level)
+_caller = configuration.log_caller
+_history = deque(maxlen=configuration.log_history)
+_writer = None
+_loggers = {}
+
+class Logger(object):
+    "Logs messages under a name, usually the module's."
+
+    def __init__(self, name):
+        self.name = name
+
+    def isEnabledFor(self, level): return level >= _level
+
+    def debug(self, message, *args):
+        if _level <= DEBUG: self._log(DEBUG, message, args)
+
+    def info(self, message, *args):
+        if _level <= INFO: self._log(INFO, message, args)
+
+    def warning(self, message, *args):
+        if _level <= WARNING: self._log(WARNING, message, args)
+
+    def error(self, message, *args):
+        if _level <= ERROR: self._log(ERROR, message, args)
+
+    def log(self, level, message, *args):
+        if _level <= level: self._log(level, message, args)
+
+    def _log(self, level, message, args):
+        caller = None
+        if _caller:
+            frame = sys._getframe(2)
+            caller = (os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+        record = Record(level, self.name, message, args, caller)
+        _history.append(record)
+        if _writer:
+            record.text # formatted now, while the arguments are as they were logged
+            _writer.put(record)
+
+    def __repr__(self): return "Logger %s" % self.name
+
+def getLogger(name):
+    "Returns the Logger for name, the same one every time."
+    logger = _loggers.get(name)
+    if logger is None: logger = _loggers[name] = Logger(name)
+    return logger
+
+def setLevel(level):
+    "Sets the lowest level logged, a number or a name."
+    global _level
+    _level = levelNamed(level) if isinstance(level, basestring) else level
+
+def getLevel(): return _level
+
+def setCallerInfo(enabled):
+    "Turns recording the calling file, line and function on or off."
+    global _caller
+    _caller = enabled
+
+def start(filename=None, stream=None, streamLevel=None):
+    """Starts copying records to filename (configuration.log_file when not
+    given, nothing if that is empty) and stream (sys.__stdout__ by default)
+    on a writer thread.
+    """
+    global _writer
+    stop()
+    if filename is None: filename = configuration.log_file
+    if filename and not os.path.isdir(os.path.dirname(filename) or '.'): os.makedirs(os.path.dirname(filename))
+    _writer = Writer(filename, stream or sys.__stdout__,
+                     levelNamed(configuration.log_console_level) if streamLevel is None else streamLevel)
+
+def stop():
+    "Stops the writer thread once it has written out what was logged."
+    global _writer
+    writer, _writer = _writer, None
+    if writer: writer.close()
+
+atexit.register(stop)
+
+def recent(count=None, level=DEBUG):
+    "Returns the text of the last count records of at least level still in memory."
+    records = [r for r in _history if r.level >= level]
+    if count: records = records[-count:]
+    return [str(r) for r in records]
+
+def clear(): _history.clear()
@@ -0,0 +1,269 @@
+# mapformat.py
+# Reading and writing of the binary .map format, plus conversion of the old
+# zipped scene.xml maps.
+#
+# Layout (all values little-endian):
+#
+#   header:  "OWMAP" version(H) tileset(H length + bytes) tileWidth(H)
+#            tileHeight(H) widthInTiles(I) heightInTiles(I)
+#   bands:   "BAND" size(I) followed by size bytes of zlib data, one per
+#            BandRows rows of the map
+#   trailer: "END!"
+#
+# Each band holds, for its cells in row order, packed arrays of base tile
+# counts and roof tile counts (H), every tile index (i) followed by a
+# parallel array of irregular tile name ids (H, 0 for regular tiles), a
+# walkability bitmask and trigger ids (H, 0 for none). Names and trigger ids
+# point into a string table stored at the start of the band, so bands can be
+# written and read one at a time.
+#
+
+from array import array
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
+from zipfile import ZipFile
+import struct
+import sys
+import zlib
+
+Magic = "OWMAP"
+Version = 1
+BandRows = 16
+
+_bandTag = "BAND"
+_endTag = "END!"
+
+class MapFormatError(Exception): pass
+
+def isBinaryMap(fileobj):
+    """Returns True if the file starts with the binary map magic. The file
+    position is left unchanged.
+    """
+    pos = fileobj.tell()
+    magic = fileobj.read(len(Magic))
+    fileobj.seek(pos)
+    return magic == Magic
+
+def _pack(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+def _unpack(typecode, data, offset, count):
+    arr = array(typecode)
+    end = offset + count * arr.itemsize
+    if end > len(data): raise MapFormatError, "Truncated band data"
+    arr.fromstring(data[offset:end])
+    if sys.byteorder != 'little': arr.byteswap()
+    return arr, end
+
+class MapWriter(object):
+    """Writes a map to an open binary file one band at a time. Cells are
+    given in row order as (baseTiles, roofTiles, isWalkable, triggerId), where
+    the tile lists hold (tileIndex, irregularName or None) pairs.
+    """
+
+    def __init__(self, fileobj, tileset, tileWidth, tileHeight, widthInTiles, heightInTiles):
+        self.fileobj = fileobj
+        self.widthInTiles = widthInTiles
+        self.heightInTiles = heightInTiles
+        self.cellsWritten = 0
+        self._resetBand()
+
+        fileobj.write(Magic)
+        fileobj.write(struct.pack("<HH", Version, len(tileset)))
+        fileobj.write(tileset)
+        fileobj.write(struct.pack("<HHII", tileWidth, tileHeight, widthInTiles, heightInTiles))
+
+    def _resetBand(self):
+        self.strings = {}
+        self.baseCounts = array('H')
+        self.roofCounts = array('H')
+        self.tiles = array('i')
+        self.names = array('H')
+        self.walkable = []
+        self.triggers = array('H')
+
+    def _stringId(self, s):
+        if s is None: return 0
+        if isinstance(s, unicode): s = s.encode('utf-8')
+        if s not in self.strings: self.strings[s] = len(self.strings) + 1
+        return self.strings[s]
+
+    def writeCell(self, baseTiles, roofTiles, isWalkable, triggerId):
+        self.baseCounts.append(len(baseTiles))
+        self.roofCounts.append(len(roofTiles))
+        for tileIndex, name in baseTiles:
+            self.tiles.append(tileIndex)
+            self.names.append(self._stringId(name))
+        for tileIndex, name in roofTiles:
+            self.tiles.append(tileIndex)
+            self.names.append(self._stringId(name))
+        self.walkable.append(isWalkable)
+        self.triggers.append(self._stringId(triggerId))
+
+        self.cellsWritten += 1
+        if len(self.baseCounts) == BandRows * self.widthInTiles: self._flushBand()
+
+    def _flushBand(self):
+        cells = len(self.baseCounts)
+        if not cells: return
+
+        mask = array('B', [0]) * ((cells + 7) / 8)
+        for i, w in enumerate(self.walkable):
+            if w: mask[i >> 3] |= 1 << (i & 7)
+
+        strings = sorted(self.strings, key=self.strings.get)
+        parts = [struct.pack("<IIH", cells, len(self.tiles), len(strings))]
+        for s in strings: parts.append(struct.pack("<H", len(s)) + s)
+        parts += [_pack(self.baseCounts), _pack(self.roofCounts), _pack(self.tiles),
+                  _pack(self.names), mask.tostring(), _pack(self.triggers)]
+
+        data = zlib.compress("".join(parts))
+        self.fileobj.write(_bandTag + struct.pack("<I", len(data)))
+        self.fileobj.write(data)
+        self._resetBand()
+
+    def close(self):
+        """Writes any pending band and the trailer. Does not close the file."""
+        if self.cellsWritten != self.widthInTiles * self.heightInTiles:
+            raise MapFormatError, "Expected %d cells, got %d" % (self.widthInTiles * self.heightInTiles, self.cellsWritten)
+        self._flushBand()
+        self.fileobj.write(_endTag)
+
+class MapReader(object):
+    """Reads a map written by MapWriter. The header fields are available as
+    soon as the reader is created; cells are decoded one band at a time.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+        if fileobj.read(len(Magic)) != Magic: raise MapFormatError, "Not a binary map file"
+        version, tilesetLength = self._read("<HH")
+        if version > Version: raise MapFormatError, "Unsupported map version %d" % version
+        self.version = version
+        self.tileset = fileobj.read(tilesetLength)
+        self.tileWidth, self.tileHeight, self.widthInTiles, self.heightInTiles = self._read("<HHII")
+
+    def _read(self, fmt):
+        size = struct.calcsize(fmt)
+        data = self.fileobj.read(size)
+        if len(data) != size: raise MapFormatError, "Unexpected end of map file"
+        return struct.unpack(fmt, data)
+
+    def __len__(self): return self.widthInTiles * self.heightInTiles
+
+    def close(self): self.fileobj.close()
+
+    def bands(self):
+        """Yields the packed arrays of each band as a tuple (baseCounts,
+        roofCounts, tiles, names, walkableMask, triggers, strings), where
+        strings[0] is None.
+        """
+        while True:
+            tag = self.fileobj.read(4)
+            if tag == _endTag: return
+            if tag != _bandTag: raise MapFormatError, "Corrupt map file (found %r)" % tag
+            size, = self._read("<I")
+            data = self.fileobj.read(size)
+            if len(data) != size: raise MapFormatError, "Unexpected end of map file"
+            try: data = zlib.decompress(data)
+            except zlib.error, e: raise MapFormatError, "Corrupt map band (%s)" % e
+            yield self._decodeBand(data)
+
+    def _decodeBand(self, data):
+        try:
+            cells, tileCount, stringCount = struct.unpack_from("<IIH", data)
+            offset = struct.calcsize("<IIH")
+            strings = [None]
+            for i in xrange(stringCount):
+                length, = struct.unpack_from("<H", data, offset)
+                offset += 2
+                strings.append(data[offset:offset+length])
+                offset += length
+        except struct.error: raise MapFormatError, "Truncated band header"
+
+        baseCounts, offset = _unpack('H', data, offset, cells)
+        roofCounts, offset = _unpack('H', data, offset, cells)
+        tiles, offset = _unpack('i', data, offset, tileCount)
+        names, offset = _unpack('H', data, offset, tileCount)
+        mask, offset = _unpack('B', data, offset, (cells + 7) / 8)
+        triggers, offset = _unpack('H', data, offset, cells)
+        return baseCounts, roofCounts, tiles, names, mask, triggers, strings
+
+    def cells(self):
+        """Yields every cell in row order as (baseTiles, roofTiles, isWalkable,
+        triggerId), the same shape MapWriter.writeCell takes.
+        """
+        for baseCounts, roofCounts, tiles, names, mask, triggers, strings in self.bands():
+            t = 0
+            for i in xrange(len(baseCounts)):
+                n = baseCounts[i]
+                base = [(tiles[j], strings[names[j]]) for j in xrange(t, t+n)]
+                t += n
+                n = roofCounts[i]
+                roof = [(tiles[j], strings[names[j]]) for j in xrange(t, t+n)]
+                t += n
+                yield base, roof, bool(mask[i >> 3] & (1 << (i & 7))), strings[triggers[i]]
+
+def convertXmlMap(xmlFile, fileobj):
+    """Streams an old style scene.xml (as stored inside the zipped .map files)
+    into the binary format, writing to fileobj. Returns the MapWriter used.
+    """
+    writer = None
+    tileset = tw = th = None
+
+    for event, elem in iterparse(xmlFile, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "tilefactory":
+                tileset = elem.get("tileset").encode('utf-8')
+                tw, th = int(elem.get("tilewidth")), int(elem.get("tileheight"))
+            elif elem.tag == "tilestacks":
+                if tileset is None: raise MapFormatError, "Map has no tilefactory before its tilestacks"
+                writer = MapWriter(fileobj, tileset, tw, th, int(elem.get("width")), int(elem.get("height")))
+        elif elem.tag == "tilestack":
+            layers = []
+            for layer in ("base", "roof"):
+                layerElem = elem.find(layer)
+                tiles = layerElem.findall("tile") if layerElem is not None else []
+                layers.append([(int(t.get("index")), t.get("name")) for t in tiles])
+            trigger = elem.get("trigger")
+            writer.writeCell(layers[0], layers[1], elem.get("walkable") != "False",
+                             None if trigger == "None" else trigger)
+            elem.clear()
+
+    if not writer: raise MapFormatError, "Map has no tilestacks"
+    writer.close()
+    return writer
+
+def openMap(filename):
+    """Returns a MapReader for the named map file. Old zipped xml maps are
+    converted in memory first.
+    """
+    f = open(filename, 'rb')
+    if isBinaryMap(f): return MapReader(f)
+    f.close()
+
+    z = ZipFile(filename)
+    try: xmlFile = StringIO(z.read("scene.xml"))
+    finally: z.close()
+
+    converted = StringIO()
+    convertXmlMap(xmlFile, converted)
+    converted.seek(0)
+    return MapReader(converted)
+
+if __name__ == '__main__':
+
+    # converts old zipped xml maps: python mapformat.py old.map new.map
+    if len(sys.argv) != 3:
+        print "usage: %s <xml map> <binary map>" % sys.argv[0]
+        sys.exit(1)
+
+    reader = openMap(sys.argv[1])
+    out = open(sys.argv[2], 'wb')
+    out.write(reader.fileobj.getvalue())
+    out.close()
+    print "Converted %d tilestacks" % len(reader)
@@ -1,12 +1,18 @@
+from characters import Actor
 from math import ceil
 from pygame.locals import *
-import engine
+import configuration
+import fonts
 import gui
+import log
+import os
 import pygame
 import scene
 import subscreens
 import tiles
 
+logger = log.getLogger("modes")
+
 class PlayMode(object):
     "Input functionality for play mode defined here."
     
@@ -16,7 +22,7 @@ class PlayMode(object):
     def addItemCb(self, event, control):
         fl = self.engine.scene.itemCollector.createItem(self.engine.scene.player, control.text)
         self.engine.scene.player.inventory.stowItem(fl)
-        print "Added %s to player inventory" % fl.name
+        logger.info("Added %s to player inventory", fl.name)
     
     def handleInput(self):
 
@@ -27,31 +33,38 @@ class PlayMode(object):
                 if e.key == K_ESCAPE: self.showMenu()
                
                 elif e.key == K_i:
-                    gui.ControlDialog("Choose item:", [gui.Button(text=item, callback=self.addItemCb) for item in self.engine.scene.itemCollector.items.keys()]).run()
+                    self.engine.openOverlay(gui.ControlDialog("Choose item:", [gui.Button(text=item, callback=self.addItemCb) for item in self.engine.scene.itemCollector.items.keys()]))
                     
                 elif e.key == K_m:
                     self.engine.mode = self.engine.modes["edit"]
                     
                 elif e.key == K_TAB:
-                    subscreens.Subscreen(self.engine.scene).run()
+                    self.engine.openOverlay(subscreens.Subscreen(self.engine.scene), pauseScene=True)
                                         
                 elif e.key == K_BACKQUOTE:
-                    console = engine.Console(self.engine)
-                    console.run()
+                    self.engine.showConsole()
                     
                 elif e.key == K_SPACE:
                     # perform the "main" action: initiate dialog, open chests, etc.
                     self.engine.scene.performPlayerAction()
                     
+                elif e.key == K_F3:
+                    self.engine.toggleProfiler()
+                    
+                elif e.key == K_F4:
+                    self.engine.exportProfile()
+                    
                 elif e.key == K_F1:
                     help = """
 `: show console
 TAB: show party screen
 m: switch to edit mode
 i: add an item to player inventory
+F3: show/hide frame timings
+F4: save frame timings to a csv file
 ESC: quit Overworld"""
 
-                    gui.Dialog(help).run()
+                    self.engine.openOverlay(gui.Dialog(help))
                 
             elif e.type == QUIT:
                 self.engine.done = True
@@ -67,6 +80,8 @@ ESC: quit Overworld"""
         "Play mode needs no special rendering"
         pygame.mouse.set_visible(True)
         
+    def getDirtyRects(self, surface): return []
+        
     def showMenu(self):        
         "Displays the options available while in edit mode."
         def quitButtonCb(event, button):
@@ -80,7 +95,7 @@ ESC: quit Overworld"""
         quitButton = gui.Button(text="Quit", callback=quitButtonCb)
         controls = [editModeButton, quitButton]
         cd = gui.ControlDialog("Play Mode", controls, width=300)
-        cd.run()
+        self.engine.openOverlay(cd, pauseScene=True)
     
 class EditMode(object):
 
@@ -95,6 +110,8 @@ class EditMode(object):
         self.selectedTile = 0
         self.selectMode = False
         self.sceneDirty = False
+        self.lastOverlay = None
+        self.sceneLoader = None
         
     def __repr__(self): return "Edit Mode"
     
@@ -118,35 +135,36 @@ class EditMode(object):
                     old = self.layerInUse
                     if old == "base": self.layerInUse = "roof"
                     else: self.layerInUse = "base"                        
-                    print "Changing layer from %s to %s" % (old, self.layerInUse)
+                    logger.info("Changing layer from %s to %s", old, self.layerInUse)
                 elif e.key == K_s:
                     self.selectMode = not self.selectMode
                 elif e.key == K_t:
                     old = self.middleClickAction
                     if old == "walk": self.middleClickAction = "trigger"
                     else: self.middleClickAction = "walk"                    
-                    print "Changing middle click from %s to %s" % (old, self.middleClickAction)
+                    logger.info("Changing middle click from %s to %s", old, self.middleClickAction)
                 elif e.key == K_w:
                     self.walkPaintMode = not self.walkPaintMode
-                    print "Changing walk paint mode from %s to %s" % (not self.walkPaintMode, self.walkPaintMode)
+                    logger.info("Changing walk paint mode from %s to %s", not self.walkPaintMode, self.walkPaintMode)
                 elif e.key == K_a:
                     npc = Actor(self.scene, "../data/spritesets/guy.zip")
-                    subscreens.CharacterScreen(npc, editable=True).run()
-                    self.scene.addActorToScene(npc)
-                    self.sceneDirty = True
+                    self.engine.openOverlay(subscreens.CharacterScreen(npc, editable=True), pauseScene=True,
+                                            onClose=lambda screen: self.addActor(screen.character))
                 elif e.key == K_p:
-                    subscreens.CharacterScreen(self.scene.player, editable=True).run()
+                    self.engine.openOverlay(subscreens.CharacterScreen(self.scene.player, editable=True), pauseScene=True)
                 elif e.key == K_n:
                     c = self.scene.createCharacter()                    
                     self.scene.addPlayerToParty(c)
                     self.sceneDirty = True
                 elif e.key == K_TAB:
                     ts = tiles.TileSelector(self.scene)
-                    ts.show()
-                    self.selectedTile = ts.selectedTile 
+                    self.engine.openOverlay(ts.app, pauseScene=True, onClose=lambda app: self.selectTile(ts.selectedTile))
                 elif e.key == K_BACKQUOTE:
-                    console = engine.Console(self.engine)
-                    console.run()
+                    self.engine.showConsole()
+                elif e.key == K_F3:
+                    self.engine.toggleProfiler()
+                elif e.key == K_F4:
+                    self.engine.exportProfile()
                 elif e.key == K_F1:
                     help = """
 Help:
@@ -155,6 +173,8 @@ N: add new actor to party
 TAB: show tile selector
 `: show console
 F1: this help
+F3: show/hide frame timings
+F4: save frame timings to a csv file
 M: change to play mode
 W: change walk painting mode
 T: change to trigger painting mode
@@ -165,7 +185,7 @@ P: edit the main player character"""
 
                     d = gui.Dialog(help)
                     #d.textLabel.font = pygame.font.Font(configuration.monofont, 14)
-                    d.run()
+                    self.engine.openOverlay(d)
                                         
             elif e.type == MOUSEBUTTONDOWN:
                 if e.button == 1: self.pressingLeftButton = True
@@ -192,6 +212,33 @@ P: edit the main player character"""
         if self.pressingMiddleButton: self.handleMiddleButton()
         if self.pressingRightButton: self.handleRightButton()
         
+    def addActor(self, actor):
+        self.scene.addActorToScene(actor)
+        self.sceneDirty = True
+        
+    def selectTile(self, tile): self.selectedTile = tile
+    
+    def loadScene(self, filename):
+        """Loads the scene file in the background (see scene.SceneLoader) behind a
+        progress dialog; closing the dialog cancels the load. The current scene
+        keeps running until the new one is ready to take its place.
+        """
+        if self.sceneLoader: self.sceneLoader.cancel()
+        dialog = gui.ProgressDialog('Loading "%s"...' % os.path.splitext(os.path.basename(filename))[0], work=0)
+        
+        def onLoaded(scene):
+            self.engine.scene = scene
+            self.sceneDirty = False
+            dialog.done = True
+        def onFailed(message):
+            dialog.done = True
+            self.engine.openOverlay(gui.ErrorDialog(message))
+            
+        loader = self.sceneLoader = scene.SceneLoader(filename, self.engine, onLoaded, onFailed, dialog)
+        self.engine.openOverlay(dialog, onClose=lambda ui: loader.cancel())
+        self.engine.addTask(loader)
+        loader.start()
+        
     def handleLeftButton(self):
         self.sceneDirty = True
         mousePos = pygame.mouse.get_pos()
@@ -200,7 +247,8 @@ P: edit the main player character"""
             if self.selectionStartY == -1: self.selectionStartY = mousePos[1]
             
         else:
-            ts = self.engine.scene.getTilestackAt(self.scene.viewport.x+mousePos[0], self.scene.viewport.y+mousePos[1])
+            vx, vy = self.scene._drawnViewport()
+            ts = self.engine.scene.getTilestackAt(vx+mousePos[0], vy+mousePos[1])
             if self.layerInUse == "base":
                 if isinstance(self.selectedTile, int):                
                     ts.addBaseTile(tiles.Tile(self.tileFactory, self.selectedTile))
@@ -216,12 +264,12 @@ P: edit the main player character"""
         rows = int(ceil(float(itw) / self.tileFactory.tileWidth))
         cols = int(ceil(float(ith) / self.tileFactory.tileHeight))
         
+        vx, vy = self.scene._drawnViewport()
         px, py, i = 0, 0, 0
         roofRows = int(rows / 3) # one-third of rows should be roof, subscribing to the "2/3" view we are using
         for c in range(cols):
             for r in range(rows):
-                ts = self.scene.getTilestackAt(self.scene.viewport.x+mousePos[0]+px, 
-                                               self.scene.viewport.y+mousePos[1]+py)
+                ts = self.scene.getTilestackAt(vx+mousePos[0]+px, vy+mousePos[1]+py)
                 if c <= roofRows: 
                     if remove: ts.removeTopRoofTile()
                     else: ts.addRoofTile(tiles.IrregularTile(self.tileFactory, self.selectedTile, i))
@@ -236,12 +284,13 @@ P: edit the main player character"""
     def handleMiddleButton(self):
         self.sceneDirty = True
         mousePos = pygame.mouse.get_pos()
-        ts = self.engine.scene.getTilestackAt(self.scene.viewport.x+mousePos[0], self.scene.viewport.y+mousePos[1])
+        vx, vy = self.scene._drawnViewport()
+        ts = self.engine.scene.getTilestackAt(vx+mousePos[0], vy+mousePos[1])
         if self.middleClickAction == "walk": ts.isWalkable = self.walkPaintMode
         else:
             id = gui.InputDialog("Enter trigger ID:")
             id.run()
-            print "Received trigger id: %s" % id.textInput.text
+            logger.debug("Received trigger id: %s", id.textInput.text)
             if id.textInput.text and id.textInput.text != "":
                 triggerId = id.textInput.text.replace(" ", "_")
                 ts.triggerId = triggerId
@@ -250,7 +299,8 @@ P: edit the main player character"""
     def handleRightButton(self):
         self.sceneDirty = True
         mousePos = pygame.mouse.get_pos()        
-        ts = self.scene.getTilestackAt(self.scene.viewport.x+mousePos[0], self.scene.viewport.y+mousePos[1])
+        vx, vy = self.scene._drawnViewport()
+        ts = self.scene.getTilestackAt(vx+mousePos[0], vy+mousePos[1])
         
         if type(self.selectedTile) is str:
             # remove the whole irregular tile from the current spot
@@ -260,9 +310,40 @@ P: edit the main player character"""
             else: ts.removeTopRoofTile()
         self.pressingRightButton = False
         
+    def _getPointerRect(self, x, y):
+        "Screen rect of the selection box or tile preview drawn at the mouse, if any"
+        if self.selectMode:
+            if self.selectionStartX != -1 and self.selectionStartY != -1:
+                r = pygame.Rect(self.selectionStartX, self.selectionStartY, x-self.selectionStartX, y-self.selectionStartY)
+                r.normalize()
+                return r.inflate(2, 2)
+        elif isinstance(self.selectedTile, str):
+            tileToPlace = self.tileFactory.irregularTiles[self.selectedTile][0]
+            tx, ty = (x/self.tileFactory.tileWidth)*self.tileFactory.tileWidth, (y/self.tileFactory.tileHeight)*self.tileFactory.tileHeight
+            return pygame.Rect(tx, ty, tileToPlace.get_width(), tileToPlace.get_height())
+        return None
+        
+    def getDirtyRects(self, surface):
+        "Screen rects where the edit mode overlay will differ from the last frame"
+        vx, vy = self.scene._drawnViewport()
+        x,y = pygame.mouse.get_pos()
+        ts = self.scene.getTilestackAt(vx+x, vy+y)
+        
+        hud = (self.layerInUse, self.selectMode, self.middleClickAction, self.walkPaintMode, ts.triggerId)
+        pointer = self._getPointerRect(x, y)
+        overlay, last = (hud, pointer), self.lastOverlay
+        self.lastOverlay = overlay
+        if overlay == last: return []
+        
+        ret = []
+        if not last or last[0] != hud: ret.append(pygame.Rect(0, surface.get_height()-70, surface.get_width(), 70))
+        if pointer: ret.append(pointer)
+        if last and last[1]: ret.append(last[1])
+        return ret
+        
     def render(self, surface):        
         "Edit mode special renderings"
-        vx, vy = self.scene.viewport.x, self.scene.viewport.y
+        vx, vy = self.scene._drawnViewport()
         x,y = pygame.mouse.get_pos()
         
         tmpSurface = pygame.Surface(surface.get_size()).convert_alpha()
@@ -270,26 +351,26 @@ P: edit the main player character"""
 
         txtStart = tmpSurface.get_height()-70
         
-        layerTxt = self.engine.font.render("Layer: %s" % self.layerInUse, True, (200,200,200))
+        layerTxt = fonts.render(self.engine.font, "Layer: %s" % self.layerInUse, True, (200,200,200))
         tmpSurface.blit(layerTxt, (10, txtStart))
         
         txtStart += 15        
-        selectModeTxt = self.engine.font.render("Select mode: %s" % self.selectMode, True, (200,200,200))
+        selectModeTxt = fonts.render(self.engine.font, "Select mode: %s" % self.selectMode, True, (200,200,200))
         tmpSurface.blit(selectModeTxt, (10, txtStart))
         
         txtStart += 15        
-        middleClickModeTxt = self.engine.font.render("Middle-click mode: %s" % self.middleClickAction, True, (200,200,200))
+        middleClickModeTxt = fonts.render(self.engine.font, "Middle-click mode: %s" % self.middleClickAction, True, (200,200,200))
         tmpSurface.blit(middleClickModeTxt, (10, txtStart))
                 
         if self.middleClickAction == "walk":
             txtStart += 15
-            walkModeTxt = self.engine.font.render("Walk Paint Mode: %s" % self.walkPaintMode, True, (200,200,200))
+            walkModeTxt = fonts.render(self.engine.font, "Walk Paint Mode: %s" % self.walkPaintMode, True, (200,200,200))
             tmpSurface.blit(walkModeTxt, (10, txtStart))
         
         ts = self.scene.getTilestackAt(vx+x, vy+y)
         if ts.triggerId:
             txtStart += 15
-            triggerTxt = self.engine.font.render("Trigger id: %s" % ts.triggerId, True, (200,200,200))
+            triggerTxt = fonts.render(self.engine.font, "Trigger id: %s" % ts.triggerId, True, (200,200,200))
             tmpSurface.blit(triggerTxt, (10, txtStart))
             
         if self.selectMode:
@@ -324,15 +405,12 @@ P: edit the main player character"""
             lcd = gui.ControlDialog("Scene filename:", controls, width=300)
             lcd.run()
         def loadMapFileCb(event, button):
-            scene = Scene.load(os.path.join(configuration.mapdir, button.text+'.map'), self.engine)
-            if not scene: return
-            self.engine.scene = scene
-            self.engine.scene.initScene()
+            self.loadScene(os.path.join(configuration.mapdir, button.text+'.map'))
             button.ancestor.exit(None)
             cd.exit(None)
         def addCharacterButtonCb(button, event):
             c = self.scene.createCharacter()
-            self.scene.actors.append(c)
+            self.scene.addActorToScene(c)
             cd.exit(None)
         def quitButtonCb(event, button):
             button.ancestor.done = True
@@ -377,6 +455,6 @@ P: edit the main player character"""
         addCharacterButton = gui.Button(text="Add Character", callback=addCharacterButtonCb)
         controls = [playModeButton, newSceneButton, addCharacterButton, saveMapButton, loadMapButton, quitButton]
         cd = gui.ControlDialog("Edit Mode", controls, width=300)
-        print "Control Dialog dimensions: %d x %d" % (cd.width, cd.height)
-        print "Control Dialog position: (%d, %d)" % (cd.x, cd.y)
-        cd.run()
+        logger.debug("Control Dialog dimensions: %d x %d", cd.width, cd.height)
+        logger.debug("Control Dialog position: (%d, %d)", cd.x, cd.y)
+        self.engine.openOverlay(cd, pauseScene=True)
@@ -0,0 +1,245 @@
+# profiler.py
+# Per frame timings of the engine's phases and the scene's passes, along with
+# counts of the work done in them (tiles blitted, actors drawn, scripts run).
+#
+# Code is timed in named scopes; names are dotted by the phase they belong
+# to ("render", "render.tiles", ...), and time spent in a scope several
+# times in a frame adds up. The engine closes each frame with endFrame, which
+# keeps the last configuration.profile_frames frames for stats, the
+# ProfilerView overlay and exportCsv. While profiling is off, scope and
+# count do next to nothing.
+#
+# usage:
+#     import profiler
+#     with profiler.scope("render.actors"):
+#         ...
+#     profiler.count("actors drawn", len(drawList))
+#
+
+from collections import deque
+import configuration
+import csv
+import fonts
+import math
+import os
+import pygame
+import sys
+import time
+
+# time.clock is the fine grained clock on windows, time.time everywhere else
+timer = time.clock if sys.platform == 'win32' else time.time
+
+FrameScope = "frame"
+
+class Frame(object):
+    "The milliseconds spent in each scope and the counters of one frame."
+
+    __slots__ = ('time', 'scopes', 'counters')
+
+    def __init__(self, time, scopes, counters):
+        self.time = time
+        self.scopes = scopes
+        self.counters = counters
+
+class Scope(object):
+    """Adds the time spent in a with block to the frame under name. There is
+    one Scope per name, so a scope must not be entered again from within
+    itself.
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = timer()
+
+    def __exit__(self, *exc):
+        _scopes[self.name] = _scopes.get(self.name, 0.0) + (timer() - self.start) * 1000.0
+
+class NullScope(object):
+    "What scope gives out while profiling is off."
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+class Stats(object):
+    "Min, average, 99th percentile and max of a scope or counter over the frames kept."
+
+    __slots__ = ('min', 'avg', 'p99', 'max', 'last')
+
+    def __init__(self, values, last):
+        values = sorted(values)
+        self.min = values[0]
+        self.avg = sum(values) / float(len(values))
+        self.p99 = values[int(math.ceil(len(values) * 0.99)) - 1]
+        self.max = values[-1]
+        self.last = last
+
+    def __repr__(self):
+        return "min %.2f avg %.2f p99 %.2f max %.2f last %.2f" % (self.min, self.avg, self.p99, self.max, self.last)
+
+# the state is module level, like the log's, so that scopes cost as little
+# as they can
+enabled = configuration.profiling
+_frames = deque(maxlen=configuration.profile_frames)
+_scopes = {}
+_counters = {}
+_scopeObjects = {}
+_nullScope = NullScope()
+_frameStart = None
+
+def scope(name):
+    "Returns the Scope timing name, for a with statement."
+    if not enabled: return _nullScope
+    ret = _scopeObjects.get(name)
+    if ret is None: ret = _scopeObjects[name] = Scope(name)
+    return ret
+
+def count(name, n=1):
+    "Adds n to the counter name for this frame."
+    if enabled: _counters[name] = _counters.get(name, 0) + n
+
+def endFrame():
+    """Closes the frame begun by the previous call, its time being the time
+    between the two, and begins the next.
+    """
+    global _scopes, _counters, _frameStart
+    now = timer()
+    if enabled and _frameStart is not None: _frames.append(Frame((now - _frameStart) * 1000.0, _scopes, _counters))
+    _frameStart = now
+    _scopes, _counters = {}, {}
+
+def setEnabled(on):
+    "Turns profiling on or off, leaving the frames already kept."
+    global enabled, _frameStart
+    enabled = on
+    _frameStart = None
+
+def frames(count=None):
+    "Returns the last count frames kept (all of them when count is None), oldest first."
+    ret = list(_frames)
+    return ret[-count:] if count else ret
+
+def clear():
+    global _frameStart
+    _frames.clear()
+    _frameStart = None
+
+def scopeNames():
+    "The names of the scopes timed in the frames kept, in order, so phases come before their parts."
+    names = set()
+    for frame in _frames: names.update(frame.scopes)
+    return sorted(names)
+
+def counterNames():
+    names = set()
+    for frame in _frames: names.update(frame.counters)
+    return sorted(names)
+
+def stats(name):
+    """Returns the Stats of scope name (FrameScope for the frame time) over
+    the frames it was timed in, None if it wasn't.
+    """
+    if name == FrameScope: values = [frame.time for frame in _frames]
+    else: values = [frame.scopes[name] for frame in _frames if name in frame.scopes]
+    return Stats(values, values[-1]) if values else None
+
+def counterStats(name):
+    "Returns the Stats of counter name over all the frames kept (zero where nothing was counted)."
+    values = [frame.counters.get(name, 0) for frame in _frames]
+    return Stats(values, values[-1]) if values else None
+
+def exportCsv(filename=None, count=None):
+    """Writes the last count frames kept (all of them when count is None) to
+    filename (configuration.profile_csv by default), one row per frame with
+    the time of each scope in milliseconds and each counter. Returns the
+    filename.
+    """
+    if filename is None: filename = configuration.profile_csv
+    rows = frames(count)
+    scopeColumns, counterColumns = scopeNames(), counterNames()
+
+    if not os.path.isdir(os.path.dirname(filename) or '.'): os.makedirs(os.path.dirname(filename))
+    f = open(filename, 'wb')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(["frame", "frame ms"] + ["%s ms" % name for name in scopeColumns] + counterColumns)
+        for i, frame in enumerate(rows):
+            writer.writerow([i, "%.3f" % frame.time] + ["%.3f" % frame.scopes.get(name, 0.0) for name in scopeColumns] +
+                            [frame.counters.get(name, 0) for name in counterColumns])
+    finally: f.close()
+    return filename
+
+class ProfilerView(object):
+    """Draws the scope and counter stats and a graph of the last frame times
+    over the game (see Engine.toggleProfiler). It is only rendered again
+    every configuration.profile_view_interval milliseconds.
+    """
+
+    GraphHeight = 60
+    GraphScale = 50.0 # ms at the top of the graph
+    Budgets = (1000.0 / 60, 1000.0 / 30) # lines across the graph at 60 and 30 fps
+
+    def __init__(self, **kwargs):
+        self.font = kwargs['font'] if 'font' in kwargs else fonts.getFont(configuration.monofont, 12)
+        self.color = kwargs['color'] if 'color' in kwargs else (200,200,200)
+        self.surface = None
+        self.updated = 0
+
+    def lines(self):
+        "The text of the view, one string per line."
+        ret = ["%-18s %7s %7s %7s %7s" % ("ms", "last", "min", "avg", "p99")]
+        for name in [FrameScope] + scopeNames():
+            s = stats(name)
+            if s: ret.append("%-18s %7.2f %7.2f %7.2f %7.2f" % (name, s.last, s.min, s.avg, s.p99))
+        for name in counterNames():
+            s = counterStats(name)
+            ret.append("%-18s %7d %7d %7.1f %7d" % (name, s.last, s.min, s.avg, s.p99))
+        return ret
+
+    def update(self, topright):
+        """Renders the view again if it is due. Returns the screen rects it
+        covered before and after with its topright corner at topright, or []
+        when it did not change.
+        """
+        now = pygame.time.get_ticks()
+        if self.surface and now - self.updated < configuration.profile_view_interval: return []
+        old = self.surface
+        self.surface = self._render()
+        self.updated = now
+        ret = [self.surface.get_rect(topright=topright)]
+        if old: ret.append(old.get_rect(topright=topright))
+        return ret
+
+    def render(self, surface, topright):
+        if not self.surface: self.update(topright)
+        surface.blit(self.surface, self.surface.get_rect(topright=topright))
+
+    def _render(self):
+        lines = [fonts.render(self.font, line, True, self.color) for line in self.lines()]
+        lineHeight = self.font.get_linesize()
+        width = max(line.get_width() for line in lines) + 10
+        height = len(lines) * lineHeight + self.GraphHeight + 15
+
+        ret = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+        ret.fill((0,0,0,160))
+        for i, line in enumerate(lines): ret.blit(line, (5, 5 + i * lineHeight))
+        self._drawGraph(ret, pygame.Rect(5, height - self.GraphHeight - 5, width - 10, self.GraphHeight))
+        return ret
+
+    def _drawGraph(self, surface, rect):
+        pygame.draw.rect(surface, (80,80,80,255), rect, 1)
+        for budget in self.Budgets:
+            y = rect.bottom - int(rect.height * budget / self.GraphScale)
+            pygame.draw.line(surface, (80,80,160,255), (rect.left, y), (rect.right - 1, y))
+
+        # one column per frame, newest on the right, red when over the 30 fps budget
+        times = [frame.time for frame in frames(rect.width)]
+        x = rect.right - len(times)
+        for t in times:
+            h = min(int(rect.height * t / self.GraphScale), rect.height)
+            color = (200,60,60,255) if t > self.Budgets[-1] else (60,200,60,255)
+            if h: pygame.draw.line(surface, color, (x, rect.bottom - 1), (x, rect.bottom - h))
+            x += 1
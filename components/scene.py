@@ -17,18 +17,26 @@ from actordialog import ActorDialog
 from characters import Actor, Spriteset
 from math import ceil, floor
 from pygame.locals import *
+from spatial import SpatialHash
+from scheduler import Scheduler
 from subscreens import CharacterScreen
-from tiles import TileFactory, Tile, Tilestack
-from zipfile import ZipFile, ZIP_DEFLATED
+from tiles import TileFactory, Tile, Tilestack, TileGrid, TileChunkCache
 import configuration
-import dataset
+import codecache
 import collectors
 import gui
+import log
+import mapformat
 import os
+import profiler
+import Queue
 import pygame
 import stat
+import threading
 import types
-import xml.dom.minidom
+import vfs
+
+logger = log.getLogger("scene")
 
 class ScriptRunner(object):
 	"Houses all OverWorld scripts for execution at a moment's notice!"
@@ -36,42 +44,47 @@ class ScriptRunner(object):
 	def __init__(self, scene):
 		self.engine = scene.engine
 		self.scene = scene
-		self._scripts = {}		
+		self._scripts = {}
+		self._pending = {} # function name -> code of the script that defines it, not run yet
 
-	def addScripts(self, script):
+	def addScripts(self, script, filename="<script>"):
+		"""Compiles script (through the code cache) and notes the functions it
+		defines; the script itself only runs the first time one of them is
+		executed.
+		"""
 		if not isinstance(script, str) or script == None or script == "":
 			return
 		
-		# clean up the script 
-		script = script.replace('\r', '') 
-		if not script.endswith('\n'): script = script+"\n"
-		
-		l = {'engine':self.engine, 'scene':self.scene, 'gui':gui}
-		g = {}		
-		try: exec(script,l,g)
+		try: code = codecache.compileSource(script, filename)
 		except SyntaxError, e:
-			print "Failed to add script: %s" % e
+			logger.warning("Failed to add script: %s", e)
 			return
 		
-		for i in g:
-			if type(g[i]) == types.FunctionType:
-				print "Found function \"%s\", adding to scripts" % i
-				self._scripts[i]=g[i]				
-			else:
-				print "Skipping %s: %s" % (type(g[i]), i)
+		for i in codecache.definedFunctions(code):
+			logger.debug("Found function \"%s\", adding to scripts", i)
+			self._scripts.pop(i, None)
+			self._pending[i] = code
 
-	def addDefaultScripts(self):
-		zf = ZipFile(configuration.scripts)
-		scripts = dataset.splitSets(zf.namelist())
+	def _runScript(self, code):
+		l = {'engine':self.engine, 'scene':self.scene, 'gui':gui}
+		g = {}
+		exec(code,l,g)
 		
-		for script in scripts[configuration.default_scriptset]:
-			self.addScripts(zf.read(script))
+		for i in [i for i in self._pending if self._pending[i] is code]:
+			del self._pending[i]
+			if type(g.get(i)) == types.FunctionType: self._scripts[i]=g[i]
+			else: logger.debug("Skipping %s: %s", type(g.get(i)), i)
+
+	def addDefaultScripts(self):
+		zf = vfs.mount(configuration.scripts)
+		for script in zf.sets[configuration.default_scriptset]:
+			self.addScripts(zf.read(script), script)
 
 	def addScriptsByFile(self, fn):
 		f = open(fn)
 		r = f.read()
 		f.close()
-		self.addScripts(r)
+		self.addScripts(r, fn)
 		
 	def addScriptsByDir(self, d):
 		files = []
@@ -83,8 +96,9 @@ class ScriptRunner(object):
 			if f.endswith('.ows'): self.addScriptsByFile(f)
 
 	def execute(self, script_id):
+		if script_id in self._pending: self._runScript(self._pending[script_id])
 		try: self._scripts[script_id](self.engine)
-		except KeyError: print "Failed to execute non-existent script \"%s\"" % script_id
+		except KeyError: logger.warning("Failed to execute non-existent script \"%s\"", script_id)
 
 class Viewport(object):
 	"""The viewport acts as the "camera" for the scene. It keeps track
@@ -132,6 +146,73 @@ class Viewport(object):
 	def isOnEdge(self):
 		return self.x == 0 or self.y == 0
 	
+class ActorList(list):
+	"""The npcs of a scene. Every change to the list is passed on to the
+	scene's spatial index, so that appending, removing, replacing or
+	assigning actors directly can't leave the index stale.
+	"""
+	
+	def __init__(self, scene, actors=()):
+		list.__init__(self, actors)
+		self.scene = scene
+		self.reindex()
+		
+	def reindex(self):
+		"Rebuilds the index from scratch, in list order"
+		self.scene.actorIndex.clear()
+		for actor in self: self.scene._indexActor(actor)
+		
+	def _removed(self, actor):
+		if actor not in self: self.scene._unindexActor(actor)
+		
+	def append(self, actor):
+		list.append(self, actor)
+		self.scene._indexActor(actor)
+		
+	def extend(self, actors):
+		for actor in actors: self.append(actor)
+		
+	def __iadd__(self, actors):
+		self.extend(actors)
+		return self
+		
+	def remove(self, actor):
+		list.remove(self, actor)
+		self._removed(actor)
+		
+	def pop(self, i=-1):
+		actor = list.pop(self, i)
+		self._removed(actor)
+		return actor
+	
+	# the rest change the order or several actors at once
+	def insert(self, i, actor):
+		list.insert(self, i, actor)
+		self.reindex()
+		
+	def __setitem__(self, i, value):
+		old = list(self)
+		list.__setitem__(self, i, value)
+		for actor in old: self._removed(actor)
+		self.reindex()
+		
+	def __delitem__(self, i):
+		old = list(self)
+		list.__delitem__(self, i)
+		for actor in old: self._removed(actor)
+		self.reindex()
+		
+	def __setslice__(self, i, j, actors): self.__setitem__(slice(i, j), actors)
+	def __delslice__(self, i, j): self.__delitem__(slice(i, j))
+		
+	def sort(self, *args, **kwargs):
+		list.sort(self, *args, **kwargs)
+		self.reindex()
+		
+	def reverse(self):
+		list.reverse(self)
+		self.reindex()
+	
 class Scene(object):
 	"""Represents all visual and logic elements for an individual map
 	and its workings (e.g. actors, tilestacks, etc)
@@ -157,13 +238,19 @@ class Scene(object):
 		self.properties = keywords
 		self.widthInPixels = self.widthInTiles * self.tileFactory.tileWidth
 		self.heightInPixels = self.heightInTiles * self.tileFactory.tileHeight
+		self.actorIndex = SpatialHash(configuration.actor_hash_cell_size)
 		self.actors = []
 		self.players = []
 		self.triggers = []
-		self.scripts = []
+		self.scripts = Scheduler(configuration.max_scene_scripts_per_update)
+		self.scriptsById = {} # scriptId -> SceneScripts running it, oldest first
 		
 		self.triggerTile = None
 		self.actionObject = None
+		self.lastDrawn = None
+		self.interpolation = 1.0
+		self.previousPositions = {}
+		self.previousViewport = None
 
 		self.viewport = Viewport(self)
 		self.scriptRunner = ScriptRunner(self)
@@ -171,6 +258,7 @@ class Scene(object):
 	def initScene(self):
 		"Auxiliary init method for portions of init that vary after standard init"
 		if not hasattr(self, 'tilestacks') or not self.tilestacks: self.tilestacks = self._loadTilestacks()
+		self.tileCache = TileChunkCache(self)
 
 		self.players = self.properties['players'] if 'players' in self.properties else [Actor(self, configuration.default_actor_spriteset)]
 		
@@ -190,8 +278,19 @@ class Scene(object):
 		if len(self.players) > 0: self.players[0] = player
 		else: self.players.insert(0, player)
 	player = property(__get_player, __set_player, None, "Gets/Sets the controlling player")
+	
+	def __get_actors(self): return self.__actors
+	def __set_actors(self, actors):
+		if hasattr(self, '_Scene__actors'):
+			for actor in self.__actors:
+				if actor not in actors: actor.positionListener = None
+		self.__actors = ActorList(self, actors)
+	actors = property(__get_actors, __set_actors, None, "Gets/Sets the npcs of the scene, kept in the spatial index")
 		
 	def _loadTilestacks(self):
+		if configuration.tile_storage == 'grid':
+			return TileGrid(self.tileFactory, self.widthInTiles, self.heightInTiles, self.baseTile)
+		
 		ret = []
 		for y in xrange(self.heightInTiles):
 			for x in xrange(self.widthInTiles):
@@ -224,60 +323,48 @@ class Scene(object):
 			pygame.draw.line(surface, (200,200,200,150), (0,ypos), (surface.get_width(), ypos))
 
 	def _drawTiles(self, surface, drawBaseTiles=True):
-		"""Internal method used by the external method render. 
-		NOTE: this method is called EVERY render cycle, and therefore needs to be as 
-		optimized as possible.
+		"""Internal method used by the external method render. The tiles themselves
+		are kept pre-rendered by the scene's TileChunkCache, so this only blits
+		the chunks visible through the viewport.
 		"""
-		tw = self.tileFactory.tileWidth
-		th = self.tileFactory.tileHeight
-		txstart = int(ceil(self.viewport.x / tw))
-		tystart = int(ceil(self.viewport.y / th))
-		txend = int(ceil(self.viewport.widthInPixels / tw)) + txstart + 1
-		tyend = int(ceil(self.viewport.heightInPixels / th))+ tystart + 2
-		if txend >= self.widthInTiles: txend = self.widthInTiles
-		if tyend >= self.heightInTiles: tyend = self.heightInTiles
-		ox = -(self.viewport.x % self.tileFactory.tileWidth)
-		oy = -(self.viewport.y % self.tileFactory.tileHeight)
-		px, py = ox, oy
-		
-		if drawBaseTiles:
-			for y in xrange(tystart, tyend):
-				for x in xrange(txstart, txend):
-					try:
-						ts = self.tilestacks[y*self.widthInTiles + x]
-						ts.renderBase(surface, px, py)
-						if not ts.isWalkable and self.borderUnwalkable:						
-							pygame.draw.rect(surface, (0,100,0,50), (px,py,tw,th), 1)
-						if ts.triggerId and self.borderTrigger:
-							pygame.draw.rect(surface, (0,0,100,50), (px+1,py+1,tw-2,th-2), 1)
-						px += tw
-					except: surface.fill((0,0,0), (px, py, tw, th))
-				py += th
-				px = ox
-		else:
-			for y in xrange(tystart, tyend):
-				for x in xrange(txstart, txend):
-					try:
-						ts = self.tilestacks[y*self.widthInTiles + x]
-						ts.renderRoof(surface, px, py)
-						if not ts.isWalkable and self.borderUnwalkable:
-							pygame.draw.rect(surface, (0,100,0,50), (px,py,tw,th), 1)
-						if ts.triggerId and self.borderTrigger:
-							pygame.draw.rect(surface, (0,0,100,50), (px+1,py+1,tw-2,th-2), 1)
-						px += tw
-					except: pass
-				py += th
-				px = ox
+		vx, vy = self._drawnViewport()
+		with profiler.scope("render.tiles"):
+			if drawBaseTiles: self.tileCache.renderBase(surface, vx, vy)
+			else: self.tileCache.renderRoof(surface, vx, vy)
 
 	def _drawActors(self, surface):
 		"""Draws all actors in their z-order based upon y position.
 		Note: this method is called every cycle so needs to be optimized.
 		"""
 		
-		# sort all actors in increasing y order
-		drawList = self.actors + self.players
-		drawList.sort(lambda x,y: x.py-y.py)	# this is why i love python		
-		for actor in drawList: actor.render(surface, -self.viewport.x, -self.viewport.y)
+		vx, vy = self._drawnViewport()
+		
+		with profiler.scope("render.actors"):
+			# sort all actors in increasing y order
+			drawList = self.actors + self.players
+			drawList.sort(lambda x,y: x.py-y.py)	# this is why i love python		
+			for actor in drawList:
+				x, y = self._drawnPosition(actor)
+				actor.render(surface, x - actor.px - vx, y - actor.py - vy)
+		profiler.count("actors drawn", len(drawList))
+	
+	def _interpolate(self, previous, current):
+		"""Returns the point self.interpolation of the way from previous to
+		current. Jumps of more than a tile (warps, teleports) are not smoothed.
+		"""
+		if previous is None: return current
+		(px, py), (cx, cy) = previous, current
+		if abs(cx - px) > self.tileFactory.tileWidth or abs(cy - py) > self.tileFactory.tileHeight: return current
+		a = self.interpolation
+		return int(round(px + (cx - px) * a)), int(round(py + (cy - py) * a))
+	
+	def _drawnViewport(self):
+		"Topleft of the viewport as it is drawn this frame"
+		return self._interpolate(self.previousViewport, (self.viewport.x, self.viewport.y))
+	
+	def _drawnPosition(self, actor):
+		"Pixel position of an actor as it is drawn this frame"
+		return self._interpolate(self.previousPositions.get(id(actor)), (actor.px, actor.py))
 		
 	### Public Methods ###
 	
@@ -290,6 +377,7 @@ class Scene(object):
 		self.widthInPixels = width * self.tileFactory.tileWidth
 		self.heightInTiles = height
 		self.heightInPixels = height * self.tileFactory.tileHeight
+		if hasattr(self, 'tileCache'): self.tileCache.reset()
 		
 	def render(self, surface):
 		"Renders the scene through the viewport onto the specified surface."
@@ -299,21 +387,63 @@ class Scene(object):
 		self._drawActors(surface)
 		self._drawTiles(surface, False)
 		
+	def getDirtyRects(self):
+		"""Returns the screen rects that have changed since the previous call, or
+		None when the whole viewport needs redrawing (e.g. it has scrolled).
+		Used by the engine's dirty rectangle rendering path.
+		"""
+		vx, vy = self._drawnViewport()
+		
+		actors = {}
+		for actor in self.actors + self.players:
+			x, y = self._drawnPosition(actor)
+			actors[id(actor)] = (x - vx, y - vy - actor.height, actor.width, actor.height, actor.image)
+		
+		damage = self.tileCache.takeDamage()
+		last, self.lastDrawn = self.lastDrawn, ((vx, vy), actors)
+		if not last or last[0] != (vx, vy): return None
+		
+		ret = [pygame.Rect(x-vx, y-vy, w, h) for x,y,w,h in damage]
+		lastActors = last[1]
+		for key, state in actors.iteritems():
+			old = lastActors.get(key)
+			if old == state: continue
+			ret.append(pygame.Rect(state[:4]))
+			if old: ret.append(pygame.Rect(old[:4]))
+		for key, old in lastActors.iteritems():
+			if key not in actors: ret.append(pygame.Rect(old[:4]))
+			
+		return ret
+		
+	def savePositions(self):
+		"""Remembers where the viewport and every actor are before a simulation
+		step, so that frames drawn before the next one can be interpolated.
+		"""
+		self.previousPositions = dict((id(actor), (actor.px, actor.py)) for actor in self.actors + self.players)
+		self.previousViewport = (self.viewport.x, self.viewport.y)
+	
+	def setInterpolation(self, alpha):
+		"""Sets how far (0.0 to 1.0) between the previous and the current
+		simulation step the next render draws actors and the viewport.
+		"""
+		self.interpolation = alpha
+	
 	def update(self, tick):
 		"Updates the scene logic on a clock-based interval"
 		
-		prx, pry = self.player.px, self.player.py
-		self.player.px -= self.viewport.x
-		self.player.py -= self.viewport.y
-		self.player.update(tick)
-		self.player.px, self.player.py = prx, pry
-		
-		for i in xrange(1,len(self.players)): self.players[i].update(tick)
+		with profiler.scope("update.actors"):
+			prx, pry = self.player.px, self.player.py
+			self.player.px -= self.viewport.x
+			self.player.py -= self.viewport.y
+			self.player.update(tick)
+			self.player.px, self.player.py = prx, pry
+			
+			for i in xrange(1,len(self.players)): self.players[i].update(tick)
 						
-		for sscript in self.scripts:
-			sscript.update(tick)
-		for npc in self.actors:
-			npc.update(tick)
+		with profiler.scope("update.scripts"): profiler.count("scripts run", self.scripts.advance(tick))
+		with profiler.scope("update.actors"):
+			for npc in self.actors:
+				npc.update(tick)
 	
 	def centerAt(self, x, y):
 		"Centers the viewport at the x,y coordinate specified."
@@ -427,23 +557,30 @@ class Scene(object):
 			player.move((-dx,-dy))
 			player.direction = d
 						
+	def _actorMoved(self, actor):
+		if actor in self.actorIndex: self.actorIndex.update(actor, actor.getRect())
+		
+	def _indexActor(self, actor):
+		actor.positionListener = self._actorMoved
+		self.actorIndex.insert(actor, actor.getRect())
+		
+	def _unindexActor(self, actor):
+		actor.positionListener = None
+		self.actorIndex.remove(actor)
+		
 	def npcAt(self, collisionPoint):
-		"Returns true if there is an npc sprite standing in the range of collisionPoint +/- tolerance"
-		ret = None
-		cx = collisionPoint[0]
-		cy = collisionPoint[1]
-		for npc in self.actors:
-			r = npc.getRect()
-			if r[0] <= cx and r[0]+r[2] >= cx:
-				if r[1] <= cy and r[1]+r[3] >= cy:
-					ret = npc
-					break
-			elif r[0] >= cx and r[0]+r[2] <= cx:
-				if [r1] >= cy and r[1]+r[3] <= cy:
-					ret = npc
-					break
-
-		return ret
+		"Returns the first npc sprite whose rect contains collisionPoint, or None"
+		found = self.actorIndex.queryPoint(collisionPoint[0], collisionPoint[1])
+		if found: return found[0]
+		return None
+	
+	def actorsInRect(self, rect):
+		"Returns the npcs whose rect overlaps the (x, y, width, height) rect, in scene order"
+		return self.actorIndex.queryRect(rect)
+	
+	def actorsNear(self, point, radius):
+		"Returns the npcs within radius pixels of point, nearest first"
+		return self.actorIndex.queryRadius(point[0], point[1], radius)
 		
 	def addBaseTile(self, tileIndex, x, y):		
 		ts = self.tilestacks[y*self.widthInTiles+x]
@@ -453,6 +590,10 @@ class Scene(object):
 	def addRoofTile(self, tileIndex, x, y):
 		self.tilestacks[y*self.widthInTiles+x].addRoofTile(Tile(self.tileFactory, tileIndex))
 		
+	def invalidateTiles(self):
+		"Forces every tile to be rendered again, e.g. after the tileset images changed."
+		self.tileCache.invalidate()
+		
 	def getTilestackAt(self, x, y):
 		tx = x / self.tileFactory.tileWidth
 		ty = y / self.tileFactory.tileHeight
@@ -461,14 +602,18 @@ class Scene(object):
 			raise Exception, "Could not retrieve tilestack at (%d,%d): %s" % (tx,ty,e)
 		
 	def addScript(self, scriptId, timeout=1000):
-		"Runs the specified scriptId (through the ScriptRunner) every /timeout/ seconds."
-		self.scripts.append(SceneScript(self, scriptId, timeout))
+		"""Runs the specified scriptId (through the ScriptRunner) every /timeout/ milliseconds,
+		or just once if timeout is 0. Returns the SceneScript, which can be cancelled.
+		"""
+		script = SceneScript(self, scriptId, timeout)
+		script.timer = self.scripts.schedule(script.run, timeout, timeout)
+		if scriptId not in self.scriptsById: self.scriptsById[scriptId] = []
+		self.scriptsById[scriptId].append(script)
+		return script
 		
 	def removeScript(self, scriptId):
-		for script in self.scripts:
-			if script.scriptId == scriptId: 
-				self.scripts.remove(script)
-				break			
+		"Stops the oldest SceneScript running scriptId"
+		if scriptId in self.scriptsById: self.scriptsById[scriptId][0].cancel()
 		
 	def performPlayerAction(self):
 		"""Figure out if there is any actionable object in front of the player, then do 
@@ -502,21 +647,29 @@ class Scene(object):
 			
 	def createCharacter(self):
 		"Show the character editor with default values, return the character edited."
+		self.engine.runPendingOverlays()
 		ce = CharacterScreen(Actor(self, configuration.default_actor_spriteset), editable=True)
 		ce.run()
 		return ce.character
 	
 	def playDialog(self, character, txt, **kwargs):
-		ActorDialog(character, txt, **kwargs).run()
+		"Shows the dialog above the scene once the ones played before it are closed"
+		self.engine.queueOverlay(ActorDialog(character, txt, **kwargs))
 		
 	def playDialogWithYesNo(self, character, txt, **kwargs):
+		"""Asks the question and returns the answer. The caller has to wait for
+		it, so this dialog runs in its own loop, after any still queued ones."""
+		self.engine.runPendingOverlays()
 		cd = ActorDialogWithYesNo(character, txt, **kwargs)
 		cd.run()
 		return cd.result
 	
 	def displayShopInterface(self, buyer, seller):
 		"""Builds the store interface using the specified actor's inventory. Although it isn't terribly
-		realistic, all shopkeepers have the same prices for items"""
+		realistic, all shopkeepers have the same prices for items. Like the other
+		interfaces dialog scripts start, it runs modally once the queued lines
+		have been read."""
+		self.engine.runPendingOverlays()
 		ShopInterface(self, buyer, seller).run()
 	
 	def addPlayerToParty(self, player):
@@ -524,8 +677,8 @@ class Scene(object):
 		player.py = self.players[-1].py - self.partySpacing
 		self.players.append(player)
 		
-	def addActorToScene(self, actor):
-		self.actors.append(actor)
+	def addActorToScene(self, actor): self.actors.append(actor)
+	def removeActorFromScene(self, actor): self.actors.remove(actor)
 		
 	def createMapContainer(self, contents, x=-1, y=-1):
 		"""Creates a container object at the specified pixel coordinates that can 
@@ -533,7 +686,7 @@ class Scene(object):
 		"""
 		if x == -1: x = self.player.px+self.player.width
 		if y == -1: y = self.player.py
-		print "adding %s to tile at (%s,%s)" % (contents, x, y)
+		logger.debug("adding %s to tile at (%s,%s)", contents, x, y)
 		if not isinstance(contents, list): contents = [contents]
 		
 		ts = self.getTilestackAt(x,y)		
@@ -584,49 +737,16 @@ class Scene(object):
 #			
 #		self.characterEditor = CharacterEditor()
 
-		print "Creating scene xml..."
-
-		scene_xml = xml.dom.minidom.Document()
-		
-		sceneXml = xml.dom.minidom.Element("scene")		
-		
-		# tile factory
-		scene_tf_xml = xml.dom.minidom.Element("tilefactory")
-		scene_tf_xml.attributes["tileset"] = self.tileFactory.tileset
-		scene_tf_xml.attributes["tilewidth"] = "%s" % self.tileFactory.tileWidth
-		scene_tf_xml.attributes["tileheight"] = "%s" % self.tileFactory.tileHeight
-		sceneXml.appendChild(scene_tf_xml)
-		
-		# itemset
-		scene_is_xml = xml.dom.minidom.Element("itemset")
-		scene_is_xml.attributes["itemset"] = self.itemset
-		
-		# actors
-		scene_actors_xml = xml.dom.minidom.Element("actors")
-		
-		# player party
-		scene_pp_xml = xml.dom.minidom.Element("playerparty")
-		
-		# map tilestacks
-		scene_tile_xml = xml.dom.minidom.Element("tilestacks")
-		scene_tile_xml.attributes["width"] = "%s" % self.widthInTiles
-		scene_tile_xml.attributes["height"] = "%s" % self.heightInTiles
-		
-		for t in self.tilestacks: scene_tile_xml.appendChild(t.toXml())
-		
-		sceneXml.appendChild(scene_tile_xml)
-		
-		scene_xml.appendChild(sceneXml)
-		
-		sceneStr = scene_xml.toxml()
-		
-		print "Finished creating scene xml"
-		
-		print "Compressing and writing scene xml..."
-		f = ZipFile(filename, 'w', ZIP_DEFLATED)		
-		f.writestr("scene.xml", sceneStr)
-		f.close()
-		print "Wrote scene to file %s in %d bytes" % (filename, os.stat(filename)[stat.ST_SIZE])
+		logger.info("Writing scene...")
+		f = open(filename, 'wb')
+		try:
+			writer = mapformat.MapWriter(f, self.tileFactory.tileset, self.tileFactory.tileWidth, self.tileFactory.tileHeight, self.widthInTiles, self.heightInTiles)
+			if isinstance(self.tilestacks, TileGrid): cells = self.tilestacks.cells()
+			else: cells = (ts.toCell() for ts in self.tilestacks)
+			for cell in cells: writer.writeCell(*cell)
+			writer.close()
+		finally: f.close()
+		logger.info("Wrote scene to file %s in %d bytes", filename, os.stat(filename)[stat.ST_SIZE])
 		
 	@staticmethod
 	def load(filename, engine, progressDialog=None):
@@ -636,60 +756,32 @@ class Scene(object):
 			gui.ErrorDialog("No file by the name \"%s\" found." % filename).run()
 			return
 		
-		print 'Loading scene from "%s"...' % filename
+		logger.info('Loading scene from "%s"...', filename)
 		
-		f = ZipFile(filename)
-		try: sceneXmlStr = f.read("scene.xml")
-		except Exception, e: 
-			gui.ErrorDialog("Could not read scene.xml file, aborting load (%s)" % e).run()
-			f.close()
+		try: reader = mapformat.openMap(filename)
+		except Exception, e:
+			gui.ErrorDialog("Could not read scene file, aborting load (%s)" % e).run()
 			return
 		
-		f.close()
+		if progressDialog:
+			progressDialog.addWork(90) # the steps of the load below
+			progressDialog.updateProgress(10)
 		
-		if progressDialog: progressDialog.updateProgress(10)
-				
-		print "Parsing scene xml..."
-		sceneXml = xml.dom.minidom.parseString(sceneXmlStr)
-		print "Finished parsing scene xml"
+		widthInTiles, heightInTiles = reader.widthInTiles, reader.heightInTiles
+		logger.debug('TileFactory standard tilesize: %dx%d', reader.tileWidth, reader.tileHeight)
+		tf = TileFactory(reader.tileset, reader.tileWidth, reader.tileHeight)
+		logger.debug("Scene tile width/height: %d x %d", widthInTiles, heightInTiles)
 
 		if progressDialog: progressDialog.updateProgress(10)
 		
-		# tile factory
-		scene_tf_xml = sceneXml.getElementsByTagName("tilefactory")[0]
-		tw = int(scene_tf_xml.attributes["tilewidth"].value)
-		th = int(scene_tf_xml.attributes["tileheight"].value)
-		print 'TileFactory standard tilesize: %dx%d' % (tw, th)
-		tf = TileFactory(scene_tf_xml.attributes["tileset"].value, tw, th)
-
-		if progressDialog: progressDialog.updateProgress(10)
-		
-		# tilestacks
-		scene_tile_xml = sceneXml.getElementsByTagName("tilestacks")[0]
-		tilestacks = []
-		# tilestacks attributes
-		widthInTiles = int(scene_tile_xml.attributes['width'].value)
-		heightInTiles = int(scene_tile_xml.attributes['height'].value)
-		print "Scene tile width/height: %d x %d" % (widthInTiles, heightInTiles)
-		print "Removing non-element child nodes..."
-		tilestacksXml = [i for i in scene_tile_xml.childNodes if i.nodeType == xml.dom.minidom.Node.ELEMENT_NODE]
-		print "Done removing non-element child nodes"
-		
-		if progressDialog: progressDialog.updateProgress(10)
-		
-		totalTilestacks = len(tilestacksXml)
-		print "Total tilestacks to parse: %d" % totalTilestacks
-		
-		print "Parsing tilestacks..."
-		# tilestacks children
-		count = 0
-		for txml in tilestacksXml: 
-			tilestacks.append(Tilestack.fromXml(txml, tf))
-			count += 1
-			if progressDialog and count > totalTilestacks/30: 
-				progressDialog.updateProgress(1)
-				count = 0
-		print "Finished parsing tilestacks (parsed %s tilestacks)" % len(tilestacks)
+		logger.debug("Reading tilestacks...")
+		onProgress = (lambda cellsRead: progressDialog.updateProgress(1)) if progressDialog else None
+		try: tilestacks = Scene.readTilestacks(reader, tf, onProgress)
+		except mapformat.MapFormatError, e:
+			gui.ErrorDialog("Could not read scene file, aborting load (%s)" % e).run()
+			return
+		finally: reader.close()
+		logger.info("Finished reading tilestacks (read %s tilestacks)", len(tilestacks))
 		
 		ret = Scene(engine, tileFactory=tf, widthInTiles=widthInTiles, heightInTiles=heightInTiles)
 		ret.tilestacks = tilestacks
@@ -698,31 +790,150 @@ class Scene(object):
 		ret.initScene()
 		if progressDialog: progressDialog.updateProgress(10)
 
-		
-		# TEMPORARY
-		ret.player = Actor(ret, configuration.default_actor_spriteset)
-		ret.scriptRunner.addDefaultScripts()
-		ret.itemCollector = ItemCollector(ret, ret.itemset)
-		
-		print 'Finished loading scene'
+		logger.info('Finished loading scene')
 
 		if progressDialog: progressDialog.updateProgress(10)
 
 		return ret
+
+	@staticmethod
+	def readTilestacks(reader, tileFactory, onProgress=None, checkCancelled=None):
+		"""Builds the tile storage (see configuration.tile_storage) for the cells
+		of reader, a mapformat.MapReader. onProgress(cellsRead) is called about 40
+		times along the way, each time after checkCancelled(), which raises to stop
+		the read. Doesn't touch the display, so it can run on any thread.
+		"""
+		total = len(reader)
+		def progressCells():
+			count = 0
+			for cellsRead, cell in enumerate(reader.cells()):
+				yield cell
+				count += 1
+				if count > total/40:
+					if checkCancelled: checkCancelled()
+					if onProgress: onProgress(cellsRead + 1)
+					count = 0
+		
+		if configuration.tile_storage == 'grid': 
+			tilestacks = TileGrid(tileFactory, reader.widthInTiles, reader.heightInTiles)
+			tilestacks.loadCells(progressCells())
+		else: tilestacks = [Tilestack.fromCell(cell, tileFactory) for cell in progressCells()]
+		return tilestacks
+		
+class SceneLoadCancelled(Exception): pass
+
+class SceneLoader(object):
+	"""Loads a scene file without stopping the game: the map is read and its tile storage
+	built on a worker thread, while the steps that need the display (the tileset, then the
+	scene's actors and scripts) run in poll, which the engine calls every frame (see
+	Engine.addTask). The finished scene is handed to onLoaded(scene) in one go; a map that
+	can't be read goes to onFailed(message) instead. cancel() stops the load at the next
+	step, and neither is called. A progressDialog is updated from poll as well.
+	"""
+	
+	def __init__(self, filename, engine, onLoaded=None, onFailed=None, progressDialog=None):
+		self.filename = filename
+		self.engine = engine
+		self.onLoaded = onLoaded
+		self.onFailed = onFailed
+		self.progressDialog = progressDialog
+		self.progress = 0.0 # 0.0 to 1.0
+		self.reportedProgress = 0 # percent
+		self.done = False
+		self.cancelled = False
+		self.reader = None
+		self.tileFactory = None
+		self.messages = Queue.Queue() # (step, value) from the worker
+		self.tileFactoryReady = threading.Event()
+		self.thread = None
+		
+	def start(self):
+		logger.info('Loading scene from "%s" in the background...', self.filename)
+		if self.progressDialog: self.progressDialog.addWork(100)
+		self.thread = threading.Thread(target=self._read, name="SceneLoader")
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def cancel(self):
+		if self.done: return
+		self.cancelled = True
+		self.tileFactoryReady.set()
+		
+	def _checkCancelled(self):
+		if self.cancelled: raise SceneLoadCancelled
+		
+	def _read(self):
+		"The worker: reads the map, waiting for poll to make the TileFactory after the header"
+		try:
+			reader = mapformat.openMap(self.filename)
+			try:
+				self.messages.put(('header', reader))
+				self.tileFactoryReady.wait()
+				self._checkCancelled()
+				def onProgress(cellsRead): self.progress = 0.9 * cellsRead / len(reader)
+				tilestacks = Scene.readTilestacks(reader, self.tileFactory, onProgress, self._checkCancelled)
+			finally: reader.close()
+			self.messages.put(('tilestacks', tilestacks))
+		except SceneLoadCancelled: self.messages.put(('cancelled', None))
+		except Exception, e: self.messages.put(('failed', e))
+		
+	def poll(self):
+		"Runs the steps the worker is waiting on or has finished. Returns True once the load is over."
+		while not self.done:
+			try: step, value = self.messages.get_nowait()
+			except Queue.Empty: break
+			
+			try:
+				if step == 'header':
+					self.reader = value
+					if not self.cancelled: self.tileFactory = TileFactory(value.tileset, value.tileWidth, value.tileHeight)
+					self.tileFactoryReady.set()
+				elif step == 'tilestacks' and not self.cancelled:
+					scene = Scene(self.engine, tileFactory=self.tileFactory, widthInTiles=self.reader.widthInTiles, heightInTiles=self.reader.heightInTiles)
+					scene.tilestacks = value
+					scene.initScene()
+					self.progress = 1.0
+					logger.info("Finished loading scene (read %s tilestacks)", len(value))
+					self._finish(self.onLoaded, scene)
+				elif step == 'failed' and not self.cancelled:
+					self._finish(self.onFailed, "Could not read scene file, aborting load (%s)" % value)
+				else: self._finish(None, None)
+			except Exception, e:
+				report = not self.cancelled
+				self.cancel() # the worker may still be waiting for the tileset
+				self._finish(self.onFailed if report else None, "Could not load scene, aborting load (%s)" % e)
+		
+		percent = int(self.progress * 100)
+		if self.progressDialog and percent > self.reportedProgress:
+			self.progressDialog.updateProgress(percent - self.reportedProgress)
+			self.reportedProgress = percent
+		return self.done
+		
+	def _finish(self, callback, value):
+		self.done = True
+		if callback: callback(value)
 		
 class SceneScript(object):
-	"Container for the scripts that run throughout the scene. This manages the timeouts, etc"
+	"""Container for the scripts that run throughout the scene. The scene's scheduler
+	calls run when the timeout is up."""
 	
 	def __init__(self, scene, scriptId, timeout=0):
 		self.scene = scene
 		self.scriptId = scriptId
 		self.timeout = timeout
 		self.runOnce = self.timeout == 0
-		self.dt = 0
-		
-	def update(self, ticks):
-		self.dt += ticks		
-		if self.dt > self.timeout:
-			self.scene.scriptRunner.execute(self.scriptId)
-			if self.runOnce: self.scene.scripts.remove(self)
-			else: self.dt = 0
+		self.timer = None
+		
+	def run(self):
+		if self.runOnce: self.__forget()
+		self.scene.scriptRunner.execute(self.scriptId)
+		
+	def cancel(self):
+		if self.timer.active:
+			self.timer.cancel()
+			self.__forget()
+		
+	def __forget(self):
+		scripts = self.scene.scriptsById[self.scriptId]
+		scripts.remove(self)
+		if not scripts: del self.scene.scriptsById[self.scriptId]
@@ -0,0 +1,119 @@
+# scheduler.py
+# Timers for the scene: callbacks that run once or periodically after a
+# number of simulated milliseconds, kept in a heap by the time they are due
+# so that each update only costs the timers that actually fire.
+#
+
+import heapq
+
+class Timer(object):
+    "A handle on a callback scheduled with a Scheduler."
+
+    __slots__ = ('scheduler', 'callback', 'due', 'period', 'cancelled', 'queued')
+
+    def __init__(self, scheduler, callback, due, period):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.due = due
+        self.period = period
+        self.cancelled = False
+        self.queued = False
+
+    def __get_active(self): return not self.cancelled
+    active = property(__get_active, None, None, "False once the timer was cancelled or, for a one-shot timer, has run")
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+class Scheduler(object):
+    """Runs callbacks when the scheduler's clock, moved on by advance(),
+    reaches the time they are due. Adding and cancelling a timer take
+    O(log n); cancelled timers are dropped from the heap as they come up, or
+    all at once when they make up most of it.
+
+    At most maxRunsPerTick callbacks (0 for no limit) run in one advance;
+    the ones left over stay due and run first in the next one.
+    """
+
+    def __init__(self, maxRunsPerTick=0):
+        self.maxRunsPerTick = maxRunsPerTick
+        self.now = 0.0
+        self.runs = 0
+        self.deferredTicks = 0
+        self._heap = [] # (due, sequence, timer)
+        self._sequence = 0
+        self._cancelledQueued = 0
+        self._active = 0
+
+    def __len__(self): return self._active
+
+    def schedule(self, callback, delay, period=0):
+        """Calls callback() once delay milliseconds from now and, when period
+        is given, every period milliseconds after that. Returns the Timer.
+        """
+        timer = Timer(self, callback, self.now + delay, period)
+        self._active += 1
+        self._push(timer)
+        return timer
+
+    def cancel(self, timer):
+        "Stops timer from running again; cancelling it twice does nothing."
+        if timer.cancelled: return
+        timer.cancelled = True
+        self._active -= 1
+        if timer.queued:
+            self._cancelledQueued += 1
+            if self._cancelledQueued > 32 and self._cancelledQueued * 2 > len(self._heap): self._compact()
+
+    def advance(self, ticks):
+        "Moves the clock on by ticks milliseconds and runs the timers that came due. Returns how many ran."
+        self.now += ticks
+        ran = 0
+        while self._heap and self._heap[0][0] <= self.now:
+            if self.maxRunsPerTick and ran >= self.maxRunsPerTick:
+                self.deferredTicks += 1
+                break
+            timer = heapq.heappop(self._heap)[2]
+            timer.queued = False
+            if timer.cancelled:
+                self._cancelledQueued -= 1
+                continue
+
+            if not timer.period: self.cancel(timer)
+            timer.callback()
+            ran += 1
+            if not timer.cancelled:
+                timer.due = self.now + timer.period
+                self._push(timer)
+        self.runs += ran
+        return ran
+
+    def clear(self):
+        for entry in self._heap: entry[2].cancelled = True
+        del self._heap[:]
+        self._cancelledQueued = 0
+        self._active = 0
+
+    def nextDue(self):
+        "Returns when the next timer is due, or None if there is none."
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)[2].queued = False
+            self._cancelledQueued -= 1
+        return self._heap[0][0] if self._heap else None
+
+    def _push(self, timer):
+        self._sequence += 1
+        timer.queued = True
+        heapq.heappush(self._heap, (timer.due, self._sequence, timer))
+
+    def _compact(self):
+        live = []
+        for entry in self._heap:
+            if entry[2].cancelled: entry[2].queued = False
+            else: live.append(entry)
+        heapq.heapify(live)
+        self._heap = live
+        self._cancelledQueued = 0
+
+    def __repr__(self):
+        return "Scheduler: %d timers, %d runs, %d ticks over budget" % (self._active, self.runs, self.deferredTicks)
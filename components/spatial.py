@@ -0,0 +1,111 @@
+# spatial.py
+# A uniform grid ("spatial hash") for finding objects by position without
+# looking at every one of them.
+#
+
+class SpatialHash(object):
+    """Buckets objects by the grid cells their rect touches. Rects are
+    (x, y, width, height) and, like Scene.npcAt has always treated them,
+    include their right and bottom edges. Query results come back in the
+    order the objects were first inserted.
+    """
+
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {}     # (cx, cy) -> set of objects
+        self.entries = {}   # object -> (rect, cell range, insertion number)
+        self.counter = 0
+
+    def __len__(self): return len(self.entries)
+    def __contains__(self, obj): return obj in self.entries
+    def __iter__(self): return iter(self._sorted(self.entries))
+
+    def _range(self, rect):
+        cs = self.cellSize
+        x, y, w, h = rect
+        return (int(x) // cs, int(y) // cs, int(x + w) // cs, int(y + h) // cs)
+
+    def _cells(self, cellRange):
+        x0, y0, x1, y1 = cellRange
+        for cy in xrange(y0, y1 + 1):
+            for cx in xrange(x0, x1 + 1): yield (cx, cy)
+
+    def _sorted(self, objs):
+        entries = self.entries
+        return sorted(objs, key=lambda o: entries[o][2])
+
+    def insert(self, obj, rect):
+        """Adds obj covering rect. Inserting an object already present
+        just updates its rect."""
+        if obj in self.entries: return self.update(obj, rect)
+        cellRange = self._range(rect)
+        for cell in self._cells(cellRange): self.cells.setdefault(cell, set()).add(obj)
+        self.entries[obj] = (tuple(rect), cellRange, self.counter)
+        self.counter += 1
+
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if not entry: return
+        for cell in self._cells(entry[1]):
+            bucket = self.cells[cell]
+            bucket.discard(obj)
+            if not bucket: del self.cells[cell]
+
+    def update(self, obj, rect):
+        """Moves obj to rect. Only touches the buckets when the set of cells
+        it covers changes."""
+        entry = self.entries.get(obj)
+        if not entry: return self.insert(obj, rect)
+        cellRange = self._range(rect)
+        if cellRange != entry[1]:
+            old = set(self._cells(entry[1]))
+            new = set(self._cells(cellRange))
+            for cell in old - new:
+                bucket = self.cells[cell]
+                bucket.discard(obj)
+                if not bucket: del self.cells[cell]
+            for cell in new - old: self.cells.setdefault(cell, set()).add(obj)
+        self.entries[obj] = (tuple(rect), cellRange, entry[2])
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+
+    def rectOf(self, obj): return self.entries[obj][0]
+
+    def queryPoint(self, x, y):
+        """Returns the objects whose rect contains x,y."""
+        cs = self.cellSize
+        bucket = self.cells.get((int(x) // cs, int(y) // cs))
+        if not bucket: return []
+        ret = []
+        for obj in bucket:
+            rx, ry, rw, rh = self.entries[obj][0]
+            if rx <= x <= rx + rw and ry <= y <= ry + rh: ret.append(obj)
+        return self._sorted(ret)
+
+    def queryRect(self, rect):
+        """Returns the objects whose rect overlaps rect."""
+        x, y, w, h = rect
+        found = set()
+        for cell in self._cells(self._range(rect)):
+            bucket = self.cells.get(cell)
+            if bucket: found.update(bucket)
+        ret = []
+        for obj in found:
+            rx, ry, rw, rh = self.entries[obj][0]
+            if rx <= x + w and x <= rx + rw and ry <= y + h and y <= ry + rh: ret.append(obj)
+        return self._sorted(ret)
+
+    def queryRadius(self, x, y, radius):
+        """Returns the objects whose rect lies within radius of x,y, nearest
+        first."""
+        ret = []
+        for obj in self.queryRect((x - radius, y - radius, 2 * radius, 2 * radius)):
+            rx, ry, rw, rh = self.entries[obj][0]
+            dx = max(rx - x, 0, x - (rx + rw))
+            dy = max(ry - y, 0, y - (ry + rh))
+            distance = dx * dx + dy * dy
+            if distance <= radius * radius: ret.append((distance, self.entries[obj][2], obj))
+        ret.sort()
+        return [obj for distance, order, obj in ret]
@@ -13,13 +13,17 @@ from characters import Spriteset
 from gui import *
 from items import *
 from pygame.locals import *
-from zipfile import ZipFile
 import configuration
 import constants
+import fonts
+import log
 import os
 import pygame
 import sys
 import threading
+import vfs
+
+logger = log.getLogger("subscreens")
 
 class Subscreen(Application):
     """Constructs and manages the GUI for all subscreen actions."""
@@ -41,7 +45,7 @@ class Subscreen(Application):
             control.width = listbox.width-5
             listbox.add(control)
         
-        closeButton = Button(borderWidth=2, text="X", font=pygame.font.Font(None, 15), callback=lambda x,y: self.exit())
+        closeButton = Button(borderWidth=2, text="X", font=fonts.getFont(None, 15), callback=lambda x,y: self.exit())
         closeButton.width = closeButton.height
         closeButton.x = self.x+self.width-closeButton.width-3
         closeButton.y = self.y+2
@@ -214,7 +218,7 @@ class OldInventoryControl(BorderedControl):
             dx += item.width*32
             if dx > self.width: dx, dy = 0, dy + item.height * 32
 
-            print "Adding InventoryItemControl at (%d,%d)" % (itm.x, itm.y)
+            logger.debug("Adding InventoryItemControl at (%d,%d)", itm.x, itm.y)
             self.add(itm)
             
     def __repr__(self): return "InventoryControl"
@@ -249,6 +253,8 @@ class OldInventoryControl(BorderedControl):
 class InventoryItemControl(BorderedControl):
     "Item in the inventory grid"
 
+    animated = True # counts down its popup delay as it renders
+    
     def __init__(self, item, count, **kwargs):
         BorderedControl.__init__(self, **kwargs)
         
@@ -256,7 +262,7 @@ class InventoryItemControl(BorderedControl):
         self.width = 32 * item.width
         self.height = 32 * item.height
         self.count = count
-        self.font = pygame.font.Font(None, 15)
+        self.font = fonts.getFont(None, 15)
         self._initItemBubble()
         self.mouseOver = False
         self.popupDelay = 5
@@ -269,7 +275,7 @@ class InventoryItemControl(BorderedControl):
     mouseOver = property(__get_mo, __set_mo, __del_mo, "Mouse is over this control")
 
     def _renderCountText(self, surface):
-        txt = self.font.render("%d" % self.count, True, (100,100,100))
+        txt = fonts.render(self.font, "%d" % self.count, True, (100,100,100))
         surface.blit(txt, (self.x+self.width-txt.get_width(), self.y+self.height-txt.get_height()+2))
         
     def render(self, surface):
@@ -298,7 +304,7 @@ class InventoryItemControl(BorderedControl):
             
     def mouseDown(self, event):
         BorderedControl.mouseDown(self, event)
-        print "Mouse down on %s" % self.item.name
+        logger.debug("Mouse down on %s", self.item.name)
 
 class ItemBubble(DialogBubble):
 
@@ -325,7 +331,7 @@ class ItemBubble(DialogBubble):
     def __repr__(self): return "ItemBubble"
         
     def _initComponents(self):
-        f = pygame.font.Font(None, 20)
+        f = fonts.getFont(None, 20)
         
         img = Image(surface=self.item.image, parent=self, pos=(10,10), borderWidth=0)
         self.add(img)
@@ -405,7 +411,7 @@ class ItemBubble(DialogBubble):
             
     def dropButtonCb(self, event, button):
         self.item.drop()
-        print "Clicked drop button on item: %s" % self.item.name
+        logger.debug("Clicked drop button on item: %s", self.item.name)
 #        for iic in self.ancestor.inventory._children:
 #            iibc = iic._children[0]
 #            if iibc.item == self.item:
@@ -418,10 +424,10 @@ class ItemBubble(DialogBubble):
 #                break
             
     def buyButtonCb(self, event, button):
-        print "Buying %s for %s" % (self.item.name, self.item.cost)
+        logger.info("Buying %s for %s", self.item.name, self.item.cost)
 
     def sellButtonCb(self, event, button):
-        print "Selling %s for %s" % (self.item.name, self.item.cost)
+        logger.info("Selling %s for %s", self.item.name, self.item.cost)
         
     def mouseEnter(self, mousePos):
         DialogBubble.mouseEnter(self, mousePos)
@@ -454,11 +460,11 @@ class StatsDisplay(BorderedControl):
         else: self.editable = False
         
         self.character = character
-        self.font = pygame.font.Font(None, 22)
+        self.font = fonts.getFont(None, 22)
         
         self._initComponents()
         
-        print "width/height: %d/%d" % (self.width, self.height)
+        logger.debug("width/height: %d/%d", self.width, self.height)
         
     def __repr__(self): return "Stats Display"
         
@@ -503,7 +509,7 @@ class StatsDisplay(BorderedControl):
                 try: 
                     self.character.stats.setSubstatValue(control.text, int(id.textInput.text))
                     self.statLabels[control].text = id.textInput.text
-                except Exception, e: print 'Could not set %s to "%s" (%s)' % (control.text, id.textInput.text, e)
+                except Exception, e: logger.warning('Could not set %s to "%s" (%s)', control.text, id.textInput.text, e)
         
 class CharacterScreen(Application):
     """Shows a character's attributes, vitals, statistics, inventory, etc.
@@ -520,13 +526,12 @@ class CharacterScreen(Application):
 
     def initControls(self):
         "Create and add all controls to the app."
-        fnt = pygame.font.Font(configuration.monofont, 15)
-        fnt.set_bold(True)
+        fnt = fonts.getFont(configuration.monofont, 15, bold=True)
 
         self.border = BorderedControl(parent=self, pos=(20,30), width=self.width-40, height=self.height-40)
         self.border.borderWidth = 2
                     
-        self.closeButton = Button(text="X", callback=self.exit, borderWidth=2, parent=self, font=pygame.font.Font(None, 15))
+        self.closeButton = Button(text="X", callback=self.exit, borderWidth=2, parent=self, font=fonts.getFont(None, 15))
         self.closeButton.width = self.closeButton.height
         self.closeButton.x = self.width-self.closeButton.width-3
         self.closeButton.y = self.y+2
@@ -548,9 +553,7 @@ class CharacterScreen(Application):
         # Job Label
         if not self.character.job: jobtxt = "Jobless"
         else: jobtxt = repr(self.character.job)
-        f = pygame.font.Font(configuration.regfont, 15)
-        f.set_italic(True)
-        f.set_bold(True)
+        f = fonts.getFont(configuration.regfont, 15, bold=True, italic=True)
         self.jobLabel = Label(text=jobtxt, parent=self.border, font=f)
         self.jobLabel.x = self.nameLabel.right + 10
         self.jobLabel.y = self.nameLabel.y
@@ -576,12 +579,12 @@ class CharacterScreen(Application):
         self.border.add(self.apLabel)
         
         # Inventory display
-        self.inventory = ListBox(parent=self.border, width=300, height=300, borderWidth=2, backgroundColor=(255,255,255))
+        self.inventory = ListBox(parent=self.border, width=300, height=300, borderWidth=2, backgroundColor=(255,255,255),
+                                 rowFactory=lambda item: ItemListControl(item, parent=self.inventory))
         self.inventory.x = self.border.width - self.inventory.width - 10
         self.inventory.y = self.border.height - self.inventory.height - 10
         #self.inventory.orderItems()
-        for item in self.character.inventory.stowed: 
-            self.inventory.add(ItemListControl(item, parent=self.inventory))
+        self.inventory.extend(self.character.inventory.stowed)
         self.border.add(self.inventory)
 
         # Player stats
@@ -597,21 +600,21 @@ class CharacterScreen(Application):
         
     def _initEditableComponents(self):
         # position
-        self.positionLabel = Label(text="Position: (%d,%d)" % (self.character.px, self.character.py), parent=self.border, font=pygame.font.Font(configuration.regfont, 12))
+        self.positionLabel = Label(text="Position: (%d,%d)" % (self.character.px, self.character.py), parent=self.border, font=fonts.getFont(configuration.regfont, 12))
         self.positionLabel.x = self.spriteImage.x
         self.positionLabel.y = self.spriteImage.bottom + 5
         self.positionLabel.clicked = self.changePositionCb        
         self.border.add(self.positionLabel)
         
         # 'accept' button        
-        self.okButton = Button(text="OK", parent=self, callback=self.exit, borderWidth=2, font=pygame.font.Font(None, 15))
+        self.okButton = Button(text="OK", parent=self, callback=self.exit, borderWidth=2, font=fonts.getFont(None, 15))
         self.okButton.height = self.closeButton.height
         self.okButton.x = self.closeButton.x - self.okButton.width - 5
         self.okButton.y = self.closeButton.y
         self.add(self.okButton)
         
         # dialog set choice
-        self.dialogsetLabel = Label(text="Dialog ID: %s" % self.character.dialogId, parent=self.border, font=pygame.font.Font(configuration.regfont, 12))
+        self.dialogsetLabel = Label(text="Dialog ID: %s" % self.character.dialogId, parent=self.border, font=fonts.getFont(configuration.regfont, 12))
         self.dialogsetLabel.x = self.positionLabel.x
         self.dialogsetLabel.y = self.positionLabel.bottom + 5
         self.dialogsetLabel.clicked = self.dialogsetChangeCb
@@ -635,7 +638,7 @@ class CharacterScreen(Application):
     def addItemCb(self, event, control):
         item = self.character.scene.itemCollector.createItem(self.character, control.text)
         self.character.inventory.stowItem(item)
-        print "Added %s to %s's inventory" % (item.name, self.character.name)
+        logger.info("Added %s to %s's inventory", item.name, self.character.name)
         
     def resetInventory(self):
         self.inventory.sort()
@@ -687,7 +690,7 @@ class CharacterScreen(Application):
                 self.character.px = x
                 self.character.py = y
                 self.positionLabel.text = "Position: (%d,%d)" % (self.character.px, self.character.py)
-                print "New position: (%d,%d)" % (self.character.px, self.character.py)
+                logger.debug("New position: (%d,%d)", self.character.px, self.character.py)
             except Exception, e:
                 ErrorDialog("Could not read new position value. (%s)" % e).run()
     
@@ -695,8 +698,7 @@ class CharacterScreen(Application):
         try:
             #ssfn = os.path.join(configuration.spritesetdir, button.text+".zip")
             #print "Opening spriteset at %s" % ssfn
-            ss = Spriteset(button.text)
-            self.character.changeSpriteset(ss)
+            self.character.changeSpriteset(button.text)
             self.spriteImage.surface = self.character._spriteset[Spriteset.SOUTH][0]
             self.nameLabel.x = self.spriteImage.right + 10
             self.jobLabel.x = self.nameLabel.right + 10
@@ -709,8 +711,7 @@ class CharacterScreen(Application):
 
     def spritesetChangeCb(self, event, button):
         controls = []
-        z = ZipFile(configuration.spritesets)
-        for spriteset in dataset.splitSets(z.namelist()):
+        for spriteset in vfs.mount(configuration.spritesets).sets:
             controls.append(Button(text=spriteset, callback=self.spriteChoiceCb))
         ControlDialog("Choose spriteset:", controls).run()
     
@@ -778,6 +779,10 @@ class ItemListControl(BorderedControl):
     def __repr__(self): return "ItemListControl"
         
     def mouseEnter(self, event):
+        if self.itemBubble and (self.itemBubble.spoutX, self.itemBubble.spoutY) != (self.absx, self.absy+self.height/2):
+            # scrolled since the bubble was made: replace it rather than pile up another
+            self.itemBubble.parent.remove(self.itemBubble)
+            self.itemBubble = None
         if not self.itemBubble: 
             self.itemBubble = ItemBubble(self.item, width=250, height=200, borderWidth=2, 
                                          spoutX=self.absx, spoutY=self.absy+self.height/2,
@@ -796,12 +801,14 @@ class ItemListControl(BorderedControl):
 
 class HpCurMaxLabel(BorderedControl):
     
+    animated = True # follows the character's stats as they change
+    
     def __init__(self, character, **kwargs):
         BorderedControl.__init__(self, **kwargs)
         self.borderWidth = 0
         self.backgroundColor = (0,0,0,0)
         if "font" in kwargs: self.font = kwargs["font"]
-        else: self.font = pygame.font.Font(None, 20)
+        else: self.font = fonts.getFont(None, 20)
         self.character = character
         self.amountLabel = Label(text="%d/%d" % (self.character.hp, self.character.maxHp), width=100, parent=self, font=self.font)
         self.add(self.amountLabel)
@@ -816,12 +823,14 @@ class HpCurMaxLabel(BorderedControl):
         
 class ApCurMaxLabel(BorderedControl):
     
+    animated = True # follows the character's stats as they change
+    
     def __init__(self, character, **kwargs):
         BorderedControl.__init__(self, **kwargs)
         self.borderWidth = 0
         self.backgroundColor = (0,0,0,0)
         if "font" in kwargs: self.font = kwargs["font"]
-        else: self.font = pygame.font.Font(None, 20)
+        else: self.font = fonts.getFont(None, 20)
         self.character = character
         self.amountLabel = Label(text="%d/%d" % (self.character.ap, self.character.maxAp), width=100, parent=self, font=self.font)
         self.add(self.amountLabel)
@@ -0,0 +1,92 @@
+# tilecache.py
+# On-disk cache of processed tilesets, so TileFactory can skip decoding PNGs,
+# generating blend variants and splitting irregular tiles on every launch.
+#
+# A cached tileset is two files in configuration.cachedir: a .pixels file of
+# raw RGBA surfaces laid end to end, memory-mapped when loading, and a
+# marshalled .index describing where each surface lives. Both are named after
+# a hash of the tileset's zip entries (name, CRC, size) and the tile size, so
+# a changed source simply misses the cache and gets rebuilt.
+#
+
+import configuration
+import diskcache
+import hashlib
+import log
+import marshal
+import mmap
+import os
+import pygame
+import vfs
+
+logger = log.getLogger("tilecache")
+
+FormatVersion = 1
+
+def cacheKey(tileset, tileWidth, tileHeight):
+    """Returns the hex digest identifying the current contents of the tileset."""
+    z = vfs.mount(configuration.tilesets)
+    infos = [z.getinfo(name) for name in z.sets[tileset]]
+
+    h = hashlib.sha1("%d %d %d" % (FormatVersion, tileWidth, tileHeight))
+    for info in sorted(infos, key=lambda i: i.filename):
+        h.update("%s %08x %d\n" % (info.filename, info.CRC & 0xffffffff, info.file_size))
+    return h.hexdigest()
+
+def _paths(tileset, key):
+    base = os.path.join(configuration.cachedir, "tileset-%s-%s" % (tileset, key))
+    return base + ".index", base + ".pixels"
+
+def load(tileFactory, key):
+    """Fills in tileFactory.tiles, specialTiles and irregularTiles from the
+    cache. Returns False if there is no usable cache entry for key.
+    """
+    indexPath, pixelsPath = _paths(tileFactory.tileset, key)
+    if not os.path.exists(indexPath) or not os.path.exists(pixelsPath): return False
+
+    try:
+        f = open(indexPath, 'rb')
+        try: index = marshal.load(f)
+        finally: f.close()
+        if index.get('version') != FormatVersion: return False
+
+        f = open(pixelsPath, 'rb')
+        try:
+            pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # frombuffer doesn't copy, convert_alpha does, so nothing
+                # refers to the map once it is closed
+                surface = lambda (offset, w, h): pygame.image.frombuffer(buffer(pixels, offset, w*h*4), (w, h), 'RGBA').convert_alpha()
+                tileFactory.tiles = [surface(t) for t in index['tiles']]
+                tileFactory.irregularTiles = dict((name, (surface(orig), [surface(s) for s in slices]))
+                                                  for name, (orig, slices) in index['irregularTiles'].iteritems())
+            finally: pixels.close()
+        finally: f.close()
+    except Exception, e:
+        logger.warning("Ignoring unreadable tileset cache %s: %s", indexPath, e)
+        return False
+
+    tileFactory.specialTiles = index['specialTiles']
+    return True
+
+def save(tileFactory, key):
+    """Writes tileFactory's processed tiles to the cache under key, replacing
+    any older entries for the same tileset.
+    """
+    indexPath, pixelsPath = _paths(tileFactory.tileset, key)
+    diskcache.removeStale("tileset-%s-" % tileFactory.tileset, (".index", ".pixels"))
+
+    def writePixels(f):
+        def write(surface):
+            offset = f.tell()
+            f.write(pygame.image.tostring(surface, 'RGBA'))
+            return (offset,) + surface.get_size()
+        return {'version': FormatVersion,
+                'tiles': [write(t) for t in tileFactory.tiles],
+                'irregularTiles': dict((name, (write(orig), [write(s) for s in slices]))
+                                       for name, (orig, slices) in tileFactory.irregularTiles.iteritems()),
+                'specialTiles': tileFactory.specialTiles}
+
+    # the index goes last, an entry without one is never loaded
+    index = diskcache.writeFile(pixelsPath, writePixels)
+    diskcache.writeFile(indexPath, lambda f: marshal.dump(index, f))
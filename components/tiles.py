@@ -9,17 +9,22 @@
 #    [] Review classes invluded in module for relevance to module
 #
 
-from cStringIO import StringIO
+from array import array
 from pygame.locals import *
-from zipfile import ZipFile
 import configuration
-import dataset
 import gui
 import imageutil
+import loader
+import log
 import os
+import profiler
 import pygame
+import tilecache
+import vfs
 import xml.dom.minidom
 
+logger = log.getLogger("tiles")
+
 class TileSelector(object):
     
     def __init__(self, scene):
@@ -98,19 +103,24 @@ class TileFactory(object):
         self.tileHeight = tileHeight
         self.specialTiles = {}
         self.irregularTiles = {}
-        self.tiles = self.readTilesetFile()
+        
+        if not configuration.tileset_cache: 
+            self.tiles = self.readTilesetFile()
+            return
+        
+        key = tilecache.cacheKey(tileset, tileWidth, tileHeight)
+        if not tilecache.load(self, key):
+            self.tiles = self.readTilesetFile()
+            try: tilecache.save(self, key)
+            except (IOError, OSError), e: logger.warning("Could not cache tileset %s: %s", tileset, e)
                 
     def readTilesetFile(self):
         ret = []
-        z = ZipFile(configuration.tilesets)
-        nl = z.namelist()
-        
-        tilesets = dataset.splitSets(nl)
+        z = vfs.mount(configuration.tilesets)
+        images = loader.loadImages(z, z.sets[self.tileset])
                 
-        for name in tilesets[self.tileset]:
-            data = z.read(name)
-            pbuf = StringIO(data)
-            origSprite = pygame.image.load(pbuf).convert_alpha()
+        for name in z.sets[self.tileset]:
+            origSprite = images[name]
             
             if name.endswith('base.png'): 
                 base = origSprite # special case "default" tile
@@ -121,11 +131,11 @@ class TileFactory(object):
             
             size = origSprite.get_size()
             if size[0] > self.tileWidth or size[1] > self.tileHeight:
-                print "Splitting image \"%s\" into tiles..." % name
+                logger.debug("Splitting image \"%s\" into tiles...", name)
                 sprites = imageutil.convertToTiles(origSprite, self.tileWidth, self.tileHeight)
-                print "Done splitting"
+                logger.debug("Done splitting")
                 tileName = os.path.split(name)[-1]
-                print "cataloging irregular tile %s" % tileName
+                logger.debug("cataloging irregular tile %s", tileName)
                 self.irregularTiles[tileName] = (origSprite, sprites)
             else: 
                 sprites = [origSprite]
@@ -142,7 +152,6 @@ class TileFactory(object):
                     if b3: ret.append(b3)
                     if b4: ret.append(b4)
             
-        z.close()
         if base: 
             ret.append(base)
             self.specialTiles['base'] = ret.index(base)
@@ -182,11 +191,32 @@ class Tilestack(object):
     def __init__(self):
         self.baseTiles = []
         self.roofTiles = []
-        self.isWalkable = True
-        self.triggerId = None
+        self.onChange = None
+        self.__walkable = True
+        self.__trigger_id = None
         self.contents = None
         
     def __len__(self): return len(self.baseTiles) + len(self.roofTiles)
+    
+    def _changed(self):
+        """Tells whoever is listening (normally the scene's TileChunkCache) that
+        this stack looks different now.
+        """
+        if self.onChange: self.onChange()
+    
+    def __get_walkable(self): return self.__walkable
+    def __set_walkable(self, walkable):
+        if walkable == self.__walkable: return
+        self.__walkable = walkable
+        self._changed()
+    isWalkable = property(__get_walkable, __set_walkable, None, "Whether actors can walk onto this stack")
+    
+    def __get_trigger(self): return self.__trigger_id
+    def __set_trigger(self, triggerId):
+        if triggerId == self.__trigger_id: return
+        self.__trigger_id = triggerId
+        self._changed()
+    triggerId = property(__get_trigger, __set_trigger, None, "Script id executed when this stack is acted upon")
         
     def renderBase(self, surface, x, y):
         """Render only the base tiles."""
@@ -198,31 +228,57 @@ class Tilestack(object):
 
     def addBaseTile(self, tile):
         """Add the specified tile to the base portion of the stack."""
-        if len(self.baseTiles) == 0: self.baseTiles.append(tile)
-        elif self.baseTiles[-1].tileIndex != tile.tileIndex: self.baseTiles.append(tile)
+        if len(self.baseTiles) == 0 or self.baseTiles[-1].tileIndex != tile.tileIndex: 
+            self.baseTiles.append(tile)
+            self._changed()
         
     def addRoofTile(self, tile):
         """Add the specified tile to the roof portion of the stack."""
-        if len(self.roofTiles) == 0: self.roofTiles.append(tile)
-        elif self.roofTiles[-1].tileIndex != tile.tileIndex: self.roofTiles.append(tile)              
+        if len(self.roofTiles) == 0 or self.roofTiles[-1].tileIndex != tile.tileIndex: 
+            self.roofTiles.append(tile)
+            self._changed()
         
     def removeTopBaseTile(self):
         """Removes the topmost tile in the base stack. If there is only
         one tile remaining, does nothing.
         """
-        if len(self.baseTiles)>1: self.baseTiles = self.baseTiles[:-1]
+        if len(self.baseTiles)>1: 
+            self.baseTiles = self.baseTiles[:-1]
+            self._changed()
             
     def removeTopRoofTile(self):
         """Removes the topmost tile in the roof stack. The roof stack
         can potentially be empty.
         """
-        self.roofTiles = self.roofTiles[:-1]
+        if self.roofTiles:
+            self.roofTiles = self.roofTiles[:-1]
+            self._changed()
         
     def performAction(self, scene):
         scene.actionObject = self
         scene.scriptRunner.execute(self.triggerId)
         scene.actionObject = None
         
+    def toCell(self):
+        """Returns the stack as (baseTiles, roofTiles, isWalkable, triggerId), the
+        tile lists holding (tileIndex, irregularName or None) pairs. This is the
+        shape the mapformat module reads and writes.
+        """
+        return ([(t.tileIndex, getattr(t, 'tileName', None)) for t in self.baseTiles],
+                [(t.tileIndex, getattr(t, 'tileName', None)) for t in self.roofTiles],
+                self.isWalkable, self.triggerId)
+        
+    def fromCell(cell, tileFactory):
+        base, roof, walkable, trigger = cell
+        ret = Tilestack()
+        ret.baseTiles = [IrregularTile(tileFactory, name, index) if name else Tile(tileFactory, index) for index, name in base]
+        ret.roofTiles = [IrregularTile(tileFactory, name, index) if name else Tile(tileFactory, index) for index, name in roof]
+        ret.isWalkable = walkable
+        ret.triggerId = trigger
+        return ret
+    
+    fromCell = staticmethod(fromCell)
+        
     def toXml(self):
         ret = xml.dom.minidom.Element("tilestack")
         ret.attributes["walkable"] = "%s" % self.isWalkable
@@ -277,3 +333,464 @@ class Tilestack(object):
         return ret
     
     fromXml = staticmethod(fromXml)
+
+class TileGrid(object):
+    """Struct-of-arrays storage for a whole map. Each layer depth is one typed
+    array with an entry per cell, allocated the first time any cell needs that
+    depth; walkability is a bitmask and trigger ids index into a string table.
+    Indexing the grid like the old list of Tilestacks returns GridTilestack
+    views, so code written against Tilestacks keeps working.
+    
+    Tiles are stored as ints: a regular tile's index, EMPTY, or for irregular
+    tiles -2 - n where n indexes the (tileName, tileIndex) pairs in
+    irregularTiles.
+    """
+    
+    EMPTY = -1
+    
+    def __init__(self, tileFactory, widthInTiles, heightInTiles, baseTile=None):
+        self.tileFactory = tileFactory
+        self.widthInTiles = widthInTiles
+        self.heightInTiles = heightInTiles
+        size = widthInTiles * heightInTiles
+        self.size = size
+        
+        self.basePlanes = []
+        self.roofPlanes = []
+        self.baseDepth = array('B', [0]) * size
+        self.roofDepth = array('B', [0]) * size
+        if baseTile is not None:
+            self.basePlanes.append(array('i', [baseTile]) * size)
+            self.baseDepth = array('B', [1]) * size
+        
+        self.walkable = array('B', [0xff]) * ((size + 7) / 8)
+        self.triggers = array('H', [0]) * size
+        self.triggerNames = [None]
+        self.triggerIds = {}
+        self.irregularTiles = []
+        self.irregularIds = {}
+        self.contents = {}
+        self.onChange = None
+        
+    def __len__(self): return self.size
+    
+    def __getitem__(self, index):
+        if index < 0: index += self.size
+        if index < 0 or index >= self.size: raise IndexError, "tilestack index out of range"
+        return GridTilestack(self, index)
+    
+    def __iter__(self):
+        for i in xrange(self.size): yield GridTilestack(self, i)
+        
+    def _changed(self, index):
+        if self.onChange: self.onChange(index)
+        
+    def encode(self, tile):
+        """Returns the int stored for the Tile or IrregularTile."""
+        if not isinstance(tile, IrregularTile): return tile.tileIndex
+        return self.encodeCell(tile.tileIndex, tile.tileName)
+    
+    def encodeCell(self, tileIndex, tileName):
+        if not tileName: return tileIndex
+        key = (tileName, tileIndex)
+        if key not in self.irregularIds:
+            self.irregularIds[key] = len(self.irregularTiles)
+            self.irregularTiles.append(key)
+        return -2 - self.irregularIds[key]
+    
+    def decode(self, code):
+        """Returns the Tile or IrregularTile for a stored int."""
+        if code >= 0: return Tile(self.tileFactory, code)
+        name, index = self.irregularTiles[-2 - code]
+        return IrregularTile(self.tileFactory, name, index)
+    
+    def tileIndexOf(self, code):
+        if code >= 0: return code
+        return self.irregularTiles[-2 - code][1]
+        
+    def _planes(self, roof):
+        if roof: return self.roofPlanes, self.roofDepth
+        return self.basePlanes, self.baseDepth
+    
+    def getLayer(self, index, roof=False):
+        """Returns the stored ints of one layer of a cell, bottom first."""
+        planes, depth = self._planes(roof)
+        return [planes[d][index] for d in xrange(depth[index])]
+        
+    def setLayer(self, index, codes, roof=False):
+        planes, depth = self._planes(roof)
+        if len(codes) > 255: raise IndexError, "at most 255 tiles per layer"
+        while len(planes) < len(codes): planes.append(array('i', [TileGrid.EMPTY]) * self.size)
+        for d in xrange(len(planes)): planes[d][index] = codes[d] if d < len(codes) else TileGrid.EMPTY
+        depth[index] = len(codes)
+        self._changed(index)
+        
+    def push(self, index, code, roof=False):
+        """Adds a tile on top of a cell's layer unless the top tile has the same
+        tile index. Returns True if the tile was added."""
+        planes, depth = self._planes(roof)
+        d = depth[index]
+        if d and self.tileIndexOf(planes[d-1][index]) == self.tileIndexOf(code): return False
+        if d == 255: raise IndexError, "at most 255 tiles per layer"
+        if d == len(planes): planes.append(array('i', [TileGrid.EMPTY]) * self.size)
+        planes[d][index] = code
+        depth[index] = d + 1
+        self._changed(index)
+        return True
+    
+    def pop(self, index, roof=False, keep=0):
+        """Removes the top tile of a cell's layer, leaving at least /keep/ tiles."""
+        planes, depth = self._planes(roof)
+        d = depth[index]
+        if d <= keep: return
+        planes[d-1][index] = TileGrid.EMPTY
+        depth[index] = d - 1
+        self._changed(index)
+        
+    def isWalkable(self, index):
+        return bool(self.walkable[index >> 3] & (1 << (index & 7)))
+    
+    def setWalkable(self, index, walkable):
+        byte, bit = index >> 3, 1 << (index & 7)
+        old = self.walkable[byte]
+        if walkable: self.walkable[byte] = old | bit
+        else: self.walkable[byte] = old & ~bit
+        if old != self.walkable[byte]: self._changed(index)
+        
+    def getTrigger(self, index): return self.triggerNames[self.triggers[index]]
+    
+    def setTrigger(self, index, triggerId):
+        if triggerId is None: tid = 0
+        else:
+            if triggerId not in self.triggerIds:
+                self.triggerIds[triggerId] = len(self.triggerNames)
+                self.triggerNames.append(triggerId)
+            tid = self.triggerIds[triggerId]
+        if self.triggers[index] != tid:
+            self.triggers[index] = tid
+            self._changed(index)
+            
+    def render(self, index, surface, x, y, roof=False):
+        """Draws one layer of a cell without creating any Tile objects."""
+        planes, depth = self._planes(roof)
+        tf = self.tileFactory
+        for d in xrange(depth[index]):
+            code = planes[d][index]
+            if code >= 0: 
+                try: surface.blit(tf.tiles[code], (x,y))
+                except Exception: pass
+            else:
+                name, tileIndex = self.irregularTiles[-2 - code]
+                surface.blit(tf.irregularTiles[name][1][tileIndex], (x,y))
+                
+    def getCell(self, index):
+        """Same as Tilestack.toCell for the cell at index."""
+        ret = []
+        for roof in (False, True):
+            layer = []
+            for code in self.getLayer(index, roof):
+                if code >= 0: layer.append((code, None))
+                else: 
+                    name, tileIndex = self.irregularTiles[-2 - code]
+                    layer.append((tileIndex, name))
+            ret.append(layer)
+        return ret[0], ret[1], self.isWalkable(index), self.getTrigger(index)
+    
+    def setCell(self, index, cell):
+        base, roof, walkable, trigger = cell
+        self.setLayer(index, [self.encodeCell(i, n) for i, n in base])
+        self.setLayer(index, [self.encodeCell(i, n) for i, n in roof], True)
+        self.setWalkable(index, walkable)
+        self.setTrigger(index, trigger)
+        
+    def cells(self):
+        """Yields getCell for every cell in order, for writing the map out."""
+        basePlanes, roofPlanes, baseDepth, roofDepth = self.basePlanes, self.roofPlanes, self.baseDepth, self.roofDepth
+        walkable, triggers, triggerNames, irregular = self.walkable, self.triggers, self.triggerNames, self.irregularTiles
+        decode = lambda code: (code, None) if code >= 0 else irregular[-2 - code][::-1]
+        for index in xrange(self.size):
+            yield ([decode(basePlanes[d][index]) for d in xrange(baseDepth[index])],
+                   [decode(roofPlanes[d][index]) for d in xrange(roofDepth[index])],
+                   bool(walkable[index >> 3] & (1 << (index & 7))),
+                   triggerNames[triggers[index]])
+    
+    def loadCells(self, cells):
+        """Fills a freshly made, empty grid from cells in the getCell format,
+        e.g. straight from a mapformat.MapReader. Doesn't notify onChange.
+        """
+        walkable, triggers = self.walkable, self.triggers
+        for index, (base, roof, isWalkable, triggerId) in enumerate(cells):
+            for layer, planes, depth in ((base, self.basePlanes, self.baseDepth), (roof, self.roofPlanes, self.roofDepth)):
+                if not layer: continue
+                n = len(layer)
+                if n > 255: raise IndexError, "at most 255 tiles per layer"
+                while len(planes) < n: planes.append(array('i', [TileGrid.EMPTY]) * self.size)
+                for d in xrange(n):
+                    tileIndex, name = layer[d]
+                    planes[d][index] = self.encodeCell(tileIndex, name) if name else tileIndex
+                depth[index] = n
+            if not isWalkable: walkable[index >> 3] &= ~(1 << (index & 7))
+            if triggerId is not None:
+                if triggerId not in self.triggerIds:
+                    self.triggerIds[triggerId] = len(self.triggerNames)
+                    self.triggerNames.append(triggerId)
+                triggers[index] = self.triggerIds[triggerId]
+        
+class GridTilestack(Tilestack):
+    """A Tilestack-compatible view onto one cell of a TileGrid. Views are made
+    on demand and compare equal when they refer to the same cell. The
+    baseTiles and roofTiles lists are built on each access; change the stack
+    through its methods or by assigning a whole new list.
+    """
+    
+    def __init__(self, grid, index):
+        self.grid = grid
+        self.index = index
+        
+    def __eq__(self, other):
+        return isinstance(other, GridTilestack) and other.grid is self.grid and other.index == self.index
+    def __ne__(self, other): return not self.__eq__(other)
+    def __hash__(self): return hash((id(self.grid), self.index))
+    
+    def __repr__(self): return "<GridTilestack %d>" % self.index
+    
+    def __len__(self): return self.grid.baseDepth[self.index] + self.grid.roofDepth[self.index]
+    
+    def _changed(self): self.grid._changed(self.index)
+    
+    def __get_onChange(self): return None
+    def __set_onChange(self, onChange): 
+        raise AttributeError, "listen for changes through TileGrid.onChange"
+    onChange = property(__get_onChange, __set_onChange)
+    
+    def __get_base(self): return [self.grid.decode(c) for c in self.grid.getLayer(self.index)]
+    def __set_base(self, tiles): self.grid.setLayer(self.index, [self.grid.encode(t) for t in tiles])
+    baseTiles = property(__get_base, __set_base, None, "Base tiles, bottom first")
+    
+    def __get_roof(self): return [self.grid.decode(c) for c in self.grid.getLayer(self.index, True)]
+    def __set_roof(self, tiles): self.grid.setLayer(self.index, [self.grid.encode(t) for t in tiles], True)
+    roofTiles = property(__get_roof, __set_roof, None, "Roof tiles, bottom first")
+    
+    def __get_walkable(self): return self.grid.isWalkable(self.index)
+    def __set_walkable(self, walkable): self.grid.setWalkable(self.index, walkable)
+    isWalkable = property(__get_walkable, __set_walkable, None, "Whether actors can walk onto this stack")
+    
+    def __get_trigger(self): return self.grid.getTrigger(self.index)
+    def __set_trigger(self, triggerId): self.grid.setTrigger(self.index, triggerId)
+    triggerId = property(__get_trigger, __set_trigger, None, "Script id executed when this stack is acted upon")
+    
+    def __get_contents(self): return self.grid.contents.get(self.index)
+    def __set_contents(self, contents):
+        if contents is None: self.grid.contents.pop(self.index, None)
+        else: self.grid.contents[self.index] = contents
+    contents = property(__get_contents, __set_contents, None, "Items held by a container on this stack")
+    
+    def renderBase(self, surface, x, y): self.grid.render(self.index, surface, x, y)
+    def renderRoof(self, surface, x, y): self.grid.render(self.index, surface, x, y, True)
+    
+    def addBaseTile(self, tile): self.grid.push(self.index, self.grid.encode(tile))
+    def addRoofTile(self, tile): self.grid.push(self.index, self.grid.encode(tile), True)
+    def removeTopBaseTile(self): self.grid.pop(self.index, keep=1)
+    def removeTopRoofTile(self): self.grid.pop(self.index, True)
+    
+    def toCell(self): return self.grid.getCell(self.index)
+
+class TileChunk(object):
+    """A square block of tilestacks pre-rendered onto off-screen surfaces: one
+    opaque surface for the base tiles and, only when something in the chunk
+    needs it, a transparent one for the roof tiles.
+    """
+    
+    def __init__(self, cache, tx, ty, width, height):
+        self.cache = cache
+        self.tx, self.ty = tx, ty
+        self.width, self.height = width, height
+        self.base = None
+        self.roof = None
+        self.hasRoof = False
+        self.dirty = True
+        self.lastUsed = -1
+        
+    def invalidate(self):
+        """Marks the chunk for re-rendering the next time it is visible."""
+        if not self.dirty: self.cache.damaged.append(self)
+        self.dirty = True
+        
+    def getRect(self):
+        """Returns the map pixel rect covered by this chunk."""
+        tw, th = self.cache.tileWidth, self.cache.tileHeight
+        return (self.tx * tw, self.ty * th, self.width * tw, self.height * th)
+        
+    def release(self):
+        """Drops the chunk's surfaces, it will be rebuilt when next needed."""
+        self.base = None
+        self.roof = None
+        self.dirty = True
+        
+    def build(self):
+        scene = self.cache.scene
+        tw, th = self.cache.tileWidth, self.cache.tileHeight
+        size = (self.width * tw, self.height * th)
+        
+        if not self.base or self.base.get_size() != size:
+            self.base = pygame.Surface(size)
+            if pygame.display.get_surface(): self.base = self.base.convert()
+        self.base.fill((0,0,0))
+        
+        borderUnwalkable, borderTrigger = scene.borderUnwalkable, scene.borderTrigger
+        tilestacks, width = scene.tilestacks, scene.widthInTiles
+        
+        roofStacks = []
+        for y in xrange(self.height):
+            row = (self.ty + y) * width + self.tx
+            py = y * th
+            for x in xrange(self.width):
+                px = x * tw
+                try:
+                    ts = tilestacks[row + x]
+                    ts.renderBase(self.base, px, py)
+                    border = (not ts.isWalkable and borderUnwalkable) or (ts.triggerId and borderTrigger)
+                    if border: self._drawBorders(self.base, ts, px, py)
+                    if ts.roofTiles or border: roofStacks.append((ts, px, py))
+                except: self.base.fill((0,0,0), (px, py, tw, th))
+        
+        profiler.count("tiles blitted", self.width * self.height + len(roofStacks))
+        self.hasRoof = len(roofStacks) > 0
+        if self.hasRoof:
+            if not self.roof or self.roof.get_size() != size:
+                self.roof = pygame.Surface(size, SRCALPHA, 32)
+                if pygame.display.get_surface(): self.roof = self.roof.convert_alpha()
+            self.roof.fill((0,0,0,0))
+            for ts, px, py in roofStacks:
+                try:
+                    ts.renderRoof(self.roof, px, py)
+                    self._drawBorders(self.roof, ts, px, py)
+                except: pass
+        else: self.roof = None
+        
+        self.dirty = False
+        
+    def _drawBorders(self, surface, ts, px, py):
+        scene = self.cache.scene
+        tw, th = self.cache.tileWidth, self.cache.tileHeight
+        if not ts.isWalkable and scene.borderUnwalkable:
+            pygame.draw.rect(surface, (0,100,0,255), (px,py,tw,th), 1)
+        if ts.triggerId and scene.borderTrigger:
+            pygame.draw.rect(surface, (0,0,100,255), (px+1,py+1,tw-2,th-2), 1)
+
+class TileChunkCache(object):
+    """Keeps the scene's tilestacks pre-rendered in chunks so that drawing the
+    visible part of the map costs a handful of blits instead of one blit per
+    tile per layer. Tilestacks tell their chunk when they change, so only
+    edited chunks are ever rendered again. Chunks that have not been visible
+    for a while give their surfaces back once more than
+    configuration.tile_chunk_cache_limit of them are held.
+    """
+    
+    def __init__(self, scene, **kwargs):
+        self.scene = scene
+        self.chunkSize = kwargs['chunkSize'] if 'chunkSize' in kwargs else configuration.tile_chunk_size
+        self.limit = kwargs['limit'] if 'limit' in kwargs else configuration.tile_chunk_cache_limit
+        self.frame = 0
+        self.reset()
+        
+    def reset(self):
+        """Rebuilds the chunk grid from the scene, used after the map has been
+        resized or its tilestacks replaced.
+        """
+        scene = self.scene
+        self.tileWidth = scene.tileFactory.tileWidth
+        self.tileHeight = scene.tileFactory.tileHeight
+        self.widthInChunks = (scene.widthInTiles + self.chunkSize - 1) / self.chunkSize
+        self.heightInChunks = (scene.heightInTiles + self.chunkSize - 1) / self.chunkSize
+        self.chunks = []
+        self.built = []
+        self.damaged = []
+        
+        grid = isinstance(scene.tilestacks, TileGrid)
+        if grid: scene.tilestacks.onChange = self.invalidateTile
+        
+        for cy in xrange(self.heightInChunks):
+            for cx in xrange(self.widthInChunks):
+                tx, ty = cx * self.chunkSize, cy * self.chunkSize
+                w = min(self.chunkSize, scene.widthInTiles - tx)
+                h = min(self.chunkSize, scene.heightInTiles - ty)
+                chunk = TileChunk(self, tx, ty, w, h)
+                self.chunks.append(chunk)
+                if grid: continue
+                for y in xrange(ty, ty + h):
+                    for x in xrange(tx, tx + w):
+                        try: scene.tilestacks[y * scene.widthInTiles + x].onChange = chunk.invalidate
+                        except IndexError: pass
+                    
+    def invalidate(self):
+        """Marks every chunk for re-rendering."""
+        for chunk in self.chunks: chunk.invalidate()
+        
+    def invalidateTile(self, index):
+        """Marks the chunk holding the tile at index (in scene.tilestacks) for
+        re-rendering.
+        """
+        width = self.scene.widthInTiles
+        self.chunkAt(index % width, index / width).invalidate()
+        
+    def takeDamage(self):
+        """Returns the map pixel rects of the chunks that were on display and have
+        changed since the last call.
+        """
+        ret = [chunk.getRect() for chunk in self.damaged]
+        self.damaged = []
+        return ret
+        
+    def chunkAt(self, tx, ty):
+        """Returns the chunk holding the tile at tx,ty."""
+        return self.chunks[(ty / self.chunkSize) * self.widthInChunks + tx / self.chunkSize]
+    
+    def visibleChunks(self, vx, vy, width, height):
+        """Yields (chunk, x, y) for each chunk overlapping the width x height
+        area whose topleft is at pixel vx,vy on the map.
+        """
+        cw, ch = self.chunkSize * self.tileWidth, self.chunkSize * self.tileHeight
+        # the last chunks may be partial, so the area is clipped to the map
+        right = min(vx + width, self.scene.widthInTiles * self.tileWidth)
+        bottom = min(vy + height, self.scene.heightInTiles * self.tileHeight)
+        cxstart, cystart = max(vx, 0) / cw, max(vy, 0) / ch
+        cxend = (right - 1) / cw + 1 if right > max(vx, 0) else cxstart
+        cyend = (bottom - 1) / ch + 1 if bottom > max(vy, 0) else cystart
+        
+        for cy in xrange(cystart, cyend):
+            for cx in xrange(cxstart, cxend):
+                yield self.chunks[cy * self.widthInChunks + cx], cx * cw - vx, cy * ch - vy
+        
+    def renderBase(self, surface, vx, vy):
+        """Draws the base layer of the map as seen from vx,vy."""
+        self.frame += 1
+        sw, sh = surface.get_size()
+        if vx < 0 or vy < 0 or self.scene.widthInPixels - vx < sw or self.scene.heightInPixels - vy < sh:
+            surface.fill((0,0,0))
+        
+        for chunk, x, y in self.visibleChunks(vx, vy, sw, sh):
+            if chunk.dirty:
+                if not chunk.base: self.built.append(chunk)
+                chunk.build()
+            chunk.lastUsed = self.frame
+            surface.blit(chunk.base, (x, y))
+            profiler.count("chunks blitted")
+            
+        if len(self.built) > self.limit: self._evict()
+        
+    def renderRoof(self, surface, vx, vy):
+        """Draws the roof layer of the map as seen from vx,vy. Must follow a
+        call to renderBase for the same frame.
+        """
+        sw, sh = surface.get_size()
+        for chunk, x, y in self.visibleChunks(vx, vy, sw, sh):
+            if chunk.hasRoof:
+                surface.blit(chunk.roof, (x, y))
+                profiler.count("chunks blitted")
+            
+    def _evict(self):
+        self.built.sort(lambda a,b: b.lastUsed - a.lastUsed)
+        for chunk in self.built[self.limit:]:
+            if chunk.lastUsed != self.frame: chunk.release()
+        self.built = [c for c in self.built if c.base]
@@ -0,0 +1,108 @@
+# vfs.py
+# The data zips (spritesets, tilesets, scripts, dialogs, items) as a virtual
+# filesystem: each archive is opened and memory-mapped once, its central
+# directory read once and its members indexed by set and item, instead of
+# every loader opening its own ZipFile for every scene and every actor.
+#
+# Members stored without compression (DatasetBuilder stores PNGs that way,
+# they are compressed already) are served straight out of the map without
+# copying; deflated members are inflated from it.
+#
+
+from cStringIO import StringIO
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import dataset
+import mmap
+import os
+import struct
+import zlib
+
+class Archive(object):
+    """One mounted data zip. sets maps a member's directory to its members
+    (like dataset.splitSets), itemsets maps a set to its items and each item
+    to its members, for the zips laid out set/item/file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stat = _stat(filename)
+        self.file = open(filename, 'rb')
+        try:
+            z = ZipFile(self.file)
+            self.infos = dict((info.filename, info) for info in z.infolist())
+            z.close() # leaves self.file open, ZipFile didn't open it
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.stat[0] else ''
+        except:
+            self.file.close()
+            raise
+        self.offsets = {} # name -> offset of the member's data in the map
+
+        self.sets = dataset.splitSets(self.infos)
+        self.itemsets = {}
+        for directory, names in self.sets.iteritems():
+            set, item = os.path.split(directory)
+            if not set in self.itemsets: self.itemsets[set] = {}
+            self.itemsets[set][item] = names
+
+    def namelist(self): return self.infos.keys()
+
+    def getinfo(self, name): return self.infos[name]
+
+    def view(self, name):
+        """Returns the member's contents as a buffer over the map for a stored
+        member, or as a string for a compressed one.
+        """
+        info = self.infos[name]
+        offset = self._dataOffset(info)
+        if info.compress_type == ZIP_STORED: return buffer(self.map, offset, info.file_size)
+        if info.compress_type == ZIP_DEFLATED: return zlib.decompress(self.map[offset:offset + info.compress_size], -15)
+        raise IOError, "Unsupported compression type %d for %s in %s" % (info.compress_type, name, self.filename)
+
+    def read(self, name):
+        "Returns the member's contents as a string, like ZipFile.read."
+        return str(self.view(name))
+
+    def open(self, name):
+        "Returns a read-only file object for the member, e.g. for pygame.image.load."
+        return StringIO(self.view(name))
+
+    def _dataOffset(self, info):
+        offset = self.offsets.get(info.filename)
+        if offset is None:
+            header = self.map[info.header_offset:info.header_offset + 30]
+            if header[:4] != "PK\003\004": raise IOError, "Bad local header for %s in %s" % (info.filename, self.filename)
+            nameLength, extraLength = struct.unpack("<HH", header[26:30])
+            offset = self.offsets[info.filename] = info.header_offset + 30 + nameLength + extraLength
+        return offset
+
+    def close(self):
+        if self.map: self.map.close()
+        self.file.close()
+
+    def __repr__(self):
+        return "Archive %s: %d members in %d sets" % (self.filename, len(self.infos), len(self.sets))
+
+_archives = {} # filename -> Archive
+
+def _stat(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime)
+
+def mount(filename):
+    """Returns the Archive for filename, opening it the first time and again
+    only if the file changed on disk since.
+    """
+    archive = _archives.get(filename)
+    if archive is not None:
+        if archive.stat == _stat(filename): return archive
+        unmount(filename)
+    archive = _archives[filename] = Archive(filename)
+    return archive
+
+def unmount(filename):
+    "Closes the Archive for filename, e.g. before the file is replaced."
+    archive = _archives.pop(filename, None)
+    if archive is not None: archive.close()
+
+def unmountAll():
+    for filename in _archives.keys(): unmount(filename)
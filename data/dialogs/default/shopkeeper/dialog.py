@@ -134,27 +134,31 @@ def build_shopkeeper_dialog(scene, buyer, seller):
             self.populateList(self.sellerList, self.seller, False)
             
         def populateList(self, list, actor, buyer):
-            for item in actor.inventory.stowed:
-                if item.count <= 0: continue
-                id = ItemDisplay(item, buyer)
-                id.borderRenderer = gui.RoundBorderRenderer(id, borderWidth=2, backgroundColor=(255,255,255))
-                id.borderRenderer.cornerRadius = 20
-                id.width = self.frame.width - 20
-                id.y = 10            
-                id.height = self.frame.y - 20
-                id.x = (self.width-id.width)/2
-                id.show = False
-                self.add(id)
-    
+            # the list only makes labels for the items scrolled into view, and
+            # an item's display is only made once it is clicked
+            def createRow(item):
                 lbl = gui.Label(text=item.name, width=list.width)
-                ih = self.ItemHover(self, id, lbl, buyer)
+                ih = self.ItemHover(self, item, lbl, buyer)
                 lbl.clicked = ih.clicked
-                list.add(lbl)
+                return lbl
+            list.rowFactory = createRow
+            list.extend([item for item in actor.inventory.stowed if item.count > 0])
+            
+        def createItemDisplay(self, item, buyer):
+            id = ItemDisplay(item, buyer)
+            id.borderRenderer = gui.RoundBorderRenderer(id, borderWidth=2, backgroundColor=(255,255,255))
+            id.borderRenderer.cornerRadius = 20
+            id.width = self.frame.width - 20
+            id.y = 10            
+            id.height = self.frame.y - 20
+            id.x = (self.width-id.width)/2
+            self.add(id)
+            return id
                 
         def redraw(self):
             self.buyerMoney.text = 'Money: %s' % self.buyer.money
             self.sellerMoney.text = 'Money: %s' % self.seller.money
-            self.itemDisplayShown.show = False
+            self.remove(self.itemDisplayShown)
             self.buyerList.removeAllChildren()
             self.populateList(self.buyerList, self.buyer, True)
             self.sellerList.removeAllChildren()
@@ -183,9 +187,9 @@ def build_shopkeeper_dialog(scene, buyer, seller):
             self.redraw()
                 
         class ItemHover:        
-            def __init__(self, app, itemDisplay, label, buyer=True): 
+            def __init__(self, app, item, label, buyer=True): 
                 self.app = app
-                self.id = itemDisplay
+                self.item = item
                 self.label = label
                 self.buyer = buyer
                 self.origBuyClicked = None
@@ -193,13 +197,12 @@ def build_shopkeeper_dialog(scene, buyer, seller):
                 
             def clicked(self, event, control):
                 if self.app.itemDisplayShown:
-                    self.app.itemDisplayShown.show = False
+                    self.app.remove(self.app.itemDisplayShown)
                 if self.app.itemDisplayLabel:
                     self.app.itemDisplayLabel.backgroundColor = (0,0,0,0)
                 
-                self.id.show = True
                 self.label.backgroundColor = (0,0,0,50)
-                self.app.itemDisplayShown = self.id
+                self.app.itemDisplayShown = self.app.createItemDisplay(self.item, self.buyer)
                 self.app.itemDisplayLabel = self.label
                 
                 if self.buyer: 
@@ -208,12 +211,11 @@ def build_shopkeeper_dialog(scene, buyer, seller):
                 else: 
                     self.app.buyButton.enabled = True
                     self.app.sellButton.enabled = False
-                    
-            def mouseEnter(self, event): self.id.show = True        
-            def mouseLeave(self, event): self.id.show = False
+
     
     return ShopInterface(scene, buyer, seller)
     
 def speak(otherFuncs, actor, scene):
     scene.playDialog(actor, 'I have a few items I can sell...')
+    scene.engine.runPendingOverlays()
     otherFuncs.build_shopkeeper_dialog(scene, scene.player, actor).run()
\ No newline at end of file
@@ -1,5 +1,6 @@
 
 def sayHi(engine):
+	engine.runPendingOverlays()
 	gui.ChatDialog("Hi there.").run()
 
 def warp(engine):
@@ -11,6 +12,7 @@ def container_search(engine):
 	ts = engine.scene.actionObject
 	contents = ""
 	for item in ts.contents: contents += "* %s\n" % item.name
+	engine.runPendingOverlays()
 	gui.Dialog("Contents of bag:\n%s" % contents).run()
 	
 def loadDefaultMap(engine):
@@ -0,0 +1,53 @@
+#
+# Tests for the shared asset cache
+#
+
+import sys
+sys.path.append('../components')
+
+import gc
+from assetcache import AssetCache
+
+class Holder(object): pass
+
+class Test_AssetCache:
+
+    def setup_method(self, method):
+        self.loads = []
+        def loader(key):
+            self.loads.append(key)
+            return [key]
+        self.cache = AssetCache("test", loader, lambda asset: 10, 25)
+
+    def test_shared_per_key(self):
+        a, b = Holder(), Holder()
+        assert self.cache.acquire('x', a) is self.cache.acquire('x', b)
+        assert self.loads == ['x']
+        assert self.cache.refCount('x') == 2
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_release_and_collect(self):
+        a, b = Holder(), Holder()
+        self.cache.acquire('x', a)
+        self.cache.acquire('x', b)
+        self.cache.release('x', a)
+        assert self.cache.refCount('x') == 1
+        del b
+        gc.collect()
+        assert self.cache.refCount('x') == 0
+        assert 'x' in self.cache
+
+    def test_lru_eviction_of_unused_only(self):
+        a, b, c, d = Holder(), Holder(), Holder(), Holder()
+        self.cache.acquire('a', a)
+        self.cache.acquire('b', b)
+        self.cache.release('b', b)
+        self.cache.release('a', a)
+        assert self.cache.stats()['unused'] == 2 # 20 bytes still fit
+        self.cache.acquire('c', c)
+        assert 'b' not in self.cache and 'a' in self.cache
+        self.cache.acquire('d', d)
+        self.cache.acquire('e', d)
+        assert len(self.cache) == 3 # held assets are never evicted
+        assert self.cache.bytes == 30
+        assert self.cache.evictions == 2
@@ -0,0 +1,79 @@
+#
+# Tests for the compiled content script cache
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import shutil
+import tempfile
+import codecache
+import configuration
+
+Script = "x = 1\r\ndef first(engine): return x\r\nclass Thing: pass\r\ndef second(engine): pass"
+
+class Test_CodeCache:
+
+    def setup_method(self, method):
+        self.cachedir, configuration.cachedir = configuration.cachedir, tempfile.mkdtemp()
+        codecache.clear()
+
+    def teardown_method(self, method):
+        shutil.rmtree(configuration.cachedir)
+        configuration.cachedir = self.cachedir
+        codecache.clear()
+
+    def entries(self):
+        return [name for name in os.listdir(configuration.cachedir) if name.endswith('.marshal')]
+
+    def test_compiles_and_runs(self):
+        g = {}
+        exec(codecache.compileSource(Script, "default/test.py"), g)
+        assert g['first'](None) == 1
+        assert g['first'].func_code.co_filename == "default/test.py"
+
+    def test_defined_functions(self):
+        code = codecache.compileSource(Script, "default/test.py")
+        assert sorted(codecache.definedFunctions(code)) == ['Thing', 'first', 'second']
+
+    def test_reused_from_memory_and_disk(self):
+        code = codecache.compileSource(Script, "default/test.py")
+        assert codecache.compileSource(Script, "default/test.py") is code
+        assert len(self.entries()) == 1
+
+        codecache.clear()
+        loaded = codecache.compileSource(Script, "default/test.py")
+        assert loaded is not code and loaded.co_consts == code.co_consts
+
+    def test_changed_source_replaces_entry(self):
+        codecache.compileSource(Script, "default/test.py")
+        codecache.compileSource("y = 2\n", "other/test.py")
+        old = set(self.entries())
+        codecache.compileSource(Script + "\ny = 3", "default/test.py")
+        new = set(self.entries())
+        assert len(new) == 2 and len(old & new) == 1
+
+    def test_unreadable_entry_is_recompiled(self):
+        codecache.compileSource(Script, "default/test.py")
+        path = os.path.join(configuration.cachedir, self.entries()[0])
+        f = open(path, 'wb')
+        f.write("not marshal data")
+        f.close()
+        codecache.clear()
+        g = {}
+        exec(codecache.compileSource(Script, "default/test.py"), g)
+        assert g['first'](None) == 1
+
+    def test_disabled(self):
+        configuration.code_cache = False
+        try: codecache.compileSource(Script, "default/test.py")
+        finally: configuration.code_cache = True
+        assert self.entries() == []
+
+    def test_syntax_error(self):
+        try:
+            codecache.compileSource("def broken(:\n", "default/broken.py")
+            assert False
+        except SyntaxError, e:
+            assert e.filename == "default/broken.py"
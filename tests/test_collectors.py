@@ -0,0 +1,77 @@
+#
+# Tests for the lazily run dialogs and their helper functions
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import shutil
+import tempfile
+import configuration
+import vfs
+from collectors import DialogCollector, DialogHelpers
+from zipfile import ZipFile
+
+Greeter = '''
+def speak(otherFuncs, actor, scene):
+    scene.said.append(otherFuncs.offer(actor))
+'''
+
+Merchant = '''
+scene.ran.append("merchant")
+
+def offer(actor): return "a deal for %s" % actor.name
+
+def speak(otherFuncs, actor, scene):
+    scene.said.append("hello " + actor.name)
+'''
+
+class FakeScene:
+    def __init__(self):
+        self.engine = None
+        self.said, self.ran = [], []
+
+class FakeActor:
+    def __init__(self, dialogId):
+        self.dialogId = dialogId
+        self.name = "Bob"
+
+class Test_DialogCollector:
+
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = configuration.dialogs, configuration.code_cache
+        configuration.dialogs = os.path.join(self.tmp, 'dialogs.zip')
+        configuration.code_cache = False
+        z = ZipFile(configuration.dialogs, 'w')
+        z.writestr('default/greeter/dialog.py', Greeter)
+        z.writestr('default/merchant/dialog.py', Merchant)
+        z.close()
+        self.scene = FakeScene()
+        self.collector = DialogCollector(self.scene, 'default')
+
+    def teardown_method(self, method):
+        configuration.dialogs, configuration.code_cache = self.saved
+        vfs.unmountAll()
+        shutil.rmtree(self.tmp)
+
+    def test_dialogs_run_when_first_spoken(self):
+        assert self.collector.dialogs == {'greeter': None, 'merchant': None}
+        self.collector.runDialog(FakeActor('merchant'))
+        self.collector.runDialog(FakeActor('merchant'))
+        assert self.scene.ran == ["merchant"]
+        assert self.scene.said == ["hello Bob", "hello Bob"]
+
+    def test_helper_of_an_unspoken_dialog(self):
+        self.collector.runDialog(FakeActor('greeter'))
+        assert self.scene.said == ["a deal for Bob"]
+        assert self.scene.ran == ["merchant"]
+        assert self.collector.dialogs['merchant'] is not None
+
+    def test_unknown_helper(self):
+        assert self.collector.getHelper('nothing') is None
+        try: DialogHelpers(self.collector).nothing
+        except AttributeError: pass
+        else: assert False
+        assert self.scene.ran == []
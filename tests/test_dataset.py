@@ -0,0 +1,166 @@
+#
+# Tests for the incremental dataset builder
+#
+
+import sys
+sys.path.append('../components')
+
+import configuration
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from dataset import DatasetBuilder
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+
+def writeDescriptorZip(filename, members):
+    """Writes a zip the way streaming zip writers do: every member has an
+    extra field, and its crc and sizes follow its data in a data descriptor
+    instead of being in its local header."""
+    f = open(filename, 'wb')
+    central = []
+    extra = struct.pack("<HHB", 0x5455, 1, 0) # an empty extended timestamp
+    for name, data, compression in members:
+        if compression == ZIP_DEFLATED:
+            c = zlib.compressobj(6, zlib.DEFLATED, -15)
+            compressed = c.compress(data) + c.flush()
+        else: compressed = data
+        crc = zlib.crc32(data) & 0xffffffff
+        offset = f.tell()
+        f.write(struct.pack("<4s2B4HL2L2H", "PK\003\004", 20, 0, 0x08, compression, 0, 0x21, 0, 0, 0, len(name), len(extra)))
+        f.write(name + extra + compressed)
+        f.write(struct.pack("<4sLLL", "PK\007\010", crc, len(compressed), len(data)))
+        central.append(struct.pack("<4s4B4HL2L5H2L", "PK\001\002", 20, 3, 20, 0, 0x08, compression, 0, 0x21,
+                                   crc, len(compressed), len(data), len(name), len(extra), 0, 0, 0, 0, offset) + name + extra)
+    start = f.tell()
+    for entry in central: f.write(entry)
+    f.write(struct.pack("<4s4H2LH", "PK\005\006", 0, 0, len(central), len(central), f.tell() - start, start, 0))
+    f.close()
+
+def compressedBytes(filename):
+    "Maps each member of a zip to its bytes as stored, still compressed"
+    z = ZipFile(filename)
+    f = open(filename, 'rb')
+    try:
+        ret = {}
+        for info in z.infolist():
+            f.seek(info.header_offset + 26)
+            nameLength, extraLength = struct.unpack("<HH", f.read(4))
+            f.seek(nameLength + extraLength, 1)
+            ret[info.filename] = f.read(info.compress_size)
+        return ret
+    finally:
+        f.close()
+        z.close()
+
+class Test_DatasetBuilder:
+
+    def setup_method(self, method):
+        self.oldDirs = configuration.datadir, configuration.cachedir
+        self.tmp = tempfile.mkdtemp()
+        configuration.datadir = self.tmp
+        configuration.cachedir = os.path.join(self.tmp, 'cache')
+        self.src = os.path.join(self.tmp, 'things')
+        for d in ('a', 'b'): os.makedirs(os.path.join(self.src, d))
+        self.write('a/one.txt', 'one')
+        self.write('a/two.txt', 'two')
+        self.write('b/three.txt', 'three')
+        self.zip = os.path.join(self.tmp, 'things.zip')
+
+    def teardown_method(self, method):
+        configuration.datadir, configuration.cachedir = self.oldDirs
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data, mtime=None):
+        filename = os.path.join(self.src, name)
+        f = open(filename, 'w')
+        f.write(data)
+        f.close()
+        if mtime: os.utime(filename, (mtime, mtime))
+
+    def build(self): return DatasetBuilder().buildDataset(self.src)
+
+    def contents(self, filename=None):
+        z = ZipFile(filename or self.zip)
+        try:
+            assert z.testzip() is None
+            return dict((name, z.read(name)) for name in z.namelist())
+        finally: z.close()
+
+    def test_first_build(self):
+        assert self.build() == 3
+        assert self.contents() == {'a/one.txt': 'one', 'a/two.txt': 'two', 'b/three.txt': 'three'}
+
+    def test_unchanged(self):
+        self.build()
+        before = os.stat(self.zip).st_mtime
+        assert self.build() == 0
+        assert os.stat(self.zip).st_mtime == before
+
+    def test_touched_but_identical(self):
+        self.build()
+        self.write('a/one.txt', 'one', time.time() + 10)
+        assert self.build() == 0
+
+    def test_changed_member(self):
+        self.build()
+        self.write('a/two.txt', 'TWO!', time.time() + 20)
+        assert self.build() == 1
+        assert self.contents() == {'a/one.txt': 'one', 'a/two.txt': 'TWO!', 'b/three.txt': 'three'}
+
+    def test_added_and_removed(self):
+        self.build()
+        os.remove(os.path.join(self.src, 'b', 'three.txt'))
+        self.write('b/four.txt', 'four')
+        assert self.build() == 1
+        assert self.contents() == {'a/one.txt': 'one', 'a/two.txt': 'two', 'b/four.txt': 'four'}
+
+    def test_missing_zip_rebuilds(self):
+        self.build()
+        os.remove(self.zip)
+        assert self.build() == 3
+        assert len(self.contents()) == 3
+
+    def test_images_stored(self):
+        self.write('b/five.png', '\x89PNG' * 100)
+        self.build()
+        z = ZipFile(self.zip)
+        try:
+            assert z.getinfo('b/five.png').compress_type == ZIP_STORED
+            assert z.getinfo('a/one.txt').compress_type == ZIP_DEFLATED
+        finally: z.close()
+
+    def test_copied_members_are_byte_identical(self):
+        self.write('a/one.txt', 'one ' * 1000)
+        self.write('b/five.png', '\x89PNG' * 100)
+        self.build()
+        before = compressedBytes(self.zip)
+
+        self.write('a/two.txt', 'TWO!', time.time() + 20)
+        assert self.build() == 1
+        after = compressedBytes(self.zip)
+        for name in ('a/one.txt', 'b/five.png', 'b/three.txt'): assert after[name] == before[name]
+        assert after['a/two.txt'] != before['a/two.txt']
+        assert self.contents()['a/one.txt'] == 'one ' * 1000
+
+    def test_copy_members_with_data_descriptors(self):
+        members = [('a/one.txt', 'one ' * 1000, ZIP_DEFLATED), ('b/five.png', '\x89PNG' * 100, ZIP_STORED),
+                   ('b/empty.txt', '', ZIP_DEFLATED)]
+        source, copy = os.path.join(self.tmp, 'streamed.zip'), os.path.join(self.tmp, 'copy.zip')
+        writeDescriptorZip(source, members)
+        assert self.contents(source) == dict((name, data) for name, data, compression in members)
+
+        src, dst = ZipFile(source), ZipFile(copy, 'w')
+        for info in src.infolist(): DatasetBuilder()._copyMember(src, dst, info)
+        dst.close()
+        src.close()
+
+        assert self.contents(copy) == dict((name, data) for name, data, compression in members)
+        assert compressedBytes(copy) == compressedBytes(source)
+        z = ZipFile(copy)
+        try:
+            for info in z.infolist(): assert not info.flag_bits & 0x08 and info.extra == ''
+            assert [info.compress_type for info in z.infolist()] == [m[2] for m in members]
+        finally: z.close()
@@ -0,0 +1,59 @@
+#
+# Tests for the entries of the on-disk caches
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import shutil
+import tempfile
+import configuration
+import diskcache
+
+Key = "0123456789abcdef0123456789abcdef01234567"
+OtherKey = "f" * 40
+
+class Test_DiskCache:
+
+    def setup_method(self, method):
+        self.cachedir, configuration.cachedir = configuration.cachedir, tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(configuration.cachedir)
+        configuration.cachedir = self.cachedir
+
+    def touch(self, name):
+        open(os.path.join(configuration.cachedir, name), 'w').close()
+
+    def entries(self): return sorted(os.listdir(configuration.cachedir))
+
+    def test_stale_entries_of_longer_names_stay(self):
+        for name in ["tileset-default-%s.index" % Key, "tileset-default-%s.pixels" % Key, "tileset-default-%s.pixels.tmp" % Key,
+                     "tileset-default-2-%s.index" % OtherKey, "tileset-default-2-%s.pixels" % OtherKey, "tileset-default-notes.txt"]:
+            self.touch(name)
+        diskcache.removeStale("tileset-default-", (".index", ".pixels"))
+        assert self.entries() == ["tileset-default-2-%s.index" % OtherKey, "tileset-default-2-%s.pixels" % OtherKey,
+                                  "tileset-default-notes.txt"]
+
+    def test_suffixes(self):
+        self.touch("code-a.py-%s.marshal" % Key)
+        self.touch("code-a.py-%s.index" % Key)
+        diskcache.removeStale("code-a.py-", (".marshal",))
+        assert self.entries() == ["code-a.py-%s.index" % Key]
+
+    def test_write(self):
+        path = os.path.join(configuration.cachedir, "sub", "entry")
+        assert diskcache.writeFile(path, lambda f: f.write("data") or 5) == 5
+        assert open(path).read() == "data"
+        assert os.listdir(os.path.dirname(path)) == ["entry"]
+
+    def test_failed_write_leaves_nothing(self):
+        path = os.path.join(configuration.cachedir, "entry")
+        def fail(f):
+            f.write("half")
+            raise IOError("disk full")
+        try: diskcache.writeFile(path, fail)
+        except IOError: pass
+        else: assert False
+        assert self.entries() == []
@@ -0,0 +1,150 @@
+#
+# Tests for the engine's overlays, dirty rects and fixed step simulation
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((64, 64))
+
+import configuration
+from engine import Engine, Effects
+
+class FakeUi(object):
+    "Records when it runs modally"
+
+    def __init__(self, name, shown):
+        self.name = name
+        self.shown = shown
+        self.done = False
+
+    def run(self):
+        self.shown.append(self.name)
+        self.done = True
+
+class Test_Overlays:
+
+    def setup_method(self, method):
+        self.engine = object.__new__(Engine)
+        self.engine.overlays = []
+        self.engine.pendingOverlays = []
+        self.shown = []
+        self.closed = []
+
+    def ui(self, name): return FakeUi(name, self.shown)
+
+    def test_queued_show_in_order(self):
+        self.engine.queueOverlay(self.ui("first"))
+        self.engine.queueOverlay(self.ui("second"))
+        assert [o.ui.name for o in self.engine.overlays] == ["first"]
+        self.engine.overlays[0].ui.done = True
+        self.engine.closeOverlays()
+        assert [o.ui.name for o in self.engine.overlays] == ["second"]
+
+    def test_run_pending_runs_the_one_on_display_first(self):
+        onClose = lambda ui: self.closed.append(ui.name)
+        self.engine.queueOverlay(self.ui("greeting"), onClose=onClose)
+        self.engine.queueOverlay(self.ui("offer"), onClose=onClose)
+        self.engine.runPendingOverlays()
+        assert self.shown == ["greeting", "offer"]
+        assert self.closed == ["greeting", "offer"]
+        assert self.engine.overlays == [] and self.engine.pendingOverlays == []
+
+    def test_run_pending_leaves_other_overlays(self):
+        self.engine.openOverlay(self.ui("party screen"))
+        self.engine.queueOverlay(self.ui("line"))
+        self.engine.runPendingOverlays()
+        assert self.shown == ["line"]
+        assert [o.ui.name for o in self.engine.overlays] == ["party screen"]
+
+class FakeScene:
+    def __init__(self): self.rects = []
+    def getDirtyRects(self): return self.rects
+
+class FakeMode:
+    def getDirtyRects(self, surface): return []
+
+class Test_DirtyRects:
+
+    def setup_method(self, method):
+        self.engine = object.__new__(Engine)
+        self.engine.scene = FakeScene()
+        self.engine.mode = FakeMode()
+        self.engine.effects = Effects(self.engine)
+        self.engine.overlays = []
+        self.engine.pendingOverlays = []
+        self.engine.profilerView = None
+        self.engine.lastFrame = None
+        self.engine.buffer = pygame.Surface((64, 64))
+        self.engine.updateText = lambda: []
+        self.engine.getDirtyRects()
+
+    def test_first_frame_is_a_full_redraw(self):
+        self.engine.lastFrame = None
+        assert self.engine.getDirtyRects() is None
+
+    def test_idle(self):
+        assert self.engine.getDirtyRects() == []
+
+    def test_rects_are_merged_and_clipped(self):
+        self.engine.scene.rects = [pygame.Rect(10, 10, 10, 10), pygame.Rect(15, 15, 10, 10),
+                                   pygame.Rect(40, 40, 5, 5), pygame.Rect(60, 60, 10, 10), pygame.Rect(100, 0, 5, 5)]
+        rects = sorted(tuple(r) for r in self.engine.getDirtyRects())
+        assert rects == [(10, 10, 15, 15), (40, 40, 5, 5), (60, 60, 4, 4)]
+
+    def test_scene_needs_a_full_redraw(self):
+        self.engine.scene.rects = None
+        assert self.engine.getDirtyRects() is None
+
+    def test_overlay_opened(self):
+        ui = FakeUi("dialog", [])
+        ui.damage = [pygame.Rect(4, 4, 8, 8)]
+        ui.renderFrame = lambda surface: None
+        ui.needsRedraw = lambda: True
+        self.engine.openOverlay(ui)
+        assert self.engine.getDirtyRects() is None
+        assert [tuple(r) for r in self.engine.getDirtyRects()] == [(4, 4, 8, 8)]
+        ui.needsRedraw = lambda: False
+        assert self.engine.getDirtyRects() == []
+
+    def test_effect_playing(self):
+        self.engine.effects.currentEffect = object()
+        assert self.engine.getDirtyRects() is None
+        assert self.engine.getDirtyRects() is None
+        self.engine.effects.currentEffect = Effects.NoEffect()
+        assert self.engine.getDirtyRects() is None
+        assert self.engine.getDirtyRects() == []
+
+class Test_Simulate:
+
+    def setup_method(self, method):
+        self.engine = object.__new__(Engine)
+        self.engine.updateStep = 1000.0 / 30
+        self.engine.accumulator = 0.0
+        self.engine.scene = self
+        self.steps = 0
+        self.engine.update = self.update
+
+    def update(self): self.steps += 1
+    def setInterpolation(self, alpha): self.alpha = alpha
+
+    def test_steps(self):
+        assert self.engine.simulate(10) == 0
+        assert abs(self.alpha - 0.3) < 1e-9
+        assert self.engine.simulate(30) == 1
+        assert abs(self.alpha - 0.2) < 1e-9
+        assert [self.engine.simulate(1000.0 / 60) for i in xrange(8)] == [0, 1, 0, 1, 0, 1, 0, 1]
+        assert self.steps == 5
+
+    def test_long_stall_is_clamped(self):
+        assert self.engine.simulate(5000) == configuration.max_update_steps
+        assert self.steps == configuration.max_update_steps
+        # nothing of the stall is carried over into the next frame
+        assert self.engine.accumulator == 0.0 and self.alpha == 0.0
+        assert self.engine.simulate(10) == 0
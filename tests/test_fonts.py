@@ -0,0 +1,34 @@
+#
+# Tests for the shared font pool and text surface cache
+#
+
+import sys
+sys.path.append('../components')
+
+import pygame
+pygame.font.init()
+
+import fonts
+
+class Test_Fonts:
+
+    def setup_method(self, method):
+        self.font = fonts.getFont(None, 20)
+        self.cache = fonts.TextCache(64 * 1024)
+
+    def test_fonts_are_shared(self):
+        assert fonts.getFont(None, 20) is self.font
+        assert fonts.getFont(None, 20, bold=True) is not self.font
+        assert fonts.getFont(None, 20, bold=True).get_bold()
+
+    def test_repeated_text_is_reused(self):
+        first = self.cache.render(self.font, "hello", True, (255, 255, 255))
+        assert self.cache.render(self.font, "hello", True, (255, 255, 255)) is first
+        assert self.cache.render(self.font, "hello", True, (0, 0, 0)) is not first
+        assert (self.cache.hits, self.cache.misses) == (1, 2)
+
+    def test_cache_stays_within_its_bytes(self):
+        for i in range(200): self.cache.render(self.font, "line number %d" % i, True, (255, 255, 255))
+        assert self.cache.bytes <= self.cache.maxBytes
+        assert self.cache.evictions > 0
+        assert self.cache.stats()['entries'] == len(self.cache)
@@ -0,0 +1,352 @@
+#
+# Tests for the retained surfaces of gui controls
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((640, 480))
+
+import gui
+
+class Test_ControlCache:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.label = gui.Label(text="Label", pos=(10, 10))
+        self.button = gui.Button(text="Button", pos=(10, 50))
+        self.app.add(self.label)
+        self.app.add(self.button)
+        self.buffer = pygame.Surface((640, 480)).convert_alpha()
+        self.app.renderFrame(self.buffer)
+
+    def test_idle_frame_redraws_nothing(self):
+        self.app.renderFrame(self.buffer)
+        assert self.app.redraws == 0
+
+    def test_changed_text_redraws_control_and_ancestors(self):
+        self.label.text = "Changed"
+        self.app.renderFrame(self.buffer)
+        assert self.app.redraws == 2
+
+    def test_same_text_redraws_nothing(self):
+        self.label.text = "Label"
+        self.app.renderFrame(self.buffer)
+        assert self.app.redraws == 0
+
+    def test_moving_redraws_only_ancestors(self):
+        self.button.x += 5
+        self.app.renderFrame(self.buffer)
+        assert self.app.redraws == 1
+
+    def test_border_renderer_changes_invalidate(self):
+        self.button.borderRenderer.backgroundColor = (1, 2, 3)
+        self.app.renderFrame(self.buffer)
+        assert self.app.redraws == 2
+
+    def test_animated_controls_redraw_every_frame(self):
+        self.label.animated = True
+        for i in range(3):
+            self.app.renderFrame(self.buffer)
+            assert self.app.redraws == 2
+
+class Test_ControlTree:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.box = gui.BorderedControl(width=300, height=300, pos=(50, 60))
+        self.app.add(self.box)
+        self.inner = gui.Label(text="inner", pos=(5, 7))
+        self.box.add(self.inner)
+
+    def test_on_top_children_stay_last(self):
+        top = gui.Label(text="top")
+        top.onTop = True
+        self.box.add(top)
+        later = gui.Label(text="later")
+        self.box.add(later)
+        assert self.box.children == [self.inner, later, top]
+        top.onTop = False
+        later.onTop = True
+        assert self.box.children == [self.inner, top, later]
+
+    def test_absolute_position_follows_ancestors(self):
+        assert (self.inner.absx, self.inner.absy) == (55, 67)
+        self.box.x = 100
+        self.app.y = 10
+        assert (self.inner.absx, self.inner.absy) == (105, 77)
+        self.inner.xOffset = 2
+        assert self.inner.absx == 107
+
+    def test_absolute_position_follows_reparenting(self):
+        assert self.inner.absx == 55
+        self.box.remove(self.inner)
+        self.app.add(self.inner)
+        assert (self.inner.absx, self.inner.absy) == (5, 7)
+
+class Test_HitTesting:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.a = gui.BorderedControl(width=20, height=20, pos=(10, 10))
+        self.b = gui.BorderedControl(width=20, height=20, pos=(25, 25))
+        self.app.add(self.a)
+        self.app.add(self.b)
+
+    def at(self, x, y):
+        return self.app.controlsAt(pygame.event.Event(pygame.MOUSEMOTION, pos=(x, y)))
+
+    def test_hits_in_drawing_order(self):
+        assert self.at(27, 27) == [self.a, self.b]
+        assert self.at(5, 5) == []
+
+    def test_index_follows_layout_changes(self):
+        assert self.at(100, 100) == []
+        self.b.x, self.b.y = 90, 90
+        assert self.at(100, 100) == [self.b]
+        self.a.width = 200
+        assert self.at(150, 15) == [self.a]
+
+    def test_hidden_and_removed_children_are_skipped(self):
+        self.a.show = False
+        assert self.at(27, 27) == [self.b]
+        self.app.remove(self.b)
+        assert self.at(27, 27) == []
+
+class Test_TextLayout:
+
+    def setup_method(self, method):
+        self.layout = gui.TextLayout(maxLayouts=2)
+        self.font = pygame.font.Font(None, 24)
+
+    def test_lines_fit_the_width(self):
+        text = "the quick brown fox jumps over the lazy dog " * 5
+        lines = self.layout.wrap(self.font, 150, text)
+        assert len(lines) > 1
+        assert " ".join(lines) == text.strip()
+        for line in lines:
+            assert self.font.size(line)[0] <= 150 or " " not in line
+
+    def test_newlines_break_lines(self):
+        assert self.layout.wrap(self.font, 1000, "one\ntwo three") == ("one", "two three")
+
+    def test_long_words_get_their_own_line(self):
+        assert self.layout.wrap(self.font, 10, "a supercalifragilistic b") == ("a", "supercalifragilistic", "b")
+
+    def test_spans_are_offsets_in_the_text(self):
+        text = "one  two\n\nthree four \n five"
+        lines = self.layout.wrap(self.font, 1000, text)
+        assert lines == ("one", "two", "three four", "five")
+        assert [text[a:b] for a, b in self.layout.spans(self.font, 1000, text)] == list(lines)
+
+    def test_layouts_are_cached_and_bounded(self):
+        first = self.layout.wrap(self.font, 100, "some text")
+        assert self.layout.wrap(self.font, 100, "some text") is first
+        self.layout.wrap(self.font, 100, "other text")
+        self.layout.wrap(self.font, 100, "more text")
+        assert len(self.layout.layouts) == 2
+        assert (self.font, 100, "some text") not in self.layout.layouts
+
+class RecordingFont(object):
+    "A font that remembers what it rendered"
+
+    def __init__(self):
+        self.font = pygame.font.Font(None, 24)
+        self.rendered = []
+
+    def size(self, text): return self.font.size(text)
+    def get_linesize(self): return self.font.get_linesize()
+    def render(self, text, *args):
+        self.rendered.append(text)
+        return self.font.render(text, *args)
+
+class Test_ChattingMultilineLabel:
+
+    def test_reveals_the_text_as_laid_out(self):
+        text = "one  two\n\nthree four \nfive six seven eight nine"
+        font = RecordingFont()
+        chatting = gui.ChattingMultilineLabel(text=text, width=120, height=200, font=font)
+        lines = chatting.splitText(text)
+        assert len(lines) > 4
+        strip = lambda t: t.replace(" ", "").replace("\n", "")
+        while chatting.chatting:
+            chatting.renderText()
+            # what's drawn is what's revealed so far, no more, no less
+            assert strip("".join(font.rendered)) == strip(chatting.text)
+        assert "".join(font.rendered) == "".join(lines)
+
+class Test_Damage:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.label = gui.Label(text="Label", pos=(10, 10))
+        self.box = gui.BorderedControl(width=100, height=100, pos=(200, 200))
+        self.button = gui.Button(text="Button", pos=(5, 5))
+        self.app.add(self.label)
+        self.app.add(self.box)
+        self.box.add(self.button)
+        self.buffer = pygame.Surface((640, 480)).convert_alpha()
+        self.app.renderFrame(self.buffer)
+
+    def test_first_frame_damages_everything(self):
+        app = gui.Application(width=640, height=480)
+        app.renderFrame(self.buffer)
+        assert pygame.Rect(0, 0, 640, 480) in app.damage
+
+    def test_idle_frame_damages_nothing(self):
+        self.app.renderFrame(self.buffer)
+        assert self.app.damage == []
+
+    def test_changed_control_damages_its_rect(self):
+        self.button.text = "Changed"
+        self.app.renderFrame(self.buffer)
+        assert self.app.damage == [pygame.Rect(205, 205, self.button.width, self.button.height)]
+
+    def test_moved_control_damages_old_and_new_rect(self):
+        w, h = self.label.width, self.label.height
+        self.label.x = 50
+        self.app.renderFrame(self.buffer)
+        assert sorted(self.app.damage) == sorted([pygame.Rect(10, 10, w, h), pygame.Rect(50, 10, w, h)])
+
+    def test_hidden_control_damages_where_it_was(self):
+        self.box.show = False
+        self.app.renderFrame(self.buffer)
+        assert self.app.damage == [pygame.Rect(200, 200, 100, 100)]
+
+    def test_wait_for_events_times_out_and_returns_pending_events(self):
+        pygame.event.clear()
+        assert gui.waitForEvents(10) == []
+        pygame.event.post(pygame.event.Event(pygame.USEREVENT, code=1))
+        assert [e.type for e in gui.waitForEvents(1000)] == [pygame.USEREVENT]
+
+class Test_ListBox:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.made = []
+        def makeRow(entry):
+            self.made.append(entry)
+            return gui.Label(text="entry %d" % entry)
+        self.list = gui.ListBox(width=200, height=100, pos=(10, 10), rowFactory=makeRow)
+        self.app.add(self.list)
+
+    def shown(self):
+        return sorted(row.children[0].text for row in self.list.children)
+
+    def test_only_entries_in_view_get_rows(self):
+        self.list.extend(range(10000))
+        assert len(self.list.items) == 10000
+        assert 0 < len(self.list.children) < 10
+        assert len(self.made) < 12
+        assert "entry 0" in self.shown()
+
+    def test_scrolling_recycles_rows(self):
+        self.list.extend(range(10000))
+        rows = set(self.list.children)
+        self.list.scrollTo(self.list.rowTops[5000])
+        assert "entry 5000" in self.shown() and "entry 0" not in self.shown()
+        assert len(set(self.list.children) - rows) <= 1
+
+    def test_scrolled_rows_are_hit_and_positioned_on_screen(self):
+        self.list.extend(range(100))
+        self.list.scrollTo(self.list.rowTops[50])
+        row = self.list.rows[50]
+        assert row.absy == self.list.absy + self.list.borderWidth
+        hit = self.list.controlsAt(pygame.event.Event(pygame.MOUSEMOTION, pos=(row.absx + 1, row.absy + 1)))
+        assert hit == [row]
+
+    def test_scrolling_stops_at_the_ends(self):
+        self.list.extend(range(20))
+        self.list.scrollUp()
+        assert self.list.scrollY == 0
+        self.list.scrollTo(10**6)
+        assert "entry 19" in self.shown()
+        assert self.list.scrollY == self.list.contentBottom + self.list.borderWidth - self.list.height
+
+    def test_added_controls_and_clearing(self):
+        plain = gui.ListBox(width=200, height=100)
+        labels = [gui.Label(text=str(i)) for i in range(3)]
+        for label in labels: plain.add(label)
+        assert [row.children[0] for row in plain.children] == labels
+        assert plain.rowTops == sorted(plain.rowTops)
+        plain.removeAllChildren()
+        assert plain.items == [] and plain.children == []
+
+    def test_scrolled_back_entries_keep_their_control(self):
+        self.list.extend(range(100))
+        first = self.list.rows[0].children[0]
+        self.list.scrollTo(self.list.rowTops[50])
+        made = len(self.made)
+        self.list.scrollTo(0)
+        assert self.list.rows[0].children[0] is first
+        assert len(self.made) == made
+
+    def test_removing_keeps_the_other_controls(self):
+        self.list.extend(range(5))
+        third = self.list.rows[3].children[0]
+        self.list.remove(1)
+        assert self.list.rows[2].children[0] is third
+        assert self.shown() == ["entry 0", "entry 2", "entry 3", "entry 4"]
+
+    def test_unsorted_adds_show_when_in_view(self):
+        self.list.add(0, sortControl=False)
+        assert self.shown() == ["entry 0"]
+        for i in range(1, 100): self.list.add(i, sortControl=False)
+        assert "entry 99" not in self.shown() and len(self.list.children) < 10
+        self.list.scrollTo(10**6)
+        assert "entry 99" in self.shown()
+
+class Test_ScrollBox:
+
+    def setup_method(self, method):
+        self.app = gui.Application(width=640, height=480)
+        self.box = gui.ScrollBox(width=100, height=100, pos=(10, 10), scroll_dy=50)
+        self.app.add(self.box)
+        self.children = [gui.BorderedControl(width=80, height=40, pos=(5, i * 50)) for i in range(10)]
+        for c in self.children: self.box.add(c)
+
+    def test_only_children_in_view_are_drawn(self):
+        assert self.box.childrenInView() == self.children[:3]
+        self.box.scrollDown()
+        assert self.box.childrenInView() == self.children[1:4]
+
+    def test_scrolling_moves_children_without_touching_them(self):
+        self.box.scrollDown()
+        assert self.children[2].yOffset == 0
+        assert self.children[2].absy == 10 + 100 - 50
+        hit = self.box.controlsAt(pygame.event.Event(pygame.MOUSEMOTION, pos=(20, 10 + 5)))
+        assert hit == [self.children[1]]
+
+    def test_scrolling_stops_at_the_ends(self):
+        for i in range(20): self.box.scrollDown()
+        assert self.box.scrollY == 490 - 100
+        for i in range(20): self.box.scrollUp()
+        assert self.box.scrollY == 0
+
+class Test_ProgressDialog:
+
+    def test_progress_follows_work_units(self):
+        dialog = gui.ProgressDialog("Loading...", work=4)
+        dialog.start()
+        dialog.updateProgress(1)
+        assert dialog.progressBar.value == 25
+        dialog.addWork(4)
+        assert dialog.progressBar.value == 12.5
+        dialog.updateProgress(10)
+        assert dialog.progressBar.value == 100
+        dialog.end()
+
+    def test_drawn_from_the_calling_thread(self):
+        screen = pygame.display.get_surface()
+        screen.fill((1, 2, 3))
+        dialog = gui.ProgressDialog("Loading...", work=2)
+        dialog.start()
+        assert screen.get_at((dialog.x + dialog.width/2, dialog.y + 2))[:3] != (1, 2, 3)
+        assert screen.get_at((0, 0))[:3] == (1, 2, 3)
+        dialog.end()
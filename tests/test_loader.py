@@ -0,0 +1,71 @@
+#
+# Tests for the parallel image loader
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.display.set_mode((64, 64))
+
+import configuration
+import loader
+import shutil
+import tempfile
+import vfs
+from zipfile import ZipFile, ZIP_STORED
+
+class Progress(object):
+    def __init__(self): self.work, self.done = 0, 0
+    def addWork(self, units): self.work += units
+    def updateProgress(self, step): self.done += step
+
+class Test_Loader:
+
+    def setup_class(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.zip = os.path.join(cls.tmp, 'images.zip')
+        z = ZipFile(cls.zip, 'w')
+        for i in xrange(12):
+            surface = pygame.Surface((8 + i, 8), pygame.SRCALPHA)
+            surface.fill((i * 20, 0, 255 - i * 20, 128))
+            filename = os.path.join(cls.tmp, '%d.png' % i)
+            pygame.image.save(surface, filename)
+            z.write(filename, 'set/image%d.png' % i, ZIP_STORED)
+        z.close()
+        cls.oldThreads = configuration.loader_threads
+
+    def teardown_class(cls):
+        configuration.loader_threads = cls.oldThreads
+        vfs.unmountAll()
+        shutil.rmtree(cls.tmp)
+
+    def load(self, threads):
+        configuration.loader_threads = threads
+        archive = vfs.mount(self.zip)
+        return loader.loadImages(archive, archive.sets['set'])
+
+    def test_parallel_matches_serial(self):
+        serial, parallel = self.load(1), self.load(4)
+        assert sorted(serial) == sorted(parallel) and len(serial) == 12
+        for name in serial:
+            assert serial[name].get_size() == parallel[name].get_size()
+            assert pygame.image.tostring(serial[name], 'RGBA') == pygame.image.tostring(parallel[name], 'RGBA')
+
+    def test_progress(self):
+        loader.progressListener = progress = Progress()
+        try: self.load(3)
+        finally: loader.progressListener = None
+        assert progress.work == progress.done == 12
+
+    def test_errors_reach_the_caller(self):
+        configuration.loader_threads = 3
+        archive = vfs.mount(self.zip)
+        try:
+            loader.loadImages(archive, ['set/image0.png', 'set/missing.png'])
+            assert False
+        except KeyError: pass
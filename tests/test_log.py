@@ -0,0 +1,101 @@
+#
+# Tests for the leveled log
+#
+
+import sys
+sys.path.append('../components')
+
+import StringIO
+import log
+import os
+import tempfile
+
+class Unformattable(object):
+    "Fails the test if anything formats it"
+    def __str__(self): raise AssertionError("formatted a message that was never read")
+
+class Test_Log:
+
+    def setup_method(self, method):
+        self.level = log.getLevel()
+        log.setLevel(log.DEBUG)
+        log.setCallerInfo(False)
+        log.clear()
+        self.logger = log.getLogger("test")
+
+    def teardown_method(self, method):
+        log.stop()
+        log.setLevel(self.level)
+        log.setCallerInfo(False)
+        log.clear()
+
+    def test_same_logger(self):
+        assert log.getLogger("test") is self.logger
+
+    def test_levels(self):
+        log.setLevel('warning')
+        self.logger.debug("debug")
+        self.logger.info("info")
+        self.logger.warning("warning")
+        self.logger.error("error")
+        assert [line.split(': ', 1)[1] for line in log.recent()] == ["warning", "error"]
+        assert not self.logger.isEnabledFor(log.INFO)
+
+    def test_disabled_messages_are_not_kept(self):
+        log.setLevel(log.INFO)
+        self.logger.debug("%s", Unformattable())
+        assert log.recent() == []
+
+    def test_formatted_lazily(self):
+        self.logger.debug("%s", Unformattable())
+        record = log._history[-1]
+        assert record._text is None
+
+    def test_bad_arguments(self):
+        self.logger.info("%d", "not a number")
+        assert "could not format" in log.recent()[0]
+
+    def test_recent(self):
+        for i in xrange(5): self.logger.debug("message %d", i)
+        self.logger.warning("warning")
+        assert [line.split(': ', 1)[1] for line in log.recent(2)] == ["message 4", "warning"]
+        assert len(log.recent(level=log.WARNING)) == 1
+
+    def test_history_is_bounded(self):
+        for i in xrange(log._history.maxlen + 10): self.logger.debug("message %d", i)
+        assert len(log._history) == log._history.maxlen
+        assert log.recent()[-1].endswith("message %d" % (log._history.maxlen + 9))
+
+    def test_caller(self):
+        log.setCallerInfo(True)
+        self.logger.info("here")
+        assert "test_log.py" in log.recent()[0] and "test_caller()" in log.recent()[0]
+
+    def test_writer(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        stream = StringIO.StringIO()
+        try:
+            log.start(filename, stream, log.WARNING)
+            for i in xrange(100): self.logger.debug("line %d", i)
+            self.logger.warning("warning")
+            log.stop()
+
+            lines = open(filename).read().splitlines()
+            assert len(lines) == 101 and lines[0].endswith("test: line 0")
+            assert stream.getvalue().splitlines() == lines[-1:]
+        finally: os.remove(filename)
+
+    def test_written_as_logged(self):
+        stream = StringIO.StringIO()
+        log.start("", stream, log.DEBUG)
+        party = ["Bob"]
+        self.logger.info("party: %s", party)
+        party.append("Alice")
+        log.stop()
+        assert stream.getvalue().rstrip().endswith("party: ['Bob']")
+
+    def test_unknown_level(self):
+        try: log.levelNamed("loud")
+        except ValueError: pass
+        else: assert False
@@ -0,0 +1,129 @@
+#
+# Tests for the binary map format and the conversion of old xml maps
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import shutil
+import tempfile
+import zipfile
+from cStringIO import StringIO
+import mapformat
+from mapformat import MapWriter, MapReader, MapFormatError
+
+SceneXml = """<?xml version="1.0" ?>
+<scene><tilefactory tileset="default" tileheight="32" tilewidth="32"/><tilestacks height="2" width="2">
+<tilestack trigger="None" walkable="True"><base><tile index="74"/></base><roof><tile index="0" name="tree1"/></roof></tilestack>
+<tilestack trigger="loadHutInside" walkable="True"><base><tile index="74"/><tile index="26" name="hut"/></base><roof/></tilestack>
+<tilestack trigger="None" walkable="False"><base><tile index="3"/></base><roof><tile index="2" name="tree1"/><tile index="0" name="tree1"/></roof></tilestack>
+<tilestack trigger="None" walkable="True"><base/><roof/></tilestack>
+</tilestacks></scene>"""
+
+XmlCells = [([(74, None)], [(0, "tree1")], True, None),
+            ([(74, None), (26, "hut")], [], True, "loadHutInside"),
+            ([(3, None)], [(2, "tree1"), (0, "tree1")], False, None),
+            ([], [], True, None)]
+
+def makeCells(width, height):
+    "A map exercising irregular tiles, roofs, triggers and walkability"
+    ret = []
+    for i in xrange(width * height):
+        base = [(i % 50, None)] + ([(i % 4, "hut")] if i % 5 == 0 else [])
+        roof = [(i % 3, "tree%d" % (i % 2))] if i % 7 == 0 else []
+        ret.append((base, roof, i % 3 != 0, "trigger%d" % (i % 4) if i % 11 == 0 else None))
+    return ret
+
+def writeMap(cells, width, height):
+    f = StringIO()
+    writer = MapWriter(f, "default", 32, 24, width, height)
+    for cell in cells: writer.writeCell(*cell)
+    writer.close()
+    return f.getvalue()
+
+class Test_MapFormat:
+
+    def test_round_trip(self):
+        # tall enough for several bands, so every band has its own strings
+        cells = makeCells(13, 40)
+        reader = MapReader(StringIO(writeMap(cells, 13, 40)))
+        assert (reader.tileset, reader.tileWidth, reader.tileHeight) == ("default", 32, 24)
+        assert (reader.widthInTiles, reader.heightInTiles, len(reader)) == (13, 40, 520)
+        assert list(reader.cells()) == cells
+
+    def test_bands(self):
+        reader = MapReader(StringIO(writeMap(makeCells(10, 40), 10, 40)))
+        assert [len(band[0]) for band in reader.bands()] == [160, 160, 80]
+
+    def test_wrong_cell_count(self):
+        writer = MapWriter(StringIO(), "default", 32, 32, 2, 2)
+        writer.writeCell([], [], True, None)
+        try: writer.close()
+        except MapFormatError: pass
+        else: assert False
+
+    def test_convert_xml(self):
+        f = StringIO()
+        writer = mapformat.convertXmlMap(StringIO(SceneXml), f)
+        assert writer.cellsWritten == 4
+        f.seek(0)
+        reader = MapReader(f)
+        assert (reader.tileset, reader.tileWidth, reader.widthInTiles) == ("default", 32, 2)
+        assert list(reader.cells()) == XmlCells
+
+    def test_convert_default_map(self):
+        reader = mapformat.openMap("../data/maps/default.map")
+        assert (reader.widthInTiles, reader.heightInTiles) == (100, 100)
+        cells = list(reader.cells())
+        assert len(cells) == 10000
+        assert cells[0] == ([(74, None)], [(0, "tree1")], True, None)
+        assert "loadHutInside" in [cell[3] for cell in cells]
+
+    def expectError(self, data):
+        try: list(MapReader(StringIO(data)).cells())
+        except MapFormatError: pass
+        else: assert False, "read a broken map"
+
+    def test_truncated(self):
+        data = writeMap(makeCells(10, 20), 10, 20)
+        for end in (3, 10, 20, len(data) / 2, len(data) - 1):
+            self.expectError(data[:end])
+
+    def test_corrupt(self):
+        data = writeMap(makeCells(10, 20), 10, 20)
+        self.expectError("XXMAP" + data[5:])
+        band = data.index("BAND")
+        self.expectError(data[:band] + "BAND" + data[band+4:band+8] + "\0" * 100 + data[band+108:])
+        self.expectError(data[:band] + "ZZZZ" + data[band+4:])
+
+    def test_newer_version(self):
+        data = writeMap(makeCells(2, 2), 2, 2)
+        self.expectError(data[:5] + "\xff\x00" + data[7:])
+
+class Test_OpenMap:
+
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp)
+
+    def test_is_binary(self):
+        f = StringIO(writeMap(XmlCells, 2, 2))
+        assert mapformat.isBinaryMap(f) and f.tell() == 0
+        assert not mapformat.isBinaryMap(StringIO("PK\x03\x04"))
+
+    def test_binary(self):
+        filename = os.path.join(self.tmp, "binary.map")
+        open(filename, 'wb').write(writeMap(XmlCells, 2, 2))
+        reader = mapformat.openMap(filename)
+        assert list(reader.cells()) == XmlCells
+        reader.close()
+
+    def test_xml(self):
+        filename = os.path.join(self.tmp, "old.map")
+        z = zipfile.ZipFile(filename, 'w')
+        z.writestr("scene.xml", SceneXml)
+        z.close()
+        assert list(mapformat.openMap(filename).cells()) == XmlCells
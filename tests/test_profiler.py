@@ -0,0 +1,99 @@
+#
+# Tests for the frame profiler
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((640, 480))
+
+import csv
+import profiler
+import tempfile
+
+class Test_Profiler:
+
+    def setup_method(self, method):
+        self.enabled = profiler.enabled
+        profiler.setEnabled(True)
+        profiler.clear()
+        profiler.endFrame()
+
+    def teardown_method(self, method):
+        profiler.setEnabled(self.enabled)
+        profiler.clear()
+
+    def frame(self, scopes=(), counters=()):
+        for name in scopes:
+            with profiler.scope(name): pass
+        for name, n in counters: profiler.count(name, n)
+        profiler.endFrame()
+
+    def test_scopes_add_up(self):
+        for i in xrange(3):
+            with profiler.scope("render"): sum(xrange(1000))
+        profiler.endFrame()
+        frame = profiler.frames()[-1]
+        assert frame.scopes.keys() == ["render"] and frame.scopes["render"] > 0
+        assert frame.time >= frame.scopes["render"]
+
+    def test_counters(self):
+        self.frame(counters=[("actors drawn", 3), ("actors drawn", 2)])
+        self.frame()
+        assert [f.counters.get("actors drawn", 0) for f in profiler.frames()] == [5, 0]
+        s = profiler.counterStats("actors drawn")
+        assert (s.min, s.avg, s.max, s.last) == (0, 2.5, 5, 0)
+
+    def test_disabled(self):
+        profiler.setEnabled(False)
+        assert profiler.scope("render") is profiler._nullScope
+        self.frame(["render"], [("tiles blitted", 10)])
+        assert profiler.frames() == []
+
+    def test_history_is_bounded(self):
+        for i in xrange(profiler._frames.maxlen + 10): self.frame(["update"])
+        assert len(profiler.frames()) == profiler._frames.maxlen
+        assert len(profiler.frames(5)) == 5
+
+    def test_stats(self):
+        for t in xrange(1, 201): profiler._frames.append(profiler.Frame(float(t), {"render": t / 2.0}, {}))
+        s = profiler.stats(profiler.FrameScope)
+        assert (s.min, s.avg, s.p99, s.max, s.last) == (1, 100.5, 198, 200, 200)
+        assert profiler.stats("render").p99 == 99
+        assert profiler.stats("missing") is None
+
+    def test_scope_names(self):
+        self.frame(["render.tiles", "update", "render"], [("scripts run", 1)])
+        assert profiler.scopeNames() == ["render", "render.tiles", "update"]
+        assert profiler.counterNames() == ["scripts run"]
+
+    def test_export_csv(self):
+        self.frame(["render"], [("actors drawn", 4)])
+        self.frame(["update"])
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            assert profiler.exportCsv(filename) == filename
+            rows = list(csv.reader(open(filename)))
+        finally: os.remove(filename)
+        assert rows[0] == ["frame", "frame ms", "render ms", "update ms", "actors drawn"]
+        assert len(rows) == 3
+        assert rows[1][0] == "0" and rows[1][4] == "4"
+        assert rows[2][2] == "0.000" and rows[2][4] == "0"
+
+    def test_view(self):
+        self.frame(["render", "update"], [("actors drawn", 4)])
+        view = profiler.ProfilerView()
+        rects = view.update((630, 10))
+        assert len(rects) == 1 and rects[0].topright == (630, 10)
+        assert len(view.lines()) == 5
+        assert view.update((630, 10)) == []
+
+        screen = pygame.display.get_surface()
+        view.render(screen, (630, 10))
@@ -0,0 +1,179 @@
+#
+# Tests for the scene: its dirty rects, interpolation and actor index
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((64, 64))
+
+from scene import Scene
+from tiles import Tile, TileChunkCache
+
+class FakeTileFactory:
+
+    def __init__(self):
+        self.tileWidth = self.tileHeight = 8
+        self.tiles = []
+        for i in xrange(4):
+            s = pygame.Surface((8, 8))
+            s.fill((i * 60, 0, 0))
+            self.tiles.append(s)
+        self.irregularTiles = {}
+        self.specialTiles = {'base': 0}
+
+class FakeActor:
+
+    def __init__(self, px, py):
+        self.px, self.py = px, py
+        self.width, self.height = 8, 16
+        self.image = None
+        self.positionListener = None
+
+    def getRect(self): return (self.px, self.py, self.width, self.height)
+    def render(self, surface, x, y): pass
+    def update(self, tick): pass
+
+def makeScene():
+    "A 100x100 tile map (800x800 pixels) with a player at 100,100"
+    scene = Scene(None, tileFactory=FakeTileFactory(), widthInTiles=100, heightInTiles=100)
+    scene.tilestacks = scene._loadTilestacks()
+    scene.tileCache = TileChunkCache(scene)
+    scene.players = [FakeActor(100, 100)]
+    return scene
+
+class Test_SceneDirtyRects:
+
+    def setup_method(self, method):
+        self.scene = makeScene()
+        self.buffer = pygame.Surface(pygame.display.get_surface().get_size())
+        self.scene.render(self.buffer)
+
+    def test_first_frame_is_a_full_redraw(self):
+        assert self.scene.getDirtyRects() is None
+
+    def test_idle(self):
+        self.scene.getDirtyRects()
+        assert self.scene.getDirtyRects() == []
+        assert self.scene.getDirtyRects() == []
+
+    def test_actor_moved(self):
+        self.scene.getDirtyRects()
+        self.scene.player.px += 3
+        rects = self.scene.getDirtyRects()
+        assert sorted(tuple(r) for r in rects) == [(100, 84, 8, 16), (103, 84, 8, 16)]
+        assert self.scene.getDirtyRects() == []
+
+    def test_actor_removed(self):
+        npc = FakeActor(40, 40)
+        self.scene.actors.append(npc)
+        self.scene.getDirtyRects()
+        self.scene.actors.remove(npc)
+        assert [tuple(r) for r in self.scene.getDirtyRects()] == [(40, 24, 8, 16)]
+
+    def test_tile_changed(self):
+        self.scene.getDirtyRects()
+        self.scene.tilestacks[0].addBaseTile(Tile(self.scene.tileFactory, 2))
+        assert [tuple(r) for r in self.scene.getDirtyRects()] == [(0, 0, 128, 128)]
+
+    def test_scrolled(self):
+        self.scene.getDirtyRects()
+        self.scene.viewport.x += 8
+        assert self.scene.getDirtyRects() is None
+        assert self.scene.getDirtyRects() == []
+
+class Test_Interpolation:
+
+    def setup_method(self, method):
+        self.scene = makeScene()
+        self.actor = self.scene.player
+        self.scene.viewport.x = self.scene.viewport.y = 40
+
+    def step(self, dx, dy):
+        "One simulation step moving the player and the viewport"
+        self.scene.savePositions()
+        self.actor.px += dx
+        self.actor.py += dy
+        self.scene.viewport.x += dx
+        self.scene.viewport.y += dy
+
+    def test_before_the_first_step(self):
+        self.scene.setInterpolation(0.5)
+        assert self.scene._drawnPosition(self.actor) == (100, 100)
+        assert self.scene._drawnViewport() == (40, 40)
+
+    def test_between_steps(self):
+        self.step(4, -2)
+        for alpha, position, viewport in ((0.0, (100, 100), (40, 40)), (0.5, (102, 99), (42, 39)), (1.0, (104, 98), (44, 38))):
+            self.scene.setInterpolation(alpha)
+            assert self.scene._drawnPosition(self.actor) == position
+            assert self.scene._drawnViewport() == viewport
+
+    def test_jumps_are_not_smoothed(self):
+        self.step(50, 0)
+        self.scene.setInterpolation(0.5)
+        assert self.scene._drawnPosition(self.actor) == (150, 100)
+        assert self.scene._drawnViewport() == (90, 40)
+
+    def test_new_actor(self):
+        self.step(2, 0)
+        npc = FakeActor(40, 40)
+        self.scene.actors.append(npc)
+        self.scene.setInterpolation(0.5)
+        assert self.scene._drawnPosition(npc) == (40, 40)
+
+class Test_ActorIndex:
+
+    def setup_method(self, method):
+        self.scene = makeScene()
+        self.a, self.b, self.c = FakeActor(0, 0), FakeActor(100, 0), FakeActor(200, 0)
+        for npc in (self.a, self.b): self.scene.addActorToScene(npc)
+
+    def check(self):
+        "The index holds exactly the scene's actors, each at its own position"
+        assert len(self.scene.actorIndex) == len(self.scene.actors)
+        for npc in (self.a, self.b, self.c):
+            found = self.scene.npcAt((npc.px + 1, npc.py + 1))
+            if npc in self.scene.actors: assert found is npc and npc.positionListener
+            else: assert found is None and npc.positionListener is None
+
+    def test_add_remove(self):
+        self.check()
+        self.scene.removeActorFromScene(self.a)
+        self.check()
+
+    def test_replace(self):
+        self.scene.actors[0] = self.c
+        self.check()
+        assert self.scene.actorsInRect((0, 0, 300, 10)) == [self.c, self.b]
+
+    def test_assign_same_length(self):
+        self.scene.actors = [self.b, self.c]
+        self.check()
+        self.scene.actors = []
+        self.check()
+
+    def test_list_changes(self):
+        self.scene.actors.append(self.c)
+        self.scene.actors.pop(0)
+        self.check()
+        del self.scene.actors[:]
+        self.check()
+        self.scene.actors += [self.a, self.c]
+        self.scene.actors.insert(1, self.b)
+        self.check()
+        assert self.scene.actorsInRect((0, 0, 300, 10)) == [self.a, self.b, self.c]
+        self.scene.actors[1:] = [self.c]
+        self.check()
+
+    def test_moved_after_replace(self):
+        self.scene.actors[1] = self.c
+        self.c.px = 300
+        self.c.positionListener(self.c)
+        assert self.scene.npcAt((301, 1)) is self.c and self.scene.npcAt((201, 1)) is None
@@ -0,0 +1,86 @@
+#
+# Tests for reading scenes off the main thread
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+pygame.display.init()
+pygame.font.init()
+pygame.display.set_mode((64, 64))
+
+import mapformat
+import shutil
+import tempfile
+import time
+from cStringIO import StringIO
+from scene import Scene, SceneLoader, SceneLoadCancelled
+
+def writeMap(width, height):
+    f = StringIO()
+    writer = mapformat.MapWriter(f, "default", 32, 32, width, height)
+    for i in xrange(width * height): writer.writeCell([(i % 7, None)], [], i % 3 != 0, None)
+    writer.close()
+    f.seek(0)
+    return f
+
+def pollUntilDone(loader):
+    for i in xrange(500):
+        if loader.poll(): return
+        time.sleep(0.01)
+    assert False, "the load never finished"
+
+class Test_ReadTilestacks:
+
+    def test_progress(self):
+        reported = []
+        tilestacks = Scene.readTilestacks(mapformat.MapReader(writeMap(40, 40)), None, reported.append)
+        assert len(tilestacks) == 1600
+        assert 30 <= len(reported) <= 41
+        assert reported == sorted(reported) and reported[-1] <= 1600
+
+    def test_cancelled(self):
+        calls = []
+        def checkCancelled():
+            calls.append(1)
+            if len(calls) == 3: raise SceneLoadCancelled
+        try:
+            Scene.readTilestacks(mapformat.MapReader(writeMap(40, 40)), None, None, checkCancelled)
+            assert False
+        except SceneLoadCancelled: pass
+
+class Test_SceneLoader:
+
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+        self.results = []
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp)
+
+    def loader(self, data):
+        filename = os.path.join(self.tmp, 'scene.map')
+        f = open(filename, 'wb')
+        f.write(data)
+        f.close()
+        return SceneLoader(filename, None, lambda scene: self.results.append(('loaded', scene)),
+                           lambda message: self.results.append(('failed', message)))
+
+    def test_unreadable_map_fails(self):
+        loader = self.loader("not a map at all")
+        loader.start()
+        pollUntilDone(loader)
+        assert len(self.results) == 1 and self.results[0][0] == 'failed'
+
+    def test_cancelled_before_the_tileset(self):
+        loader = self.loader(writeMap(40, 40).getvalue())
+        loader.start()
+        loader.cancel()
+        pollUntilDone(loader)
+        assert self.results == [] and loader.tileFactory is None
+        loader.thread.join(5)
+        assert not loader.thread.isAlive()
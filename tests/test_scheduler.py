@@ -0,0 +1,73 @@
+#
+# Tests for the scene's timer scheduler
+#
+
+import sys
+sys.path.append('../components')
+
+from scheduler import Scheduler
+
+class Test_Scheduler:
+
+    def setup_method(self, method):
+        self.scheduler = Scheduler()
+        self.ran = []
+
+    def job(self, name):
+        return lambda: self.ran.append(name)
+
+    def test_one_shot(self):
+        timer = self.scheduler.schedule(self.job('a'), 100)
+        assert self.scheduler.advance(99) == 0
+        assert self.scheduler.advance(1) == 1
+        self.scheduler.advance(1000)
+        assert self.ran == ['a']
+        assert not timer.active and len(self.scheduler) == 0
+
+    def test_periodic_restarts_from_when_it_ran(self):
+        self.scheduler.schedule(self.job('a'), 100, 100)
+        for i in xrange(10): self.scheduler.advance(30)
+        # due at 100 (ran at 120), then 220 (ran at 240)
+        assert self.ran == ['a', 'a']
+        assert len(self.scheduler) == 1
+
+    def test_due_order(self):
+        self.scheduler.schedule(self.job('late'), 50)
+        self.scheduler.schedule(self.job('early'), 10)
+        self.scheduler.schedule(self.job('early too'), 10)
+        self.scheduler.advance(60)
+        assert self.ran == ['early', 'early too', 'late']
+
+    def test_cancel(self):
+        a = self.scheduler.schedule(self.job('a'), 10, 10)
+        self.scheduler.schedule(self.job('b'), 10, 10)
+        a.cancel()
+        a.cancel()
+        self.scheduler.advance(10)
+        assert self.ran == ['b'] and len(self.scheduler) == 1
+
+    def test_cancel_from_callback(self):
+        timers = []
+        def stop():
+            self.ran.append('stop')
+            timers[0].cancel()
+        timers.append(self.scheduler.schedule(stop, 10, 10))
+        self.scheduler.advance(10)
+        self.scheduler.advance(10)
+        assert self.ran == ['stop'] and len(self.scheduler) == 0
+
+    def test_compaction(self):
+        timers = [self.scheduler.schedule(self.job(i), 10 + i) for i in xrange(1000)]
+        for timer in timers[:900]: timer.cancel()
+        assert len(self.scheduler._heap) < 1000
+        assert self.scheduler.nextDue() == 910
+        self.scheduler.advance(2000)
+        assert self.ran == range(900, 1000)
+
+    def test_budget(self):
+        self.scheduler.maxRunsPerTick = 3
+        for i in xrange(5): self.scheduler.schedule(self.job(i), 10)
+        assert self.scheduler.advance(10) == 3
+        assert self.scheduler.advance(10) == 2
+        assert self.ran == range(5)
+        assert self.scheduler.deferredTicks == 1
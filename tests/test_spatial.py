@@ -0,0 +1,48 @@
+#
+# Tests for the spatial hash used to look up actors by position
+#
+
+import sys
+sys.path.append('../components')
+
+from spatial import SpatialHash
+
+class Test_SpatialHash:
+
+    def setup_method(self, method):
+        self.hash = SpatialHash(32)
+        self.hash.insert('a', (0, 0, 10, 10))
+        self.hash.insert('b', (5, 5, 40, 40))
+        self.hash.insert('c', (100, 100, 10, 10))
+
+    def test_point_includes_edges(self):
+        assert self.hash.queryPoint(10, 10) == ['a', 'b']
+        assert self.hash.queryPoint(45, 45) == ['b']
+        assert self.hash.queryPoint(46, 45) == []
+
+    def test_insertion_order_kept(self):
+        self.hash.insert('z', (0, 0, 64, 64))
+        assert self.hash.queryPoint(6, 6) == ['a', 'b', 'z']
+
+    def test_update_moves_between_cells(self):
+        self.hash.update('a', (200, 200, 10, 10))
+        assert self.hash.queryPoint(2, 2) == []
+        assert self.hash.queryPoint(205, 205) == ['a']
+        assert self.hash.rectOf('a') == (200, 200, 10, 10)
+
+    def test_remove(self):
+        self.hash.remove('b')
+        assert 'b' not in self.hash
+        assert self.hash.queryRect((0, 0, 200, 200)) == ['a', 'c']
+        assert len(self.hash) == 2
+
+    def test_rect_and_radius(self):
+        assert self.hash.queryRect((30, 30, 80, 80)) == ['b', 'c']
+        assert self.hash.queryRadius(50, 50, 6) == []
+        assert self.hash.queryRadius(50, 50, 8) == ['b']
+        assert self.hash.queryRadius(112, 112, 30) == ['c']
+        assert self.hash.queryRadius(60, 60, 100) == ['b', 'c', 'a']
+
+    def test_negative_coordinates(self):
+        self.hash.insert('n', (-50, -50, 10, 10))
+        assert self.hash.queryPoint(-45, -45) == ['n']
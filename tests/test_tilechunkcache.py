@@ -0,0 +1,122 @@
+#
+# Tests for the pre-rendered map chunks
+#
+
+import sys
+sys.path.append('../components')
+
+import pygame
+from tiles import TileChunkCache, TileGrid, Tilestack, Tile
+
+class FakeTileFactory:
+
+    def __init__(self):
+        self.tileWidth = self.tileHeight = 4
+        self.tiles = []
+        for i in xrange(4):
+            s = pygame.Surface((4, 4))
+            s.fill((i * 60, 0, 0))
+            self.tiles.append(s)
+        self.irregularTiles = {}
+
+class FakeScene:
+    "A map of widthInTiles x heightInTiles tiles of 4x4 pixels"
+
+    def __init__(self, widthInTiles, heightInTiles, grid=True):
+        self.tileFactory = FakeTileFactory()
+        self.widthInTiles, self.heightInTiles = widthInTiles, heightInTiles
+        self.widthInPixels, self.heightInPixels = widthInTiles * 4, heightInTiles * 4
+        self.borderUnwalkable = self.borderTrigger = False
+        if grid: self.tilestacks = TileGrid(self.tileFactory, widthInTiles, heightInTiles, 0)
+        else:
+            self.tilestacks = []
+            for i in xrange(widthInTiles * heightInTiles):
+                ts = Tilestack()
+                ts.addBaseTile(Tile(self.tileFactory, 0))
+                self.tilestacks.append(ts)
+
+class Test_TileChunkCache:
+
+    def cache(self, width=10, height=10, grid=True, **kwargs):
+        self.scene = FakeScene(width, height, grid)
+        return TileChunkCache(self.scene, chunkSize=kwargs.get('chunkSize', 4), limit=kwargs.get('limit', 48))
+
+    def test_chunk_grid(self):
+        cache = self.cache()
+        assert (cache.widthInChunks, cache.heightInChunks) == (3, 3)
+        assert [(c.width, c.height) for c in cache.chunks[-3:]] == [(4, 2), (4, 2), (2, 2)]
+        assert cache.chunkAt(9, 9) is cache.chunks[-1]
+
+    def check_invalidation(self, grid):
+        cache = self.cache(grid=grid)
+        surface = pygame.Surface((40, 40))
+        cache.renderBase(surface, 0, 0)
+        assert not [c for c in cache.chunks if c.dirty]
+        assert surface.get_at((21, 21)) == (0, 0, 0, 255)
+
+        # tile 5,5 is in the middle chunk
+        self.scene.tilestacks[5 * 10 + 5].addBaseTile(Tile(self.scene.tileFactory, 3))
+        assert [c for c in cache.chunks if c.dirty] == [cache.chunkAt(5, 5)]
+        assert cache.takeDamage() == [(16, 16, 16, 16)]
+        assert cache.takeDamage() == []
+
+        cache.renderBase(surface, 0, 0)
+        assert surface.get_at((21, 21)) == (180, 0, 0, 255)
+        assert not cache.chunkAt(5, 5).dirty
+
+    def test_invalidation_grid(self): self.check_invalidation(True)
+
+    def test_invalidation_tilestacks(self): self.check_invalidation(False)
+
+    def test_offscreen_changes_are_not_damage(self):
+        cache = self.cache()
+        self.scene.tilestacks[0].isWalkable = False
+        assert cache.chunkAt(0, 0).dirty
+        assert cache.takeDamage() == []
+
+    def test_lru_eviction(self):
+        cache = self.cache(40, 4, chunkSize=4, limit=3)
+        surface = pygame.Surface((16, 16))
+        # one chunk on screen at a time, left to right
+        for cx in xrange(6):
+            cache.renderBase(surface, cx * 16, 0)
+            assert len(cache.built) <= 3
+        built = [cache.chunks.index(c) for c in cache.chunks if c.base]
+        assert built == [3, 4, 5]
+        assert cache.chunks[0].dirty and cache.chunks[0].base is None
+
+        # coming back to an evicted chunk builds it again
+        cache.renderBase(surface, 0, 0)
+        assert cache.chunks[0].base is not None
+        assert sorted(cache.chunks.index(c) for c in cache.built) == [0, 4, 5]
+
+    def test_visible_chunks_never_evicted(self):
+        cache = self.cache(40, 4, chunkSize=4, limit=1)
+        cache.renderBase(pygame.Surface((48, 16)), 0, 0)
+        assert len([c for c in cache.chunks if c.base]) == 3
+
+    def visible(self, cache, vx, vy, width, height):
+        return [(cache.chunks.index(c), x, y) for c, x, y in cache.visibleChunks(vx, vy, width, height)]
+
+    def test_visible_chunks(self):
+        cache = self.cache()
+        assert self.visible(cache, 0, 0, 16, 16) == [(0, 0, 0)]
+        assert self.visible(cache, 8, 0, 16, 8) == [(0, -8, 0), (1, 8, 0)]
+
+    def test_visible_chunks_at_the_edges(self):
+        cache = self.cache()
+        # before the start of the map
+        assert self.visible(cache, -10, -10, 16, 16) == [(0, 10, 10)]
+        # the last, partial chunks
+        assert self.visible(cache, 32, 32, 16, 16) == [(8, 0, 0)]
+        assert self.visible(cache, 30, 30, 16, 16) == [(4, -14, -14), (5, 2, -14), (7, -14, 2), (8, 2, 2)]
+        # past the end of the map
+        assert self.visible(cache, 32, 32, 100, 100) == [(8, 0, 0)]
+        assert self.visible(cache, 40, 0, 16, 16) == []
+
+    def test_edges_are_cleared(self):
+        cache = self.cache()
+        surface = pygame.Surface((16, 16))
+        surface.fill((255, 255, 255))
+        cache.renderBase(surface, -4, 0)
+        assert surface.get_at((1, 1)) == (0, 0, 0, 255)
@@ -0,0 +1,179 @@
+#
+# Tests for the struct-of-arrays map storage and its Tilestack views
+#
+
+import sys
+sys.path.append('../components')
+
+import pygame
+from tiles import TileGrid, GridTilestack, Tilestack, Tile, IrregularTile
+
+class FakeTileFactory:
+    "Tiles of one distinct color each, and a two slice irregular tile"
+
+    def __init__(self):
+        self.tiles = []
+        for i in xrange(8):
+            s = pygame.Surface((4, 4))
+            s.fill((i * 30, 0, 0))
+            self.tiles.append(s)
+        self.irregularTiles = {}
+        slices = []
+        for i in xrange(2):
+            s = pygame.Surface((4, 4))
+            s.fill((0, 100 + i, 0))
+            slices.append(s)
+        self.irregularTiles['hut'] = (None, slices)
+
+def makeCells(size):
+    ret = []
+    for i in xrange(size):
+        base = [(i % 8, None)] + ([(i % 2, "hut")] if i % 5 == 0 else [])
+        roof = [(j, None) for j in xrange(i % 4)]
+        ret.append((base, roof, i % 3 != 0, "trigger%d" % (i % 2) if i % 7 == 0 else None))
+    return ret
+
+class Test_TileGrid:
+
+    def setup_method(self, method):
+        self.factory = FakeTileFactory()
+        self.grid = TileGrid(self.factory, 6, 5)
+        self.changes = []
+        self.grid.onChange = self.changes.append
+
+    def test_load_cells_round_trip(self):
+        cells = makeCells(30)
+        self.grid.loadCells(cells)
+        assert list(self.grid.cells()) == cells
+        assert [self.grid.getCell(i) for i in xrange(30)] == cells
+        assert self.changes == []
+
+    def test_base_tile(self):
+        grid = TileGrid(self.factory, 3, 3, 5)
+        assert list(grid.cells()) == [([(5, None)], [], True, None)] * 9
+
+    def test_push_pop(self):
+        assert self.grid.push(4, 1)
+        assert not self.grid.push(4, 1)
+        # an irregular slice with the same tile index counts as the same tile
+        assert not self.grid.push(4, self.grid.encodeCell(1, "hut"))
+        assert self.grid.push(4, self.grid.encodeCell(0, "hut"))
+        assert self.grid.getCell(4)[0] == [(1, None), (0, "hut")]
+        self.grid.pop(4, keep=1)
+        self.grid.pop(4, keep=1)
+        assert self.grid.getCell(4)[0] == [(1, None)]
+        assert self.grid.getCell(3)[0] == []
+        assert self.changes == [4, 4, 4]
+
+    def test_set_cell_shrinks_layers(self):
+        self.grid.setCell(2, ([(1, None), (2, None), (3, None)], [(4, None)], False, "a"))
+        self.grid.setCell(2, ([(6, None)], [], True, None))
+        assert self.grid.getCell(2) == ([(6, None)], [], True, None)
+        assert [plane[2] for plane in self.grid.basePlanes] == [6, TileGrid.EMPTY, TileGrid.EMPTY]
+
+    def test_layer_limit(self):
+        self.grid.setLayer(0, range(255))
+        try: self.grid.push(0, 300)
+        except IndexError: pass
+        else: assert False
+        try: self.grid.setLayer(1, range(256))
+        except IndexError: pass
+        else: assert False
+        try: TileGrid(self.factory, 1, 1).loadCells([([(i, None) for i in xrange(256)], [], True, None)])
+        except IndexError: pass
+        else: assert False
+
+    def test_walkable_bits(self):
+        pattern = [i % 3 == 0 for i in xrange(30)]
+        for i, walkable in enumerate(pattern): self.grid.setWalkable(i, walkable)
+        assert [self.grid.isWalkable(i) for i in xrange(30)] == pattern
+        assert len(self.grid.walkable) == 4
+        # only actual changes are reported
+        del self.changes[:]
+        self.grid.setWalkable(0, True)
+        self.grid.setWalkable(1, True)
+        assert self.changes == [1]
+        assert [self.grid.isWalkable(i) for i in xrange(30)] == [True, True] + pattern[2:]
+
+    def test_trigger_interning(self):
+        self.grid.setTrigger(0, "door")
+        self.grid.setTrigger(7, "door")
+        self.grid.setTrigger(9, "chest")
+        assert self.grid.triggerNames == [None, "door", "chest"]
+        assert (self.grid.triggers[0], self.grid.triggers[7], self.grid.triggers[9]) == (1, 1, 2)
+        self.grid.setTrigger(7, None)
+        assert self.grid.getTrigger(7) is None and self.grid.getTrigger(0) == "door"
+        del self.changes[:]
+        self.grid.setTrigger(0, "door")
+        assert self.changes == []
+
+class Test_GridTilestack:
+
+    def setup_method(self, method):
+        self.factory = FakeTileFactory()
+        self.grid = TileGrid(self.factory, 4, 4, 0)
+
+    def stacks(self):
+        "A plain Tilestack and a view of the same starting cell"
+        plain = Tilestack()
+        plain.addBaseTile(Tile(self.factory, 0))
+        return plain, self.grid[5]
+
+    def apply(self, stack):
+        stack.addBaseTile(Tile(self.factory, 3))
+        stack.addBaseTile(Tile(self.factory, 3))
+        stack.addBaseTile(IrregularTile(self.factory, "hut", 1))
+        stack.addRoofTile(Tile(self.factory, 2))
+        stack.addRoofTile(IrregularTile(self.factory, "hut", 0))
+        stack.removeTopRoofTile()
+        stack.isWalkable = False
+        stack.triggerId = "door"
+
+    def test_matches_tilestack(self):
+        plain, view = self.stacks()
+        self.apply(plain)
+        self.apply(view)
+        assert view.toCell() == plain.toCell()
+        assert len(view) == len(plain)
+        assert [(type(t), t.tileIndex) for t in view.baseTiles] == [(type(t), t.tileIndex) for t in plain.baseTiles]
+        assert (view.isWalkable, view.triggerId) == (plain.isWalkable, plain.triggerId)
+
+        for s in (plain, view):
+            for i in xrange(5): s.removeTopBaseTile()
+            for i in xrange(5): s.removeTopRoofTile()
+        assert view.toCell() == plain.toCell() == ([(0, None)], [], False, "door")
+
+    def test_renders_like_tilestack(self):
+        plain, view = self.stacks()
+        self.apply(plain)
+        self.apply(view)
+        for render in ('renderBase', 'renderRoof'):
+            a, b = pygame.Surface((4, 4)), pygame.Surface((4, 4))
+            getattr(plain, render)(a, 0, 0)
+            getattr(view, render)(b, 0, 0)
+            assert a.get_at((1, 1)) == b.get_at((1, 1))
+
+    def test_assign_layers(self):
+        view = self.grid[2]
+        view.roofTiles = [Tile(self.factory, 4), IrregularTile(self.factory, "hut", 1)]
+        assert self.grid.getCell(2)[1] == [(4, None), (1, "hut")]
+        assert self.grid[3].roofTiles == []
+
+    def test_views(self):
+        assert self.grid[5] == self.grid[5] and hash(self.grid[5]) == hash(self.grid[5])
+        assert self.grid[5] != self.grid[6]
+        assert self.grid[-1] == self.grid[15]
+        assert isinstance(self.grid[0], GridTilestack)
+        try: self.grid[16]
+        except IndexError: pass
+        else: assert False
+        try: self.grid[0].onChange = lambda: None
+        except AttributeError: pass
+        else: assert False
+
+    def test_contents(self):
+        view = self.grid[1]
+        view.contents = ["bag"]
+        assert self.grid[1].contents == ["bag"] and self.grid[2].contents is None
+        view.contents = None
+        assert self.grid.contents == {}
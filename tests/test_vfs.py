@@ -0,0 +1,64 @@
+#
+# Tests for the virtual filesystem over the data zips
+#
+
+import sys
+sys.path.append('../components')
+
+import os
+import shutil
+import tempfile
+import time
+import vfs
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+
+class Test_Vfs:
+
+    def setup_method(self, method):
+        self.tmp = tempfile.mkdtemp()
+        self.zip = os.path.join(self.tmp, 'things.zip')
+        self.write({'default/staff/staff.py': ('name = "Staff"\n' * 20, ZIP_DEFLATED),
+                    'default/staff/staff.png': ('\x89PNG not really', ZIP_STORED),
+                    'other/rock/rock.py': ('name = "Rock"\n', ZIP_DEFLATED)})
+
+    def teardown_method(self, method):
+        vfs.unmountAll()
+        shutil.rmtree(self.tmp)
+
+    def write(self, members):
+        # replaced rather than rewritten in place, like DatasetBuilder does
+        z = ZipFile(self.zip + '.tmp', 'w')
+        for name, (data, compression) in sorted(members.items()): z.writestr(name, data, compression)
+        z.close()
+        os.rename(self.zip + '.tmp', self.zip)
+
+    def test_index(self):
+        archive = vfs.mount(self.zip)
+        assert sorted(archive.sets) == ['default/staff', 'other/rock']
+        assert sorted(archive.itemsets) == ['default', 'other']
+        assert sorted(archive.itemsets['default']['staff']) == ['default/staff/staff.png', 'default/staff/staff.py']
+        assert len(archive.namelist()) == 3
+
+    def test_reads_match_zipfile(self):
+        archive = vfs.mount(self.zip)
+        z = ZipFile(self.zip)
+        for name in z.namelist():
+            assert archive.read(name) == z.read(name)
+            assert archive.open(name).read() == z.read(name)
+        z.close()
+
+    def test_stored_members_are_not_copied(self):
+        archive = vfs.mount(self.zip)
+        assert isinstance(archive.view('default/staff/staff.png'), buffer)
+        assert isinstance(archive.view('default/staff/staff.py'), str)
+
+    def test_mounted_once(self):
+        assert vfs.mount(self.zip) is vfs.mount(self.zip)
+
+    def test_remounted_when_changed(self):
+        archive = vfs.mount(self.zip)
+        self.write({'new/thing/thing.py': ('x = 1\n', ZIP_DEFLATED)})
+        os.utime(self.zip, (time.time() + 10, time.time() + 10))
+        remounted = vfs.mount(self.zip)
+        assert remounted is not archive
+        assert remounted.namelist() == ['new/thing/thing.py']